@@ -0,0 +1,161 @@
+"""Append-only activity feed for each board.
+
+Every change a member makes to a board or its tasks adds one event to the
+board's ``activity`` subcollection. Storage methods that change a board or
+a task take the event as their ``event`` argument and write it in the same
+batch (or SQLite transaction) as the change, so the feed costs no extra
+round trip and never shows a change that didn't happen. Dragging a task to
+a new position isn't recorded.
+
+A busy board writes an event per change, so events use short keys:
+
+    t    event type, one of the codes below
+    a    id of the member who made the change, None for tasks added by recurring.py
+    k    task id, for task events
+    n    task title (or member email) at the time, so the feed renders
+         without reading tasks that may since have been deleted
+    m    member the event is about: the new assignee or the member added or removed
+    f    codes of the task fields that were edited, see FIELD_CODES
+    c    number of tasks, for imports, scheduled recurring tasks and members
+         removed from their tasks
+    at   when the change was made
+    exp  when the event may be deleted
+
+Events are kept for TASK_ACTIVITY_RETENTION_DAYS. On Firestore the TTL
+policy on ``exp`` in firestore.indexes.json removes them; the local backends
+have no TTL, so purge.py deletes expired events there. TTL deletion can run
+a day or more late, so the feed leaves out expired events itself.
+"""
+import datetime
+import os
+
+from storage import SERVER_TIMESTAMP
+
+
+RETENTION = datetime.timedelta(days=int(os.environ.get('TASK_ACTIVITY_RETENTION_DAYS', '90')))
+
+# Titles are cut to this length in events
+TITLE_LIMIT = 80
+
+TASK_CREATED = 'tc'
+TASK_EDITED = 'te'
+TASK_ASSIGNED = 'ta'
+TASK_UNASSIGNED = 'tu'
+TASK_COMPLETED = 'tx'
+TASK_DELETED = 'td'
+TASK_RESTORED = 'tr'
+TASKS_IMPORTED = 'ti'
+MEMBER_ADDED = 'ma'
+MEMBER_REMOVED = 'mr'
+BOARD_EDITED = 'be'
+BOARD_DELETED = 'bd'
+BOARD_RESTORED = 'br'
+RECURRING_ADDED = 'ra'
+RECURRING_REMOVED = 'rx'
+TASKS_SCHEDULED = 'ts'
+
+FIELD_CODES = {'title': 't', 'description': 'd', 'due_date': 'u'}
+FIELD_NAMES = {'t': 'title', 'd': 'description', 'u': 'due date'}
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def event(kind, actor, task_id=None, name=None, member_id=None, fields=None, count=None, now=None):
+    """A compact event for ``kind``, made by ``actor``, to pass to a storage method."""
+    record = {'t': kind, 'a': actor, 'at': SERVER_TIMESTAMP, 'exp': (now or _now()) + RETENTION}
+    if task_id is not None:
+        record['k'] = task_id
+    if name is not None:
+        record['n'] = name[:TITLE_LIMIT]
+    if member_id is not None:
+        record['m'] = member_id
+    if fields:
+        record['f'] = ''.join(fields)
+    if count is not None:
+        record['c'] = count
+    return record
+
+
+def edited_fields(task, update):
+    """Codes of the fields ``update`` changes on ``task``."""
+    return [code for field, code in FIELD_CODES.items()
+            if field in update and (task.get(field) or None) != (update[field] or None)]
+
+
+def task_edit_event(actor, task_id, task, update):
+    """The event for an edit, None when it changes nothing.
+
+    A change of assignee is reported as a (re)assignment, any other fields
+    edited at the same time are listed with it.
+    """
+    fields = edited_fields(task, update)
+    old_assignees = task.get('assigned_users') or []
+    new_assignees = update.get('assigned_users', old_assignees) or []
+    title = update.get('title') or task.get('title')
+    if set(new_assignees) != set(old_assignees):
+        if new_assignees:
+            return event(TASK_ASSIGNED, actor, task_id, title, member_id=new_assignees[0], fields=fields)
+        return event(TASK_UNASSIGNED, actor, task_id, title, fields=fields)
+    if fields:
+        return event(TASK_EDITED, actor, task_id, title, fields=fields)
+    return None
+
+
+def member_names(records, member_emails):
+    """Emails by member id for describing ``records``.
+
+    Former members are only in the board's ``member_emails`` while they are
+    members, so the emails recorded when they were added or removed fill in.
+    """
+    names = {record['m']: record['n'] for record in records
+             if record['t'] in (MEMBER_ADDED, MEMBER_REMOVED) and 'm' in record and 'n' in record}
+    names.update(member_emails)
+    return names
+
+
+def describe(record, names):
+    """One line of text for an event, ``names`` maps member ids to emails."""
+    actor = names.get(record.get('a'), 'A former member')
+    title = f'"{record.get("n", "")}"'
+    member = names.get(record.get('m')) or record.get('n') or 'someone'
+    edited = ', '.join(FIELD_NAMES[code] for code in record.get('f', ''))
+    kind = record['t']
+    if kind == TASK_CREATED:
+        return f"{actor} created {title}"
+    if kind == TASK_EDITED:
+        return f"{actor} edited the {edited} of {title}"
+    if kind in (TASK_ASSIGNED, TASK_UNASSIGNED):
+        member = names.get(record.get('m'), 'a former member')
+        text = f"{actor} assigned {title} to {member}" if kind == TASK_ASSIGNED else f"{actor} unassigned {title}"
+        return f"{text} and edited its {edited}" if edited else text
+    if kind == TASK_COMPLETED:
+        return f"{actor} completed {title}"
+    if kind == TASK_DELETED:
+        return f"{actor} deleted {title}"
+    if kind == TASK_RESTORED:
+        return f"{actor} restored {title}"
+    if kind == TASKS_IMPORTED:
+        return f"{actor} imported {record.get('c', 0)} tasks"
+    if kind == MEMBER_ADDED:
+        return f"{actor} added {member}"
+    if kind == MEMBER_REMOVED:
+        count = record.get('c', 0)
+        text = f"{actor} removed {member}"
+        return f"{text}, unassigning {count} task{'s' if count != 1 else ''}" if count else text
+    if kind == BOARD_EDITED:
+        return f"{actor} edited the board"
+    if kind == BOARD_DELETED:
+        return f"{actor} deleted the board"
+    if kind == BOARD_RESTORED:
+        return f"{actor} restored the board"
+    if kind == RECURRING_ADDED:
+        return f"{actor} added the recurring task {title}"
+    if kind == RECURRING_REMOVED:
+        return f"{actor} removed the recurring task {title}"
+    if kind == TASKS_SCHEDULED:
+        # added by recurring.py rather than a member
+        count = record.get('c', 0)
+        return f"{count} recurring task{'s were' if count != 1 else ' was'} added"
+    return f"{actor} changed the board"
@@ -0,0 +1,155 @@
+"""Admission control for the routes that write.
+
+Every write request is classified by route (tasks, members, boards, imports)
+and charged to a token bucket keyed by the user and that class; an empty
+bucket answers 429 with a Retry-After telling the client when a token will
+be available. On top of that a global limit on concurrent write requests
+sheds load with 503 before the backend saturates.
+
+Buckets live in process memory by default. Setting TASK_RATE_LIMIT_PATH
+keeps them in a SQLite file instead so every worker on the host draws from
+the same buckets.
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+
+
+# capacity (burst) and refill rate in tokens per second for each route class
+RATE_LIMITS = {
+    'task': (60, 2.0),
+    'member': (20, 0.5),
+    'board': (10, 0.2),
+    'import': (3, 0.02),
+}
+
+# "task=60:2,import=1:0.01" overrides the defaults above
+for _entry in filter(None, os.environ.get('TASK_RATE_LIMITS', '').split(',')):
+    _name, _, _limit = _entry.partition('=')
+    _capacity, _, _rate = _limit.partition(':')
+    RATE_LIMITS[_name.strip()] = (float(_capacity), float(_rate))
+
+# TASK_RATE_LIMIT=0 turns the per-user buckets off (the benchmark does), the concurrency limit stays
+RATE_LIMIT_ENABLED = os.environ.get('TASK_RATE_LIMIT', '1') != '0'
+MAX_CONCURRENT_WRITES = int(os.environ.get('TASK_MAX_CONCURRENT_WRITES', '64'))
+SHED_RETRY_AFTER = int(os.environ.get('TASK_SHED_RETRY_AFTER', '1'))
+BUCKET_PATH = os.environ.get('TASK_RATE_LIMIT_PATH', '')
+
+# Buckets kept by the in-process store, oldest are dropped first (a full bucket is the same as none)
+MAX_LOCAL_BUCKETS = 100000
+
+_ROUTE_CLASSES = [
+    (re.compile(r'^/board/[^/]+/create-task$'), 'task'),
+    (re.compile(r'^/board/[^/]+/task/[^/]+/(complete|edit|delete|restore)$'), 'task'),
+    (re.compile(r'^/api/board/[^/]+/task/[^/]+/move$'), 'task'),
+    (re.compile(r'^/board/[^/]+/recurring(/[^/]+/delete)?$'), 'task'),
+    (re.compile(r'^/board/[^/]+/(add-member|remove-member/[^/]+)$'), 'member'),
+    (re.compile(r'^/(create-board|board/[^/]+/(edit|delete|restore))$'), 'board'),
+    (re.compile(r'^/api/board/[^/]+/import$'), 'import'),
+]
+
+
+def route_class(method, path):
+    """The rate limit class of a request, None for requests that aren't limited."""
+    if method != 'POST':
+        return None
+    for pattern, name in _ROUTE_CLASSES:
+        if pattern.match(path):
+            return name
+    return None
+
+
+def _refill(tokens, updated, now, capacity, rate):
+    return min(capacity, tokens + (now - updated) * rate)
+
+
+class LocalBuckets:
+    """Token buckets for a single process."""
+
+    def __init__(self, max_buckets=MAX_LOCAL_BUCKETS):
+        self._lock = threading.Lock()
+        self._buckets = {}
+        self.max_buckets = max_buckets
+
+    def take(self, key, capacity, rate, now=None):
+        """Take a token, returns 0 on success or the seconds until one is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (capacity, now))
+            tokens = _refill(tokens, updated, now, capacity, rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            if len(self._buckets) >= self.max_buckets:
+                self._buckets.pop(next(iter(self._buckets)))
+            # re-inserted so the dict stays ordered by last use
+            self._buckets[key] = (tokens, now)
+        return 0 if allowed else (1 - tokens) / rate
+
+
+class SQLiteBuckets:
+    """Token buckets in a SQLite file shared by every worker process on the host."""
+
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS buckets '
+                           '(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)')
+
+    def take(self, key, capacity, rate, now=None):
+        # wall clock time, monotonic clocks aren't comparable across processes
+        now = time.time() if now is None else now
+        with self._lock:
+            # IMMEDIATE takes the write lock up front so two workers can't spend the same token
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self._conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens = _refill(*(row or (capacity, now)), now, capacity, rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self._conn.execute('INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                                   (key, tokens, now))
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return 0 if allowed else (1 - tokens) / rate
+
+
+class ConcurrencyLimiter:
+    """Caps the number of write requests being handled at once in this process."""
+
+    def __init__(self, limit=MAX_CONCURRENT_WRITES):
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self):
+        # only called from the event loop thread, so no lock is needed
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+
+
+buckets = SQLiteBuckets(BUCKET_PATH) if BUCKET_PATH else LocalBuckets()
+write_limiter = ConcurrencyLimiter()
+
+
+def check_rate(user_key, name):
+    """Seconds the caller has to wait before making a request of class ``name``, 0 if it may go ahead."""
+    if not RATE_LIMIT_ENABLED:
+        return 0
+    capacity, rate = RATE_LIMITS[name]
+    return buckets.take(f"{name}:{user_key}", capacity, rate)
+
+
+def retry_after(wait):
+    return str(max(1, math.ceil(wait)))
@@ -0,0 +1,52 @@
+"""Scheduled job that moves old completed tasks out of hot boards.
+
+Tasks completed more than ``--days`` days ago are moved from
+``task_boards/{id}/tasks`` to ``task_boards/{id}/archived_tasks`` in batches.
+The board's ``archived_count`` keeps the counters on the board page whole.
+Meant to be run periodically, e.g. from cron or Cloud Scheduler:
+
+    python archive.py --days 30
+"""
+import argparse
+import datetime
+
+import search
+
+
+def archive_board(store, board_id, cutoff, batch_size=200):
+    archived = 0
+    cursor = None
+    while True:
+        tasks, cursor = store.list_completed_before(board_id, cutoff, batch_size, cursor)
+        if tasks:
+            archived += store.archive_tasks(board_id, tasks)
+        # archived tasks drop out of search results
+        for task in tasks:
+            search.index_task(store, board_id, task['id'], task, None)
+        # a page thinned out by soft deleted tasks doesn't end the board, a short one does
+        if cursor is None:
+            return archived
+
+
+def archive_completed_tasks(store, days, batch_size=200, board_chunk_size=100):
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(days=days)
+    total = 0
+    cursor = None
+    while True:
+        boards, cursor = store.list_boards(board_chunk_size, cursor)
+        for board in boards:
+            total += archive_board(store, board['id'], cutoff, batch_size)
+        if cursor is None:
+            return total
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Archive tasks completed more than N days ago")
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--batch-size', type=int, default=200, help="tasks moved per batch")
+    parser.add_argument('--board-chunk-size', type=int, default=100, help="boards read per page")
+    args = parser.parse_args()
+
+    from storage import get_storage
+    archived = archive_completed_tasks(get_storage(), args.days, args.batch_size, args.board_chunk_size)
+    print(f"Archived {archived} tasks")
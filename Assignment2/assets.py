@@ -0,0 +1,57 @@
+"""Fingerprinted static files and the service worker that caches them.
+
+Pages link to static files with ``asset_url('/forms.js')``, which adds
+``?v=ASSET_VERSION``, a hash of everything under static/. A deploy that
+changes any file changes every link, so fingerprinted requests are served
+with a year long immutable Cache-Control and browsers never revalidate them.
+
+static/sw.js is the service worker (see the comment at its top). It is
+registered with the same fingerprint so a deploy installs a fresh copy, and
+is served with ``Service-Worker-Allowed: /`` so it can control the whole
+site from under /static.
+"""
+import hashlib
+import os
+
+from fastapi.staticfiles import StaticFiles
+
+
+STATIC_DIR = 'static'
+SERVICE_WORKER = 'sw.js'
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def _version(directory):
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            digest.update(os.path.relpath(path, directory).encode())
+            with open(path, 'rb') as f:
+                digest.update(f.read())
+    return digest.hexdigest()[:12]
+
+
+ASSET_VERSION = _version(STATIC_DIR)
+
+
+def asset_url(path):
+    return f"/static{path}?v={ASSET_VERSION}"
+
+
+class AssetFiles(StaticFiles):
+    """StaticFiles with the caching headers described above."""
+
+    async def get_response(self, path, scope):
+        response = await super().get_response(path, scope)
+        if response.status_code != 200:
+            return response
+        if path == SERVICE_WORKER:
+            # browsers check for a new worker on navigation, it must never come from the HTTP cache
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['Service-Worker-Allowed'] = '/'
+        elif f"v={ASSET_VERSION}".encode() in scope.get('query_string', b'').split(b'&'):
+            response.headers['Cache-Control'] = IMMUTABLE
+        return response
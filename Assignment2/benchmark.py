@@ -0,0 +1,250 @@
+"""Route-level benchmarks against synthetic boards.
+
+Seeds users, boards and tasks into a local backend (or the Firestore
+emulator when FIRESTORE_EMULATOR_HOST is set and --backend firestore is
+used), drives the routes through an ASGI client and reports latency
+percentiles, throughput and backend call counts.
+
+    python benchmark.py --tasks 10,1000 --members 1,100 --output baseline.json
+    python benchmark.py --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import Counter
+
+
+OP_HEADERS = {
+    'reads': 'X-Backend-Reads',
+    'writes': 'X-Backend-Writes',
+    'queries': 'X-Backend-Queries',
+    'documents': 'X-Backend-Documents'
+}
+
+
+BENCH_USER = {'user_id': 'bench_owner', 'email': 'owner@bench.local'}
+BENCH_TOKEN = 'bench-token'
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def member_id(index):
+    return f"bench_member_{index:05d}"
+
+
+def seed_board(store, task_count, member_count, title="Bench board"):
+    import ranking
+    from storage import SERVER_TIMESTAMP
+
+    members = [BENCH_USER['user_id']] + [member_id(i) for i in range(1, member_count)]
+    board_id = store.create_board({
+        'title': title,
+        'description': f"{task_count} tasks, {member_count} members",
+        'creator_id': BENCH_USER['user_id'],
+        'members': members,
+        'member_emails': {m: f"{m}@bench.local" for m in members},
+        'ranked': True,
+        'created_at': SERVER_TIMESTAMP
+    })
+    ranks = ranking.spaced_keys(task_count)
+    for i in range(task_count):
+        completed = i % 3 == 0
+        store.create_task(board_id, {
+            'title': f"Task {i}",
+            'description': f"Synthetic task number {i}",
+            'creator_id': BENCH_USER['user_id'],
+            'assigned_users': [members[i % len(members)]],
+            'status': 'completed' if completed else 'pending',
+            'created_at': SERVER_TIMESTAMP,
+            'due_date': '2030-01-01',
+            'completed_at': SERVER_TIMESTAMP if completed else None,
+            'rank': ranks[i]
+        })
+    return board_id
+
+
+def seed_users(store, member_count):
+    store.set_user(BENCH_USER['user_id'], {'email': BENCH_USER['email']})
+    for i in range(1, member_count):
+        store.set_user(member_id(i), {'email': f"{member_id(i)}@bench.local"})
+
+
+async def timed(client, method, url, **kwargs):
+    start = time.perf_counter()
+    response = await client.request(method, url, **kwargs)
+    elapsed = time.perf_counter() - start
+    if response.status_code >= 400:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    ops = Counter({op: int(response.headers.get(header, 0)) for op, header in OP_HEADERS.items()})
+    return elapsed, ops
+
+
+def summarize(name, samples, ops, wall_time):
+    count = len(samples)
+    return {
+        'scenario': name,
+        'requests': count,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'throughput_rps': count / wall_time if wall_time else 0.0,
+        'backend_ops_per_request': {op: ops[op] / count for op in OP_HEADERS} if count else {}
+    }
+
+
+async def run_scenario(name, make_request, iterations, prepare=None):
+    samples = []
+    ops = Counter()
+    wall_time = 0.0
+    for _ in range(iterations):
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        elapsed, request_ops = await make_request()
+        wall_time += time.perf_counter() - start
+        samples.append(elapsed)
+        ops.update(request_ops)
+    return summarize(name, samples, ops, wall_time)
+
+
+async def run_benchmarks(args):
+    import httpx
+    import main
+
+    # seed through the raw backend so setup is not counted against the routes
+    inner = main.store.inner
+    main.verify_token = lambda id_token: dict(BENCH_USER) if id_token == BENCH_TOKEN else _reject(id_token)
+
+    seed_users(inner, max(args.members))
+    for i in range(args.boards):
+        seed_board(inner, 0, 1, title=f"Dashboard board {i}")
+
+    results = []
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench',
+                                 cookies={'token': BENCH_TOKEN}) as client:
+        results.append(await run_scenario(
+            f"root boards={args.boards}",
+            lambda: timed(client, 'GET', '/'), args.iterations))
+
+        for task_count in args.tasks:
+            for member_count in args.members:
+                label = f"tasks={task_count} members={member_count}"
+                board_id = seed_board(inner, task_count, member_count)
+
+                results.append(await run_scenario(
+                    f"view_board {label}",
+                    lambda: timed(client, 'GET', f"/board/{board_id}"), args.iterations))
+
+                if member_count > 1:
+                    victim = member_id(member_count - 1)
+
+                    def restore_member():
+                        inner.add_member(board_id, victim, f"{victim}@bench.local")
+                        for task in inner.list_tasks(board_id):
+                            if task.get('previously_assigned_to') == victim:
+                                inner.update_task(board_id, task['id'], {
+                                    'assigned_users': [victim], 'unassigned': False})
+
+                    results.append(await run_scenario(
+                        f"remove_member {label}",
+                        lambda: timed(client, 'POST', f"/board/{board_id}/remove-member/{victim}"),
+                        args.iterations, prepare=restore_member))
+
+                pending = []
+
+                def fresh_board():
+                    pending.append(seed_board(inner, task_count, member_count))
+
+                results.append(await run_scenario(
+                    f"delete_board_submit {label}",
+                    lambda: timed(client, 'POST', f"/board/{pending.pop()}/delete", data={'force': 'true'}),
+                    args.delete_iterations, prepare=fresh_board))
+
+                inner.delete_board(board_id)
+
+    return results
+
+
+def _reject(id_token):
+    raise ValueError("Unknown benchmark token")
+
+
+def compare(results, baseline, threshold):
+    previous = {r['scenario']: r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get(result['scenario'])
+        if before is None:
+            print(f"{result['scenario']:<55} (new)")
+            continue
+        change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        print(f"{result['scenario']:<55} p95 {before['p95_ms']:9.2f} -> {result['p95_ms']:9.2f} ms ({change:+.0%})")
+        if change > threshold:
+            regressions.append(result['scenario'])
+    return regressions
+
+
+def print_results(results):
+    print(f"{'scenario':<55} {'p50':>9} {'p95':>9} {'p99':>9} {'req/s':>9}  backend ops/request")
+    for r in results:
+        ops = ', '.join(f"{op}={n:g}" for op, n in r['backend_ops_per_request'].items())
+        print(f"{r['scenario']:<55} {r['p50_ms']:9.2f} {r['p95_ms']:9.2f} {r['p99_ms']:9.2f} "
+              f"{r['throughput_rps']:9.1f}  {ops}")
+
+
+def parse_sizes(value):
+    return [int(v) for v in value.split(',') if v]
+
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='memory', choices=['memory', 'sqlite', 'firestore'])
+    parser.add_argument('--tasks', type=parse_sizes, default=[10, 1000, 50000])
+    parser.add_argument('--members', type=parse_sizes, default=[1, 100, 1000])
+    parser.add_argument('--boards', type=int, default=50, help="boards on the dashboard user")
+    parser.add_argument('--iterations', type=int, default=20)
+    parser.add_argument('--delete-iterations', type=int, default=3)
+    parser.add_argument('--output', help="write results as a JSON baseline")
+    parser.add_argument('--compare', help="baseline JSON to compare against")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fail when p95 regresses by more than this fraction")
+    args = parser.parse_args(argv)
+
+    # main.py expects to be imported from its own directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    sys.path.insert(0, os.getcwd())
+    os.environ['TASK_STORAGE'] = args.backend
+    # measure the routes themselves, not the per-user rate limits
+    os.environ.setdefault('TASK_RATE_LIMIT', '0')
+    if args.backend == 'sqlite':
+        os.environ.setdefault('TASK_SQLITE_PATH', 'benchmark.db')
+
+    results = asyncio.run(run_benchmarks(args))
+    print_results(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'backend': args.backend, 'created_at': time.time(), 'results': results}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"p95 regressions over {args.threshold:.0%}: {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main_cli())
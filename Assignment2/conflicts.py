@@ -0,0 +1,70 @@
+"""Optimistic concurrency for the task and board edit forms.
+
+An edit form carries two hidden fields from the read that rendered it:
+``version``, the document's version token (see storage.Storage), and
+``base``, a digest of the fields the form edits. The update is written with
+the version as a precondition, so a change made in the meantime makes it
+fail instead of being silently overwritten, at no extra read.
+
+When that happens the document is read again. If the fields the form edits
+still match ``base``, the other change was to something else (a completion,
+a counter, the member list) and the update is written again against the new
+version. Otherwise the route shows the conflict page: the edit form filled in
+with what the user submitted, next to the values now stored, carrying the
+new version so that saving again keeps the user's values.
+"""
+import hashlib
+import json
+
+from storage import DocumentDeleted, VersionConflict
+
+
+TASK_FIELDS = ('title', 'description', 'due_date', 'assigned_users')
+BOARD_FIELDS = ('title', 'description')
+
+# A document changing underneath this many merges in a row is shown as a conflict
+MERGE_ATTEMPTS = 3
+
+CONFLICT_MESSAGE = "Someone else changed this while you were editing."
+DELETED_MESSAGE = "This was deleted while you were editing, your changes were not saved."
+
+
+def _normalized(value):
+    # an empty form field is stored as '' or None depending on where it came from
+    return value or None
+
+
+def base(doc, fields):
+    """Digest of the values of ``fields`` in ``doc``."""
+    values = [_normalized(doc.get(field)) for field in fields]
+    return hashlib.sha256(json.dumps(values, default=str).encode()).hexdigest()[:20]
+
+
+def save(update, reread, fields, version, form_base):
+    """Write with ``update(version)``, merging over changes to other fields.
+
+    Returns ``(new_version, None)`` once written, or ``(None, current)`` when
+    the edited fields changed underneath; ``current`` is the document as read
+    again with its version, None if it is gone. Forms without a version
+    (rendered before versions existed) are written unconditionally.
+    """
+    # the hidden fields are empty on forms rendered without a version
+    version = version or None
+    current = None
+    for _ in range(MERGE_ATTEMPTS):
+        try:
+            return update(version), None
+        except DocumentDeleted:
+            return None, None
+        except VersionConflict:
+            current = reread()
+            if current is None or base(current, fields) != form_base:
+                return None, current
+            version = current['version']
+    return None, current
+
+
+def differences(current, submitted, fields):
+    """``(field, stored, submitted)`` for each field the two disagree on, in form order."""
+    return [(field, current.get(field), submitted.get(field)) for field in fields
+            if _normalized(current.get(field)) != _normalized(submitted.get(field))]
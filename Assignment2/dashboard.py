@@ -0,0 +1,154 @@
+"""Per-user dashboard summaries.
+
+Each user has one summary document listing the boards they belong to and
+their role on each, so the dashboard finds its boards with a single read
+instead of array-contains queries. Titles, descriptions and task counts stay
+on the boards and are read with one batched read of just those fields, so
+editing a board or changing its tasks writes the board alone, never an entry
+per member. The routes call the functions here when a board's membership
+changes.
+"""
+import logging
+
+from storage import VersionConflict
+
+logger = logging.getLogger(__name__)
+
+DESCRIPTION_SNIPPET_LENGTH = 120
+
+# the fields of each board the dashboard shows, member_emails is left behind
+BOARD_FIELDS = ['title', 'description', 'creator_id', 'members', 'created_at',
+                'task_count', 'completed_count', 'archived_count']
+
+
+def _count_tasks(store, board):
+    tasks = store.list_tasks(board['id'])
+    # archived tasks are completed ones moved out of the board
+    archived_count = board.get('archived_count', 0)
+    task_count = len(tasks) + archived_count
+    completed_count = sum(1 for task in tasks if task.get('status') == 'completed') + archived_count
+    return task_count, completed_count
+
+
+def _has_counts(board):
+    return 'task_count' in board and 'completed_count' in board
+
+
+def save_counts(store, board_id, task_count, completed_count):
+    store.update_board(board_id, {'task_count': task_count, 'completed_count': completed_count})
+
+
+def _role(board, member_id):
+    return 'creator' if board.get('creator_id') == member_id else 'member'
+
+
+def board_summary(board, role, task_count, completed_count):
+    description = board.get('description') or ''
+    if len(description) > DESCRIPTION_SNIPPET_LENGTH:
+        description = description[:DESCRIPTION_SNIPPET_LENGTH].rstrip() + '...'
+    return {
+        'title': board.get('title', ''),
+        'description': description,
+        'role': role,
+        'member_count': len(board.get('members', [])),
+        'task_count': task_count,
+        'completed_count': completed_count,
+        'created_at': board.get('created_at')
+    }
+
+
+def members_changed(store, board, added=(), removed=()):
+    """Add the board to the ``added`` members' summaries and drop it from the ``removed`` ones'."""
+    entries = [(member_id, board['id'], {'role': _role(board, member_id)}) for member_id in added]
+    entries += [(member_id, board['id'], None) for member_id in removed]
+    store.set_dashboard_entries(entries)
+
+
+def board_deleted(store, board):
+    """Drop a purged board from its members' summaries; soft deleted boards are skipped when read."""
+    members_changed(store, board, removed=board.get('members', []))
+
+
+def member_replaced(store, board, old_member_id, new_member_id):
+    members_changed(store, board, added=[new_member_id], removed=[old_member_id])
+
+
+def tasks_changed(store, board, total=0, completed=0):
+    deltas = {}
+    if total:
+        deltas['task_count'] = total
+    if completed:
+        deltas['completed_count'] = completed
+    if deltas:
+        store.increment_task_counts(board['id'], deltas)
+
+
+def _summaries(store, roles, boards):
+    """Summaries of ``boards`` and the counters worked out for those created before they existed."""
+    summaries = {}
+    counts = {}
+    for board in boards:
+        if _has_counts(board):
+            task_count, completed_count = board['task_count'], board['completed_count']
+        else:
+            task_count, completed_count = counts[board['id']] = _count_tasks(store, board)
+        summaries[board['id']] = board_summary(board, roles[board['id']], task_count, completed_count)
+    return summaries, counts
+
+
+def build_dashboard(store, member_ids):
+    """Entries and summaries for every board any of ``member_ids`` belongs to, found by querying the boards.
+
+    Returns ``(entries, summaries, counts)``, where ``counts`` holds the counters worked
+    out for boards created before they existed, for save_built to store. Nothing is written here.
+    """
+    roles = {}
+    boards = []
+    for member_id in member_ids:
+        for board in store.list_member_boards(member_id, BOARD_FIELDS):
+            if board['id'] not in roles:
+                roles[board['id']] = _role(board, member_id)
+                boards.append(board)
+    summaries, counts = _summaries(store, roles, boards)
+    return {board_id: {'role': role} for board_id, role in roles.items()}, summaries, counts
+
+
+def save_built(store, user_id, built):
+    """Store what load_dashboard worked out, after the response that rendered it.
+
+    A summary that changed since it was read, e.g. a board joined meanwhile, is
+    left as it is; the next load builds it again.
+    """
+    entries, counts, version = built
+    for board_id, (task_count, completed_count) in counts.items():
+        save_counts(store, board_id, task_count, completed_count)
+    if entries is None:
+        return
+    try:
+        store.save_dashboard(user_id, entries, version)
+    except VersionConflict:
+        logger.info("Dashboard of %s changed while it was built, not saved", user_id)
+
+
+def load_dashboard(store, user_id, temp_user_id):
+    """The user's board summaries, and what to pass to save_built when something is left to store.
+
+    The first load builds the entries by querying the boards; the caller saves
+    them off the request path so rendering the dashboard never writes. The
+    second value is None when there is nothing to save.
+    """
+    dashboard = store.get_dashboard(user_id)
+    if dashboard is None or not dashboard['complete']:
+        entries, summaries, counts = build_dashboard(store, [user_id, temp_user_id])
+        version = dashboard['version'] if dashboard is not None else None
+        return summaries, (entries, counts, version)
+
+    roles = {board_id: entry.get('role', 'member') for board_id, entry in dashboard['boards'].items()}
+    # boards the user was invited to by email before signing up
+    pending = store.get_dashboard(temp_user_id)
+    for board_id, entry in (pending['boards'] if pending else {}).items():
+        roles.setdefault(board_id, entry.get('role', 'member'))
+    # deleted boards come back as None and are left out until they are restored or purged
+    boards = [board for board in store.get_boards(list(roles), BOARD_FIELDS) if board is not None]
+    summaries, counts = _summaries(store, roles, boards)
+    return summaries, ((None, counts, None) if counts else None)
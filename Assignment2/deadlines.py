@@ -0,0 +1,177 @@
+"""Per-request deadlines, timeouts and retries for backend calls.
+
+Every request starts with a time budget picked by its route class: the
+admission.py classes for writes, ``read`` for pages and API reads and
+``export`` for the streamed export. Every backend call made while handling
+it gets what is left: Firestore RPCs as their timeout, the local backends
+while waiting for their lock, and the certificate fetch in verify_token as
+its HTTP timeout. Once the budget is spent, calls fail fast with
+DeadlineExceeded and the app answers 504. The request gives up its slot
+instead of holding it after the client has stopped waiting.
+
+Reads (``get_``/``list_``/``find_``, see instrumentation.classify) are
+retried on transient backend errors with exponential backoff and full
+jitter, never past the deadline. Writes are never retried here: a write
+that timed out may still have been applied.
+
+TASK_HEDGE_AFTER_MS turns on hedged board reads. If a read hasn't answered
+within that many milliseconds, a second identical read is sent and the
+first answer wins. Scripts and jobs run without a request deadline, so
+their calls use DEFAULT_TIMEOUT.
+
+    TASK_DEADLINES="read=5,task=5,import=120"
+"""
+import concurrent.futures
+import contextvars
+import os
+import random
+import re
+import sqlite3
+import time
+
+from google.api_core import exceptions as api_exceptions
+
+import metrics
+
+
+# seconds each route class may take, overridden by TASK_DEADLINES
+BUDGETS = {
+    'read': 10.0,
+    'export': 300.0,
+    'task': 10.0,
+    'member': 10.0,
+    'board': 15.0,
+    'import': 120.0,
+    'write': 10.0,
+}
+
+for _entry in filter(None, os.environ.get('TASK_DEADLINES', '').split(',')):
+    _name, _, _seconds = _entry.partition('=')
+    BUDGETS[_name.strip()] = float(_seconds)
+
+# Calls made outside a request (scripts, scheduled jobs) get this timeout
+DEFAULT_TIMEOUT = float(os.environ.get('TASK_BACKEND_TIMEOUT', '30'))
+
+# Reads are tried this many times in all, sleeping a random time up to
+# RETRY_BASE_DELAY * 2 ** attempt (capped at RETRY_MAX_DELAY) in between
+RETRY_ATTEMPTS = int(os.environ.get('TASK_READ_ATTEMPTS', '3'))
+RETRY_BASE_DELAY = 0.05
+RETRY_MAX_DELAY = 1.0
+
+HEDGE_AFTER = float(os.environ.get('TASK_HEDGE_AFTER_MS', '0')) / 1000
+HEDGE_WORKERS = 8
+
+TRANSIENT_ERRORS = (
+    api_exceptions.ServiceUnavailable,
+    api_exceptions.InternalServerError,
+    api_exceptions.DeadlineExceeded,
+    api_exceptions.TooManyRequests,
+    api_exceptions.Aborted,
+)
+
+_LONG_READS = [(re.compile(r'^/board/[^/]+/export$'), 'export')]
+
+
+def _transient(err):
+    if isinstance(err, sqlite3.OperationalError):
+        # "database is locked" while another process writes, anything else is a bug
+        return 'locked' in str(err)
+    return isinstance(err, TRANSIENT_ERRORS)
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out before a backend call could finish."""
+
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+# threads are only started once a hedged read needs them
+_hedge_pool = concurrent.futures.ThreadPoolExecutor(HEDGE_WORKERS, thread_name_prefix='hedge')
+
+
+def route_class(method, path, write_class=None):
+    """The budget class of a request, ``write_class`` is its admission.py class if any."""
+    if write_class is not None:
+        return write_class
+    if method in ('GET', 'HEAD'):
+        for pattern, name in _LONG_READS:
+            if pattern.match(path):
+                return name
+        return 'read'
+    return 'write'
+
+
+def start(budget):
+    """Give the current request ``budget`` seconds, returns a token for reset()."""
+    return _deadline.set(time.monotonic() + budget)
+
+
+def reset(token):
+    _deadline.reset(token)
+
+
+def remaining():
+    """Seconds left of the current request's budget, None outside a request."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def timeout(default=DEFAULT_TIMEOUT):
+    """The timeout for the next backend call, raises DeadlineExceeded when nothing is left."""
+    left = remaining()
+    if left is None:
+        return default
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded before the backend call")
+    return left
+
+
+def detached(fn, *args):
+    """Run ``fn`` without the request's deadline, for work done after the response."""
+    token = _deadline.set(None)
+    try:
+        return fn(*args)
+    finally:
+        _deadline.reset(token)
+
+
+def call(fn, args, kwargs, name, idempotent):
+    """Call ``fn``, retrying transient errors with backoff when it is ``idempotent``."""
+    attempt = 1
+    while True:
+        timeout()
+        try:
+            return fn(*args, **kwargs)
+        except TRANSIENT_ERRORS + (sqlite3.OperationalError,) as err:
+            if not (idempotent and _transient(err)) or attempt >= RETRY_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** attempt))
+            left = remaining()
+            if left is not None and delay >= left:
+                raise
+            metrics.BACKEND_RETRIES.labels(name).inc()
+            time.sleep(delay)
+            attempt += 1
+
+
+def hedged(fn, *args, after=None):
+    """Call ``fn`` and, if it hasn't answered ``after`` seconds later, call it again; first answer wins."""
+    after = HEDGE_AFTER if after is None else after
+    if after <= 0:
+        return fn(*args)
+    # each call runs in a copy of this context so it sees the deadline and records its ops
+    primary = _hedge_pool.submit(contextvars.copy_context().run, fn, *args)
+    try:
+        return primary.result(timeout=after)
+    except concurrent.futures.TimeoutError:
+        pass
+    hedge = _hedge_pool.submit(contextvars.copy_context().run, fn, *args)
+    done, _ = concurrent.futures.wait([primary, hedge], timeout=timeout(),
+                                      return_when=concurrent.futures.FIRST_COMPLETED)
+    if not done:
+        raise DeadlineExceeded("Request deadline exceeded waiting for a hedged read")
+    winner = done.pop()
+    metrics.HEDGED_READS.labels('hedge' if winner is hedge else 'primary').inc()
+    return winner.result()
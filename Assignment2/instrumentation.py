@@ -0,0 +1,141 @@
+import contextvars
+import logging
+import os
+import time
+from collections import Counter
+from typing import Optional
+
+import deadlines
+import loopmonitor
+from metrics import BACKEND_LATENCY, BACKEND_ERRORS
+
+
+logger = logging.getLogger(__name__)
+
+# Ops allowed per request before a warning is logged
+OP_BUDGET = int(os.environ.get('TASK_OP_BUDGET', '50'))
+
+# Point reads/writes of the same kind allowed per request before it is treated as an N+1 loop
+REPEAT_LIMIT = int(os.environ.get('TASK_OP_REPEAT_LIMIT', '5'))
+
+# Raise instead of logging when a budget is exceeded (for tests)
+STRICT = os.environ.get('TASK_OP_STRICT', '') == '1'
+
+
+class OpBudgetExceeded(RuntimeError):
+    pass
+
+
+class RequestOps:
+    """Backend operations issued while handling one request."""
+
+    def __init__(self):
+        self.reads = 0
+        self.writes = 0
+        self.queries = 0
+        self.documents = 0
+        self.calls = Counter()
+
+    @property
+    def total(self):
+        return self.reads + self.writes + self.queries
+
+    def record(self, kind: str, name: str, documents: int = 0):
+        if kind == 'read':
+            self.reads += 1
+        elif kind == 'query':
+            self.queries += 1
+        else:
+            self.writes += 1
+        self.documents += documents
+        self.calls[name] += 1
+
+    def headers(self):
+        return {
+            'X-Backend-Reads': str(self.reads),
+            'X-Backend-Writes': str(self.writes),
+            'X-Backend-Queries': str(self.queries),
+            'X-Backend-Documents': str(self.documents)
+        }
+
+    def problems(self, budget: int = OP_BUDGET, repeat_limit: int = REPEAT_LIMIT):
+        found = []
+        if self.total > budget:
+            found.append(f"{self.total} backend ops exceeds budget of {budget}")
+        for name, count in self.calls.items():
+            if count > repeat_limit:
+                found.append(f"{name} called {count} times (possible N+1)")
+        return found
+
+
+_current_ops: contextvars.ContextVar[Optional[RequestOps]] = contextvars.ContextVar('request_ops', default=None)
+
+
+def start_request() -> RequestOps:
+    ops = RequestOps()
+    _current_ops.set(ops)
+    return ops
+
+
+def current_ops() -> Optional[RequestOps]:
+    return _current_ops.get()
+
+
+def classify(name: str) -> str:
+    if name.startswith('get_'):
+        return 'read'
+    if name.startswith(('list_', 'find_', 'iter_')):
+        return 'query'
+    return 'write'
+
+
+class InstrumentedStorage:
+    """Wraps a storage backend and records every call on the current request
+    and in the backend latency/error metrics."""
+
+    def __init__(self, inner):
+        self.inner = inner
+
+    def __getattr__(self, name):
+        attr = getattr(self.inner, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        kind = classify(name)
+        latency = BACKEND_LATENCY.labels(name)
+
+        def instrumented(*args, **kwargs):
+            loopmonitor.check_blocking(f"store.{name}")
+            start = time.perf_counter()
+            try:
+                # reads are retried on transient errors, every call is held to the request deadline
+                result = deadlines.call(attr, args, kwargs, name, idempotent=kind != 'write')
+            except Exception:
+                BACKEND_ERRORS.labels(name).inc()
+                raise
+            finally:
+                latency.observe(time.perf_counter() - start)
+            ops = _current_ops.get()
+            if ops is not None:
+                documents = 0
+                if kind == 'query':
+                    # paginated queries return (documents, next_cursor)
+                    page = result[0] if isinstance(result, tuple) else result
+                    documents = len(page) if isinstance(page, list) else 0
+                ops.record(kind, name, documents)
+            return result
+
+        # cache the wrapper so later lookups bypass __getattr__
+        setattr(self, name, instrumented)
+        return instrumented
+
+
+def finish_request(ops: RequestOps, route: str, response):
+    for key, value in ops.headers().items():
+        response.headers[key] = value
+    problems = ops.problems()
+    if not problems:
+        return
+    message = f"{route}: " + "; ".join(problems)
+    if STRICT:
+        raise OpBudgetExceeded(message)
+    logger.warning(message)
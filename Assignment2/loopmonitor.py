@@ -0,0 +1,163 @@
+"""Event loop lag monitor and a debug mode that catches blocking calls.
+
+Everything that runs on the event loop thread delays every other request on
+the worker, so route handlers are plain functions that FastAPI runs in its
+thread pool and only the middleware stays on the loop. The monitor keeps
+that honest while the app runs:
+
+- a task on the loop wakes every INTERVAL and records how late it woke in
+  the ``event_loop_lag_seconds`` histogram;
+- a watchdog thread notices when the loop hasn't woken that task for
+  THRESHOLD past its due time, counts the stall and logs the stack the loop
+  thread is stuck in, together with the task running it, once per stall.
+
+With TASK_LOOP_DEBUG=1, backend calls, token verification and blocking
+socket, SQLite, subprocess and sleep calls raise BlockingCallError when made
+from a thread with a running event loop, so a handler that goes back to
+``async def`` fails in tests instead of slowing production down.
+"""
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+# How often the loop is checked, 0 turns the monitor off
+INTERVAL = float(os.environ.get('TASK_LOOP_LAG_INTERVAL_MS', '100')) / 1000
+
+# Lag past which the loop counts as blocked and its stack is logged
+THRESHOLD = float(os.environ.get('TASK_LOOP_LAG_THRESHOLD_MS', '250')) / 1000
+
+# Raise on blocking calls made on the event loop thread (for tests)
+DEBUG = os.environ.get('TASK_LOOP_DEBUG', '') == '1'
+
+# Audit events that block the calling thread, see _audit (time.sleep is only
+# audited by newer interpreters)
+_BLOCKING_EVENTS = {
+    'socket.connect', 'socket.getaddrinfo', 'socket.gethostbyname',
+    'sqlite3.connect', 'subprocess.Popen', 'time.sleep',
+}
+
+
+class BlockingCallError(RuntimeError):
+    pass
+
+
+def on_event_loop() -> bool:
+    """True when called from a thread that is running an event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def check_blocking(name: str):
+    """In debug mode, raise if ``name`` is about to block the event loop."""
+    if DEBUG and on_event_loop():
+        raise BlockingCallError(f"{name} would block the event loop, run it in a worker thread")
+
+
+def _audit(event, args):
+    if event not in _BLOCKING_EVENTS:
+        return
+    if event == 'time.sleep' and not args[0]:
+        return
+    if event == 'socket.connect' and args[0].gettimeout() == 0:
+        # non-blocking sockets are how asyncio itself connects
+        return
+    check_blocking(event)
+
+
+_audit_installed = False
+
+
+def install_audit_hook():
+    """Start raising on blocking calls made on the loop, once the app's backends are open.
+
+    The app is imported from inside the running loop by uvicorn, so the
+    connections storage.py, sharedcache.py and admission.py open at import
+    would trip the hook if it were installed any earlier. Audit hooks can't
+    be removed, so it is only ever installed once.
+    """
+    global _audit_installed
+    if DEBUG and not _audit_installed:
+        sys.addaudithook(_audit)
+        _audit_installed = True
+
+
+class LoopMonitor:
+    """Measures scheduling delay on the running loop and reports stalls."""
+
+    def __init__(self, interval: float = INTERVAL, threshold: float = THRESHOLD):
+        self.interval = interval
+        self.threshold = threshold
+        self._loop = None
+        self._loop_thread = None
+        self._last_tick = 0.0
+        self._reported_tick = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._task = self._loop.create_task(self._tick())
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stop.set()
+        self._task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await self._task
+        self._watchdog.join()
+
+    async def _tick(self):
+        while True:
+            due = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            self._last_tick = time.monotonic()
+            metrics.EVENT_LOOP_LAG.observe(max(0.0, self._last_tick - due))
+
+    def _watch(self):
+        while not self._stop.wait(self.interval / 2):
+            last_tick = self._last_tick
+            blocked = time.monotonic() - last_tick - self.interval
+            if blocked > self.threshold and self._reported_tick != last_tick:
+                self._reported_tick = last_tick
+                self._report(blocked)
+
+    def _report(self, blocked):
+        metrics.EVENT_LOOP_STALLS.inc()
+        frame = sys._current_frames().get(self._loop_thread)
+        task = asyncio.current_task(self._loop)
+        logger.warning("Event loop blocked for %.0f ms", blocked * 1000, extra={
+            'task': task.get_name() if task else None,
+            'coroutine': task.get_coro().__qualname__ if task else None,
+            'stack': ''.join(traceback.format_stack(frame)) if frame else None
+        })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """FastAPI lifespan that runs a LoopMonitor for as long as the app is up."""
+    install_audit_hook()
+    if INTERVAL <= 0:
+        yield
+        return
+    monitor = LoopMonitor()
+    monitor.start()
+    try:
+        yield
+    finally:
+        await monitor.stop()
@@ -1,31 +1,249 @@
-from fastapi import FastAPI, Request, Form, Depends, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, Request, Form, Depends, HTTPException, UploadFile, File
+from fastapi.responses import HTMLResponse, RedirectResponse, Response, StreamingResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 import google.oauth2.id_token
 from google.auth.transport import requests
-from google.cloud import firestore
 from typing import Dict, Any
+import base64
+import datetime
+import hashlib
+import hmac
+import io
+import ipaddress
+import json
+import logging
 import os
-
-
-# define the app that will contain all of our routing for Fast API 
-app = FastAPI()
+import time
+import uuid
+
+from storage import get_storage, SERVER_TIMESTAMP
+from models import Board, Task, Member, TASK_FIELDS, canonical_email, temp_member_id
+from instrumentation import InstrumentedStorage, start_request, finish_request
+import activity
+import admission
+import assets
+import conflicts
+import deadlines
+import loopmonitor
+import metrics
+import profiling
+import purge
+import ranking
+import recurring
+import search
+import sharedcache
+import dashboard
+import transfer
+from logging_config import configure_logging, request_id_var
+from writebehind import WriteBehind
+
+
+# structured logs are written from a background thread, see logging_config.py
+configure_logging()
+logger = logging.getLogger(__name__)
+
+# Fraction of completed requests that get an access log line (errors are always logged)
+REQUEST_LOG_SAMPLE_RATE = float(os.environ.get('TASK_REQUEST_LOG_SAMPLE_RATE', '0.1'))
+
+# define the app that will contain all of our routing for Fast API, route handlers
+# are plain functions run in a worker thread so the event loop never waits on the
+# backend (see loopmonitor.py)
+app = FastAPI(lifespan=loopmonitor.lifespan)
+
+# Firebase certificate fetches get at most this long, less when the request deadline is closer
+CERT_FETCH_TIMEOUT = float(os.environ.get('TASK_CERT_FETCH_TIMEOUT', '5'))
+
+class DeadlineRequest(requests.Request):
+    """Transport for token verification that times out with the request deadline."""
+
+    def __call__(self, url, method="GET", body=None, headers=None, timeout=None, **kwargs):
+        timeout = min(CERT_FETCH_TIMEOUT, deadlines.timeout())
+        return super().__call__(url, method=method, body=body, headers=headers, timeout=timeout, **kwargs)
 
 # firebase adapter
-firebase_request_adapter = requests.Request()
+firebase_request_adapter = DeadlineRequest()
 
-# define the static and templates directories
-app.mount('/static', StaticFiles(directory='static'), name='static')
+# define the static and templates directories, pages link to static files with
+# asset_url so they can be cached for good (see assets.py)
+app.mount('/static', assets.AssetFiles(directory=assets.STATIC_DIR), name='static')
 templates = Jinja2Templates(directory="templates")
+templates.env.globals['asset_url'] = assets.asset_url
+
+# Initialize the storage backend (Firestore unless TASK_STORAGE says otherwise),
+# every call is counted against the request that made it
+store = InstrumentedStorage(get_storage())
+
+# Emails worked out while rendering member lists are saved to the board in the background
+member_email_backfill = WriteBehind('member_emails', store.set_member_emails)
+
+# Verified tokens are kept until they expire so repeat requests skip verification,
+# shared between workers when serve.py runs several (see sharedcache.py)
+TOKEN_CACHE_SIZE = 10000
+token_cache = sharedcache.get_cache('tokens', TOKEN_CACHE_SIZE)
+
+# Emails of users looked up while listing board members
+MEMBER_DIRECTORY_SIZE = 50000
+MEMBER_DIRECTORY_TTL = 3600
+member_directory = sharedcache.get_cache('member_directory', MEMBER_DIRECTORY_SIZE)
+
+# Verify a Firebase ID token, raises ValueError when it is invalid
+def verify_token(id_token: str):
+    loopmonitor.check_blocking("verify_token")
+    # keyed by a digest so raw tokens never end up in the shared cache file
+    cache_key = hashlib.sha256(id_token.encode()).hexdigest()
+    cached = token_cache.get(cache_key)
+    if cached is not None and cached.get('exp', 0) > time.time():
+        metrics.CACHE_REQUESTS.labels('token', 'hit').inc()
+        return dict(cached)
+    metrics.CACHE_REQUESTS.labels('token', 'miss').inc()
+
+    start = time.perf_counter()
+    try:
+        claims = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    finally:
+        metrics.TOKEN_VERIFY_LATENCY.observe(time.perf_counter() - start)
+
+    if claims:
+        token_cache.set(cache_key, claims, claims.get('exp', 0))
+    return claims
+
+# Scrapers either send TASK_METRICS_TOKEN as a bearer token or connect from a
+# network in TASK_METRICS_ALLOW (comma separated, loopback only by default)
+METRICS_TOKEN = os.environ.get('TASK_METRICS_TOKEN', '')
+METRICS_ALLOWED_NETWORKS = [ipaddress.ip_network(network.strip()) for network in
+                            os.environ.get('TASK_METRICS_ALLOW', '127.0.0.0/8,::1/128').split(',') if network.strip()]
+
+def metrics_allowed(request: Request):
+    authorization = request.headers.get('authorization', '')
+    if METRICS_TOKEN and hmac.compare_digest(authorization.encode(), f"Bearer {METRICS_TOKEN}".encode()):
+        return True
+    try:
+        address = ipaddress.ip_address(request.client.host if request.client else '')
+    except ValueError:
+        return False
+    return any(address in network for network in METRICS_ALLOWED_NETWORKS)
+
+# Prometheus scrape endpoint, per-route traffic and errors aren't for everyone
+@app.get("/metrics")
+async def metrics_endpoint(request: Request):
+    if not metrics_allowed(request):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    return Response(metrics.generate_latest(), media_type=metrics.CONTENT_TYPE)
+
+# Count backend operations per request and report them in the response headers
+@app.middleware("http")
+async def count_backend_ops(request: Request, call_next):
+    ops = start_request()
+    response = await call_next(request)
+    route = request.scope.get('route')
+    finish_request(ops, route.path if route else request.url.path, response)
+    return response
 
-# Initialize Firestore client
-db = firestore.Client()
+# Sample profiles of selected requests (off unless configured, see profiling.py)
+if profiling.ENABLED:
+    app.middleware("http")(profiling.profile_request)
+    app.router.route_class = profiling.ProfiledRoute
+
+# Rate limit write routes per user and shed load when too many are in flight (see admission.py)
+@app.middleware("http")
+async def admission_control(request: Request, call_next):
+    route_class = admission.route_class(request.method, request.url.path)
+    if route_class is None:
+        return await call_next(request)
+
+    user_key = request.client.host if request.client else 'unknown'
+    id_token = request.cookies.get("token")
+    try:
+        if id_token:
+            try:
+                user_key = (await run_in_threadpool(verify_token, id_token))['user_id']
+            except ValueError:
+                pass
+
+        # shared buckets are a SQLite transaction that can wait on other workers, kept off the loop
+        wait = await run_in_threadpool(admission.check_rate, user_key, route_class)
+    except deadlines.DeadlineExceeded as err:
+        # exception handlers only see errors raised by the routes, not by middleware
+        return await deadline_exceeded(request, err)
+    if wait:
+        metrics.ADMISSION_REJECTIONS.labels('rate_limited', route_class).inc()
+        return JSONResponse({"detail": "Too many requests, slow down"}, status_code=429,
+                            headers={'Retry-After': admission.retry_after(wait)})
+
+    if not admission.write_limiter.try_acquire():
+        metrics.ADMISSION_REJECTIONS.labels('overloaded', route_class).inc()
+        return JSONResponse({"detail": "Server busy, try again shortly"}, status_code=503,
+                            headers={'Retry-After': str(admission.SHED_RETRY_AFTER)})
+    try:
+        return await call_next(request)
+    finally:
+        admission.write_limiter.release()
+
+# Give every request a time budget by route class, backend calls fail fast once it is spent (see deadlines.py)
+@app.middleware("http")
+async def request_deadline(request: Request, call_next):
+    route_class = deadlines.route_class(request.method, request.url.path,
+                                        admission.route_class(request.method, request.url.path))
+    request.state.deadline_class = route_class
+    token = deadlines.start(deadlines.BUDGETS[route_class])
+    try:
+        return await call_next(request)
+    finally:
+        deadlines.reset(token)
+
+@app.exception_handler(deadlines.DeadlineExceeded)
+async def deadline_exceeded(request: Request, err: deadlines.DeadlineExceeded):
+    route_class = getattr(request.state, 'deadline_class', 'read')
+    metrics.DEADLINES_EXCEEDED.labels(route_class).inc()
+    logger.warning("Request deadline exceeded: %s", err, extra={'route_class': route_class})
+    return JSONResponse({"detail": "The server took too long to answer, try again shortly"}, status_code=504,
+                        headers={'Retry-After': str(admission.SHED_RETRY_AFTER)})
+
+# Tag every log line with a request id and write a sampled access log
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    request_id = request.headers.get('x-request-id') or uuid.uuid4().hex
+    request_id_var.set(request_id)
+    start = time.perf_counter()
+    response = await call_next(request)
+    response.headers['X-Request-ID'] = request_id
+    route = request.scope.get('route')
+    logger.info("Request completed", extra={
+        'method': request.method,
+        'route': route.path if route else request.url.path,
+        'status': response.status_code,
+        'duration_ms': round((time.perf_counter() - start) * 1000, 2),
+        'backend_ops': {k: response.headers.get(v) for k, v in (
+            ('reads', 'X-Backend-Reads'), ('writes', 'X-Backend-Writes'), ('queries', 'X-Backend-Queries'))},
+        'sample_rate': 1.0 if response.status_code >= 500 else REQUEST_LOG_SAMPLE_RATE
+    })
+    return response
+
+# Record latency per route template and the number of requests in flight. Registered
+# last so it is the outermost middleware: requests turned away by admission control
+# are counted too, under the route 'unmatched' as they never reach the router
+@app.middleware("http")
+async def record_metrics(request: Request, call_next):
+    metrics.REQUESTS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        metrics.REQUESTS_IN_FLIGHT.dec()
+        route = request.scope.get('route')
+        metrics.REQUEST_LATENCY.labels(
+            request.method, route.path if route else 'unmatched', str(status)
+        ).observe(time.perf_counter() - start)
 
 # Main.html Route
 @app.get("/", response_class=HTMLResponse)
 
-async def root(request: Request):
+def root(request: Request, deleted_board: str = None):
 
     id_token = request.cookies.get("token")
 
@@ -35,11 +253,13 @@ async def root(request: Request):
 
     user_boards = []
 
+    background = None
+
     if id_token:
 
         try:
 
-            user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+            user_token = verify_token(id_token)
 
             if user_token:
 
@@ -47,168 +267,285 @@ async def root(request: Request):
 
                 email = user_token.get('email', '')
 
-                boards_query = db.collection('task_boards').where('members', 'array_contains', user_id)
-
-                for board in boards_query.stream():
+                temp_user_id = temp_member_id(email)
 
-                    board_data = board.to_dict()
+                summaries, built = dashboard.load_dashboard(store, user_id, temp_user_id)
 
-                    board_data['id'] = board.id
+                # a summary built from the boards is saved after the response, GET / doesn't write
+                if built is not None:
+                    background = BackgroundTask(deadlines.detached, dashboard.save_built, store, user_id, built)
 
-                    
+                user_boards = [Board.from_summary(board_id, summary) for board_id, summary in summaries.items()]
 
-                    board_data['is_creator'] = (board_data.get('creator_id') == user_id)
+        except ValueError as err:
 
-                    user_boards.append(board_data)
+            logger.warning("Token verification failed: %s", err)
 
-                temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            user_token = None 
 
-                boards_query_temp = db.collection('task_boards').where('members', 'array_contains', temp_user_id)
+            error_message = str(err)
 
-                for board in boards_query_temp.stream():
+    return templates.TemplateResponse('main.html', {
 
-                    board_data = board.to_dict()
+        'request': request,
 
-                    board_data['id'] = board.id
+        'user_token': user_token,
 
-                    
+        'error_message': error_message,
 
-                    board_data['is_creator'] = (board_data.get('creator_id') == temp_user_id)
+        'user_boards': user_boards,
 
-                    if not any(b['id'] == board.id for b in user_boards):
+        'undo_board_id': deleted_board if user_token else None
 
-                        user_boards.append(board_data)
+    }, background=background)
 
-        except ValueError as err:
+# Page size for the cross-board task list
+MY_TASKS_PAGE_SIZE = 50
+MY_TASKS_MAX_PAGE_SIZE = 200
 
-            print(str(err))
+# Cursors are passed around as opaque url-safe strings, datetimes as ISO 8601
+def encode_cursor(cursor):
+    if cursor is None:
+        return None
+    values = [value.isoformat() if isinstance(value, datetime.datetime) else value for value in cursor]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
 
-            user_token = None 
+def decode_cursor(value: str, size: int):
+    if not value:
+        return None
+    try:
+        values = json.loads(base64.urlsafe_b64decode(value.encode()))
+    except ValueError:
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return tuple(values)
+
+# Tasks assigned to the user (or their pending invite id) across every board they are on
+def get_assigned_tasks(user_token, cursor: str = None, limit: int = MY_TASKS_PAGE_SIZE, boards=None):
+    email = user_token.get('email', '')
+    temp_user_id = temp_member_id(email)
+    limit = max(1, min(limit, MY_TASKS_MAX_PAGE_SIZE))
+    # filtered by board in the query, tasks on boards they left or that were deleted never fill a page
+    board_ids = [board['id'] for board in (boards if boards is not None else get_member_boards(user_token, []))]
+    if not board_ids:
+        return [], None
+    tasks, next_cursor = store.list_assigned_tasks(
+        [user_token['user_id'], temp_user_id], board_ids, limit, decode_cursor(cursor, 3))
+    return tasks, encode_cursor(next_cursor)
+
+# Route for the cross-board task list
+@app.get("/my-tasks", response_class=HTMLResponse)
+def my_tasks_page(request: Request, cursor: str = None):
+    id_token = request.cookies.get("token")
 
-            error_message = str(err)
+    if not id_token:
+        return RedirectResponse(url="/")
 
-    return templates.TemplateResponse('main.html', {
+    try:
+        user_token = verify_token(id_token)
+        # read once for both the filter and the titles, boards from pending invites included
+        boards = get_member_boards(user_token, ['title'])
+        tasks, next_cursor = get_assigned_tasks(user_token, cursor, boards=boards)
+        tasks = [Task.from_doc(task) for task in tasks]
+        board_titles = {board['id']: board.get('title', '') for board in boards}
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
 
+    return templates.TemplateResponse('my_tasks.html', {
         'request': request,
-
         'user_token': user_token,
+        'error_message': None,
+        'tasks': tasks,
+        'board_titles': board_titles,
+        'next_cursor': next_cursor
+    })
 
-        'error_message': error_message,
+@app.get("/api/my-tasks")
+def my_tasks_api(request: Request, cursor: str = None, limit: int = MY_TASKS_PAGE_SIZE):
+    id_token = request.cookies.get("token")
+
+    if not id_token:
+        raise HTTPException(status_code=401, detail="Not signed in")
+
+    try:
+        user_token = verify_token(id_token)
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    tasks, next_cursor = get_assigned_tasks(user_token, cursor, limit)
+    return {"tasks": tasks, "next_cursor": next_cursor}
+
+# Boards the user can see, including ones they were invited to before signing up,
+# with only ``fields`` (plus the id) when given
+def get_member_boards(user_token, fields=None):
+    email = user_token.get('email', '')
+    temp_user_id = temp_member_id(email)
+    boards = store.list_member_boards(user_token['user_id'], fields)
+    board_ids = {board['id'] for board in boards}
+    for board in store.list_member_boards(temp_user_id, fields):
+        if board['id'] not in board_ids:
+            boards.append(board)
+            board_ids.add(board['id'])
+    return boards
+
+def get_member_board_ids(user_token):
+    return [board['id'] for board in get_member_boards(user_token, [])]
+
+SEARCH_RESULT_LIMIT = 20
+
+# Route for task search
+@app.get("/search", response_class=HTMLResponse)
+def search_page(request: Request, q: str = ""):
+    id_token = request.cookies.get("token")
+    results = []
+
+    if not id_token:
+        return RedirectResponse(url="/")
 
-        'user_boards': user_boards
+    try:
+        user_token = verify_token(id_token)
+        if q:
+            board_ids = get_member_board_ids(user_token)
+            results = [Task.from_doc(task) for task in search.search_tasks(store, board_ids, q, SEARCH_RESULT_LIMIT)]
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
 
+    return templates.TemplateResponse('search.html', {
+        'request': request,
+        'user_token': user_token,
+        'error_message': None,
+        'query': q,
+        'results': results
     })
 
+@app.get("/api/search")
+def search_api(request: Request, q: str = "", limit: int = SEARCH_RESULT_LIMIT):
+    id_token = request.cookies.get("token")
+
+    if not id_token:
+        raise HTTPException(status_code=401, detail="Not signed in")
+
+    try:
+        user_token = verify_token(id_token)
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    board_ids = get_member_board_ids(user_token)
+    return {"results": search.search_tasks(store, board_ids, q, max(1, min(limit, 100)))}
+
 # Route for logout
 @app.get("/logout")
-async def logout():
+def logout():
     response = RedirectResponse(url="/")
     response.delete_cookie(key="token")
     return response
 
 # User functions
-async def create_user(user_id: str, email: str, name: str = ""):
-    user_ref = db.collection('users').document(user_id)
+def create_user(user_id: str, email: str, name: str = ""):
     user_data = {
         'email': email,
         'name': name,
-        'created_at': firestore.SERVER_TIMESTAMP
+        'created_at': SERVER_TIMESTAMP
     }
-    user_ref.set(user_data)
+    store.set_user(user_id, user_data)
     return user_data
 
-async def get_user(user_id: str):
-    user_ref = db.collection('users').document(user_id)
-    user = user_ref.get()
-    if user.exists:
-        return user.to_dict()
-    return None
+def get_user(user_id: str):
+    return store.get_user(user_id)
 
 # Task board functions
-async def create_task_board(user_id: str, title: str, description: str = ""):
-    board_ref = db.collection('task_boards').document()
+def create_task_board(user_id: str, title: str, description: str = ""):
     board_data = {
         'title': title,
         'description': description,
         'creator_id': user_id,
         'members': [user_id],
-        'created_at': firestore.SERVER_TIMESTAMP
+        'task_count': 0,
+        'completed_count': 0,
+        'ranked': True,
+        'created_at': SERVER_TIMESTAMP
     }
-    board_ref.set(board_data)
-    return {"id": board_ref.id, **board_data}
-
-async def get_task_board(board_id: str):
-    board_ref = db.collection('task_boards').document(board_id)
-    board = board_ref.get()
-    if board.exists:
-        return {"id": board_id, **board.to_dict()}
-    return None
+    board_id = store.create_board(board_data)
+    board = {"id": board_id, **board_data}
+    dashboard.members_changed(store, board, added=[user_id])
+    return board
 
-async def get_user_task_boards(user_id: str):
-    boards_query = db.collection('task_boards').where('members', 'array_contains', user_id)
-    boards = []
-    for board in boards_query.stream():
-        boards.append({"id": board.id, **board.to_dict()})
-    return boards
+def get_task_board(board_id: str, with_version: bool = False):
+    # a second read is sent if the first is slow, when TASK_HEDGE_AFTER_MS is set
+    return deadlines.hedged(store.get_board, board_id, False, with_version)
+
+def get_user_task_boards(user_id: str):
+    return store.list_member_boards(user_id)
+
+# Forms posted by static/forms.js get a JSON answer instead of a redirect
+def wants_fragment(request: Request):
+    return request.headers.get('x-requested-with') == 'fetch'
+
+def render_task_item(board, task):
+    return templates.get_template('task_item.html').render(board=board, task=task)
+
+# Rebalances the board's ranks after the response once a new key has grown too long
+def rebalance_after(board_id, rank):
+    if ranking.needs_rebalance(rank):
+        return BackgroundTask(deadlines.detached, ranking.rebalance_board, store, board_id)
+    return None
 
 # Task functions
-async def create_task(
+def create_task(
     board_id: str, 
     title: str, 
     description: str, 
     creator_id: str, 
     assigned_users: list = None,
-    due_date: str = None
+    due_date: str = None,
+    rank: str = None,
+    event: dict = None
 ):
     if assigned_users is None:
         assigned_users = []
         
-    task_ref = db.collection('task_boards').document(board_id).collection('tasks').document()
     task_data = {
         'title': title,
         'description': description,
         'creator_id': creator_id,
         'assigned_users': assigned_users,
         'status': 'pending',
-        'created_at': firestore.SERVER_TIMESTAMP,
+        'created_at': SERVER_TIMESTAMP,
         'due_date': due_date,
-        'completed_at': None
+        'completed_at': None,
+        'rank': rank
     }
-    task_ref.set(task_data)
-    return {"id": task_ref.id, **task_data}
-
-async def get_task(board_id: str, task_id: str):
-    task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task_id)
-    task = task_ref.get()
-    if task.exists:
-        return {"id": task_id, **task.to_dict()}
-    return None
+    task_id = store.create_task(board_id, task_data, event)
+    search.index_task(store, board_id, task_id, None, task_data)
+    return {"id": task_id, **task_data}
 
-async def get_board_tasks(board_id: str):
-    tasks_query = db.collection('task_boards').document(board_id).collection('tasks')
-    tasks = []
-    for task in tasks_query.stream():
-        tasks.append({"id": task.id, **task.to_dict()})
-    return tasks
+def get_task(board_id: str, task_id: str, with_version: bool = False):
+    return store.get_task(board_id, task_id, False, with_version)
+
+def get_board_tasks(board_id: str):
+    return store.list_tasks(board_id)
 
-async def assign_user_to_task(board_id: str, task_id: str, user_id: str):
-    task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task_id)
-    task = task_ref.get()
+def assign_user_to_task(board_id: str, task_id: str, user_id: str):
+    task_data = store.get_task(board_id, task_id)
     
-    if task.exists:
-        task_data = task.to_dict()
+    if task_data:
         assigned_users = task_data.get('assigned_users', [])
         
         if user_id not in assigned_users:
             assigned_users.append(user_id)
-            task_ref.update({'assigned_users': assigned_users})
+            store.update_task(board_id, task_id, {'assigned_users': assigned_users})
             
         return True
     return False
 
 # Route for creating a new task board
 @app.get("/create-board", response_class=HTMLResponse)
-async def create_board_page(request: Request):
+def create_board_page(request: Request):
     id_token = request.cookies.get("token")
     user_token = None
     error_message = None
@@ -217,9 +554,9 @@ async def create_board_page(request: Request):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('create_board.html', {
@@ -230,24 +567,24 @@ async def create_board_page(request: Request):
 
 # Route for handling board creation
 @app.post("/create-board")
-async def create_board_submit(request: Request, title: str = Form(...), description: str = Form("")):
+def create_board_submit(request: Request, title: str = Form(...), description: str = Form("")):
     id_token = request.cookies.get("token")
     
     if not id_token:
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await create_task_board(user_id, title, description)
+        board = create_task_board(user_id, title, description)
         return RedirectResponse(url="/", status_code=303)
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
 # Routes for task board
 @app.get("/board/{board_id}", response_class=HTMLResponse)
-async def view_board(request: Request, board_id: str):
+def view_board(request: Request, board_id: str, deleted: str = None):
     id_token = request.cookies.get("token")
     error_message = None
     user_token = None
@@ -258,11 +595,11 @@ async def view_board(request: Request, board_id: str):
         return RedirectResponse(url="/")
 
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         email = user_token.get('email', '')
-        temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
-        board = await get_task_board(board_id)
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
 
         if not board:
             return RedirectResponse(url="/")
@@ -271,176 +608,404 @@ async def view_board(request: Request, board_id: str):
             return RedirectResponse(url="/")
 
         if temp_user_id in board.get('members', []) and user_id not in board.get('members', []):
-            board_ref = db.collection('task_boards').document(board_id)
             members = board.get('members', [])
             members.remove(temp_user_id)
             members.append(user_id)
-            board_ref.update({'members': members})
+            store.replace_member(board_id, temp_user_id, user_id)
             board['members'] = members
+            dashboard.member_replaced(store, board, temp_user_id, user_id)
 
-        tasks = await get_board_tasks(board_id)
-
-        total_tasks = len(tasks)
-        completed_tasks = 0
-        active_tasks = 0
+        # boards from before ranks existed are shown in this order until ranking.py ranks them
+        if board.get('ranked'):
+            tasks = store.list_tasks(board_id, TASK_FIELDS, by_rank=True)
+        else:
+            tasks = ranking.in_board_order(store.list_tasks(board_id, TASK_FIELDS))
+        tasks = [Task.from_doc(task) for task in tasks]
 
-        for task in tasks:
-            if task.get('status') == 'completed' and task.get('completed_at'):
-                completed_tasks += 1
-                
-                completed_at = task['completed_at']
-                if hasattr(completed_at, 'seconds'):
-                    import datetime
-                    task['completed_at_formatted'] = datetime.datetime.fromtimestamp(
-                        completed_at.seconds
-                    ).strftime('%Y-%m-%d %H:%M')
-                else:
-                    task['completed_at_formatted'] = completed_at.strftime('%Y-%m-%d %H:%M')
-            else:
-                active_tasks += 1
+        # archived tasks are all completed and still count towards the board totals
+        archived_tasks = board.get('archived_count', 0)
+        completed_tasks = archived_tasks + sum(1 for task in tasks if task.completed)
+        total_tasks = len(tasks) + archived_tasks
+        active_tasks = total_tasks - completed_tasks
 
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('board.html', {
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board,
+        'board': Board.from_doc(board),
         'tasks': tasks,
         'task_counters': {
             'total': total_tasks,
             'completed': completed_tasks,
             'active': active_tasks
-        }
+        },
+        'undo_task_id': deleted
     })
 
-# Routes for Add Member
-@app.get("/board/{board_id}/add-member", response_class=HTMLResponse)
-async def add_member_page(request: Request, board_id: str):
+ARCHIVE_PAGE_SIZE = 50
 
+# Route for a board's archived tasks
+@app.get("/board/{board_id}/archive", response_class=HTMLResponse)
+def view_archive(request: Request, board_id: str, cursor: str = None):
     id_token = request.cookies.get("token")
 
-    error_message = None
+    if not id_token:
+        return RedirectResponse(url="/")
 
-    success_message = None
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
+        email = user_token.get('email', '')
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
 
-    user_token = None
+        if not board:
+            return RedirectResponse(url="/")
 
-    board = None
+        if user_id not in board.get('members', []) and temp_user_id not in board.get('members', []):
+            return RedirectResponse(url="/")
 
-    members_info = []
+        after = decode_cursor(cursor, 2)
+        if after is not None:
+            try:
+                after = (datetime.datetime.fromisoformat(after[0]), after[1])
+            except (TypeError, ValueError):
+                raise HTTPException(status_code=400, detail="Invalid cursor")
 
-    if not id_token:
+        tasks, next_cursor = store.list_archived_tasks(board_id, ARCHIVE_PAGE_SIZE, after)
+        tasks = [Task.from_doc(task) for task in tasks]
 
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
+    return templates.TemplateResponse('archive.html', {
+        'request': request,
+        'user_token': user_token,
+        'error_message': None,
+        'board': Board.from_doc(board),
+        'tasks': tasks,
+        'next_cursor': encode_cursor(next_cursor)
+    })
+
+# Board the signed in user is a member of, for the JSON and file routes
+def get_member_board(request: Request, board_id: str):
+    id_token = request.cookies.get("token")
+
+    if not id_token:
+        raise HTTPException(status_code=401, detail="Not signed in")
+
     try:
+        user_token = verify_token(id_token)
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    email = user_token.get('email', '')
+    temp_user_id = temp_member_id(email)
+    board = get_task_board(board_id)
+
+    if not board or (user_token['user_id'] not in board.get('members', [])
+                     and temp_user_id not in board.get('members', [])):
+        raise HTTPException(status_code=404, detail="Board not found")
+
+    return user_token, board
+
+ACTIVITY_PAGE_SIZE = 50
+ACTIVITY_MAX_PAGE_SIZE = 200
+
+# A page of the board's activity feed, newest first, each event described in words
+def get_activity_page(board, user_token, cursor: str = None, limit: int = ACTIVITY_PAGE_SIZE):
+    limit = max(1, min(limit, ACTIVITY_MAX_PAGE_SIZE))
+    after = decode_cursor(cursor, 2)
+    if after is not None:
+        try:
+            after = (datetime.datetime.fromisoformat(after[0]), after[1])
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    events, next_cursor = store.list_activity(board['id'], limit, after)
+    names = activity.member_names(events, board.get('member_emails', {}))
+    names[user_token['user_id']] = user_token.get('email', '')
+    entries = [{
+        'id': event['id'],
+        'type': event['t'],
+        'actor': event['a'],
+        'task_id': event.get('k'),
+        'text': activity.describe(event, names),
+        'at': event['at'].isoformat()
+    } for event in events]
+    return entries, encode_cursor(next_cursor)
+
+# Route for a board's activity feed
+@app.get("/board/{board_id}/activity", response_class=HTMLResponse)
+def view_activity(request: Request, board_id: str, cursor: str = None):
+    id_token = request.cookies.get("token")
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+    if not id_token:
+        return RedirectResponse(url="/")
 
+    try:
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
+        email = user_token.get('email', '')
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
+
+        if not board:
+            return RedirectResponse(url="/")
+
+        if user_id not in board.get('members', []) and temp_user_id not in board.get('members', []):
+            return RedirectResponse(url="/")
 
-        board = await get_task_board(board_id)
+        entries, next_cursor = get_activity_page(board, user_token, cursor)
+
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
+
+    return templates.TemplateResponse('activity.html', {
+        'request': request,
+        'user_token': user_token,
+        'error_message': None,
+        'board': Board.from_doc(board),
+        'entries': entries,
+        'next_cursor': next_cursor
+    })
+
+@app.get("/api/board/{board_id}/activity")
+def activity_api(request: Request, board_id: str, cursor: str = None, limit: int = ACTIVITY_PAGE_SIZE):
+    user_token, board = get_member_board(request, board_id)
+    entries, next_cursor = get_activity_page(board, user_token, cursor, limit)
+    return {"events": entries, "next_cursor": next_cursor}
+
+def render_recurring_page(request, user_token, board, error_message=None, status_code=200):
+    board_members = get_board_members(board, user_token)
+    emails = {member.id: member.email for member in board_members}
+    rules = sorted(store.list_recurring(board['id']), key=lambda rule: rule['title'].lower())
+    for rule in rules:
+        rule['assignee'] = ', '.join(emails.get(user, 'a former member') for user in rule.get('assigned_users') or [])
+    return templates.TemplateResponse('recurring.html', {
+        'request': request,
+        'user_token': user_token,
+        'error_message': error_message,
+        'board': Board.from_doc(board),
+        'board_members': board_members,
+        'rules': rules,
+        'window_days': recurring.WINDOW.days
+    }, status_code=status_code)
+
+# Routes for a board's recurring tasks, their occurrences are created by recurring.py
+@app.get("/board/{board_id}/recurring", response_class=HTMLResponse)
+def recurring_page(request: Request, board_id: str):
+    id_token = request.cookies.get("token")
+
+    if not id_token:
+        return RedirectResponse(url="/")
+
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
+        email = user_token.get('email', '')
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
 
         if not board:
+            return RedirectResponse(url="/")
 
+        if user_id not in board.get('members', []) and temp_user_id not in board.get('members', []):
             return RedirectResponse(url="/")
 
-        if board.get('creator_id') != user_id:
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
 
-            return RedirectResponse(url=f"/board/{board_id}")
+    return render_recurring_page(request, user_token, board)
 
-        
+@app.post("/board/{board_id}/recurring")
+def add_recurring(
+    request: Request,
+    board_id: str,
+    title: str = Form(...),
+    description: str = Form(""),
+    rule: str = Form(...),
+    assigned_to: str = Form(None)
+):
+    id_token = request.cookies.get("token")
 
-        board_ref = db.collection('task_boards').document(board_id)
+    if not id_token:
+        return RedirectResponse(url="/")
 
-        board_data = board_ref.get().to_dict()
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
+        email = user_token.get('email', '')
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
 
-        member_emails = board_data.get('member_emails', {})
+        if not board:
+            return RedirectResponse(url="/")
 
-        
+        if user_id not in board.get('members', []) and temp_user_id not in board.get('members', []):
+            return RedirectResponse(url="/")
 
-        for member_id in board.get('members', []):
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
 
-            if member_id in member_emails:
+    assigned_users = []
+    if assigned_to and assigned_to != "none" and assigned_to in board.get('members', []):
+        assigned_users = [assigned_to]
 
-                members_info.append({
+    try:
+        data = recurring.new_rule(title.strip(), description, rule, assigned_users, user_id)
+    except ValueError as err:
+        return render_recurring_page(request, user_token, board, str(err), status_code=400)
 
-                    'id': member_id,
+    rule_id = store.create_recurring(board_id, data,
+                                     event=activity.event(activity.RECURRING_ADDED, user_id, name=data['title']))
+    # the first occurrences show up straight away rather than after the next scheduled run
+    background = BackgroundTask(deadlines.detached, recurring.materialize_added, store, board_id, rule_id)
+    return RedirectResponse(url=f"/board/{board_id}/recurring", status_code=303, background=background)
 
-                    'email': member_emails[member_id],
+@app.post("/board/{board_id}/recurring/{rule_id}/delete")
+def delete_recurring(request: Request, board_id: str, rule_id: str):
+    id_token = request.cookies.get("token")
 
-                    'is_creator': member_id == board.get('creator_id', '')
+    if not id_token:
+        return RedirectResponse(url="/")
 
-                })
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
+        email = user_token.get('email', '')
+        temp_user_id = temp_member_id(email)
+        board = get_task_board(board_id)
 
-                continue
+        if not board:
+            return RedirectResponse(url="/")
 
-                
+        if user_id not in board.get('members', []) and temp_user_id not in board.get('members', []):
+            return RedirectResponse(url="/")
 
-            if member_id == user_id:
+        rule = store.get_recurring(board_id, rule_id)
 
-                members_info.append({
+        # tasks already created for it stay on the board
+        if rule is not None:
+            store.delete_recurring(board_id, rule_id,
+                                   event=activity.event(activity.RECURRING_REMOVED, user_id, name=rule['title']))
 
-                    'id': member_id,
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
 
-                    'email': user_token.get('email', 'Your account'),
+    return RedirectResponse(url=f"/board/{board_id}/recurring", status_code=303)
 
-                    'is_creator': member_id == board.get('creator_id', '')
+# Route for downloading a board's tasks, streamed page by page
+@app.get("/board/{board_id}/export")
+def export_board(request: Request, board_id: str, format: str = "jsonl"):
+    if format not in transfer.FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown export format")
 
-                })
+    _, board = get_member_board(request, board_id)
 
-                
+    return StreamingResponse(
+        transfer.export_tasks(store, board_id, format, by_rank=bool(board.get('ranked'))),
+        media_type=transfer.FORMATS[format],
+        headers={'Content-Disposition': f'attachment; filename="board-{board_id}.{format}"'}
+    )
 
-                if 'email' in user_token:
+# Route for bulk importing tasks from a JSON Lines or CSV upload
+@app.post("/api/board/{board_id}/import")
+def import_board_tasks(request: Request, board_id: str, file: UploadFile = File(...), format: str = Form(None)):
+    if format is not None and format not in transfer.FORMATS:
+        raise HTTPException(status_code=400, detail="Unknown import format")
 
-                    member_emails[member_id] = user_token['email']
+    user_token, board = get_member_board(request, board_id)
 
-                    board_ref.update({'member_emails': member_emails})
+    # the upload is spooled to disk by the form parser and read back a line at a time
+    lines = io.TextIOWrapper(file.file, encoding='utf-8-sig', newline='')
+    rows = transfer.read_rows(lines, format or transfer.format_for(file.filename))
+    try:
+        return transfer.import_tasks(store, board, rows, user_token['user_id'])
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Uploads must be UTF-8 encoded")
+
+# Route for dragging a task to a new position, only the moved task is written
+@app.post("/api/board/{board_id}/task/{task_id}/move")
+def move_task(request: Request, board_id: str, task_id: str,
+                    before_id: str = Form(None), after_id: str = Form(None)):
+    _, board = get_member_board(request, board_id)
+    if not board.get('ranked'):
+        # boards from before ranks existed are ranked behind this answer rather than inside it
+        return JSONResponse({"error": "The board's order is being set up, reload it to move tasks."}, status_code=409,
+                            background=BackgroundTask(deadlines.detached, ranking.ensure_ranked, store, board))
+
+    neighbour_ids = [neighbour_id for neighbour_id in (before_id, after_id) if neighbour_id]
+    if task_id in neighbour_ids:
+        raise HTTPException(status_code=400, detail="A task can't be moved next to itself")
+    task, *neighbours = store.get_tasks([(board_id, task_id)] + [(board_id, neighbour_id) for neighbour_id in neighbour_ids])
+    if task is None or None in neighbours:
+        raise HTTPException(status_code=404, detail="Task not found")
+    ranks = dict((neighbour['id'], neighbour.get('rank')) for neighbour in neighbours)
 
-                continue
+    try:
+        rank = ranking.key_between(ranks.get(before_id), ranks.get(after_id))
+    except ValueError:
+        # the neighbours moved since the page was rendered
+        return JSONResponse({"error": "The board changed, reload it to see the current order."}, status_code=409)
 
-                
+    store.update_task(board_id, task_id, {'rank': rank})
 
-            if member_id.startswith('temp_'):
+    return JSONResponse({"task_id": task_id, "rank": rank}, background=rebalance_after(board_id, rank))
 
-                email = member_id.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
+# Routes for Add Member
+@app.get("/board/{board_id}/add-member", response_class=HTMLResponse)
+def add_member_page(request: Request, board_id: str):
 
-                members_info.append({
+    id_token = request.cookies.get("token")
 
-                    'id': member_id,
+    error_message = None
 
-                    'email': email,
+    success_message = None
 
-                    'is_creator': member_id == board.get('creator_id', '')
+    user_token = None
 
-                })
+    board = None
 
-                
+    members_info = []
 
-                member_emails[member_id] = email
+    if not id_token:
 
-                board_ref.update({'member_emails': member_emails})
+        return RedirectResponse(url="/")
 
-                continue
+    try:
 
-            
+        user_token = verify_token(id_token)
 
-            members_info.append({
+        user_id = user_token['user_id']
 
-                'id': member_id,
+        board = get_task_board(board_id)
 
-                'email': f"User {member_id[:6]}...",
+        if not board:
 
-                'is_creator': member_id == board.get('creator_id', '')
+            return RedirectResponse(url="/")
 
-            })
+        if board.get('creator_id') != user_id:
+
+            return RedirectResponse(url=f"/board/{board_id}")
+
+        
+
+        members_info = get_board_members(board, user_token)
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
 
         return RedirectResponse(url="/")
 
@@ -450,22 +1015,22 @@ async def add_member_page(request: Request, board_id: str):
         'user_token': user_token,
         'error_message': error_message,
         'success_message': success_message,
-        'board': board,
+        'board': Board.from_doc(board),
         'members_info': members_info
 
     })
 
 @app.post("/board/{board_id}/add-member")
-async def add_member_submit(request: Request, board_id: str, email: str = Form(...)):
+def add_member_submit(request: Request, board_id: str, email: str = Form(...)):
     id_token = request.cookies.get("token")
 
     if not id_token:
         return RedirectResponse(url="/")
 
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
 
         if not board:
             return RedirectResponse(url="/")
@@ -473,162 +1038,113 @@ async def add_member_submit(request: Request, board_id: str, email: str = Form(.
         if board.get('creator_id') != user_id:
             return RedirectResponse(url=f"/board/{board_id}")
             
-        users_ref = db.collection('users').where('email', '==', email)
-        users = [doc for doc in users_ref.stream()]
+        email = canonical_email(email)
+        entry = resolve_email(email)
 
-        board_ref = db.collection('task_boards').document(board_id)
-        board_data = board_ref.get().to_dict()
-        member_emails = board_data.get('member_emails', {})
+        member_emails = board.setdefault('member_emails', {})
 
-        if not users:
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+        if entry is None:
+            temp_user_id = temp_member_id(email)
             user_data = {
                 'email': email,
-                'created_at': firestore.SERVER_TIMESTAMP,
+                'created_at': SERVER_TIMESTAMP,
                 'temp_user': True
             }
-            db.collection('users').document(temp_user_id).set(user_data)
-            member_id = temp_user_id
-            
-            member_emails[member_id] = email
-            
-            print(f"Created temporary user record for {email} with ID {temp_user_id}")
-        else:
-            member_id = users[0].id
-            user_email = users[0].to_dict().get('email')
-            
-            member_emails[member_id] = user_email
+            entry = store.claim_email(email, temp_user_id, user_data, pending=True)
+            if entry['uid'] == temp_user_id:
+                logger.info("Created temporary user record", extra={'email': email, 'user_id': temp_user_id})
+
+        member_id = entry['uid']
+        member_emails[member_id] = entry['email']
 
         if member_id in board.get('members', []):
-            members_info = []
-            for mid in board.get('members', []):
-                if mid in member_emails:
-                    members_info.append({
-                        'id': mid,
-                        'email': member_emails[mid],
-                        'is_creator': mid == board.get('creator_id', '')
-                    })
-                elif mid == user_id:
-                    members_info.append({
-                        'id': mid,
-                        'email': user_token.get('email', 'Your account'),
-                        'is_creator': mid == board.get('creator_id', '')
-                    })
-                elif mid.startswith('temp_'):
-                    temp_email = mid.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
-                    members_info.append({
-                        'id': mid,
-                        'email': temp_email,
-                        'is_creator': mid == board.get('creator_id', '')
-                    })
-                else:
-                    members_info.append({
-                        'id': mid,
-                        'email': f"User {mid[:6]}...",
-                        'is_creator': mid == board.get('creator_id', '')
-                    })
+            members_info = get_board_members(board, user_token)
             
             return templates.TemplateResponse('add_member.html', {
                 'request': request,
                 'user_token': user_token,
                 'error_message': "User is already a member of this board.",
                 'success_message': None,
-                'board': board,
+                'board': Board.from_doc(board),
                 'members_info': members_info
             })
 
-        members = board.get('members', [])
-        members.append(member_id)
+        store.add_member(board_id, member_id, member_emails[member_id],
+                         activity.event(activity.MEMBER_ADDED, user_id, name=entry['email'], member_id=member_id))
         
-        board_ref.update({
-            'members': members,
-            'member_emails': member_emails
-        })
+        updated_board = get_task_board(board_id)
+        dashboard.members_changed(store, updated_board, added=[member_id])
         
-        updated_board = await get_task_board(board_id)
-        
-        members_info = []
-        for mid in updated_board.get('members', []):
-            if mid in member_emails:
-                members_info.append({
-                    'id': mid,
-                    'email': member_emails[mid],
-                    'is_creator': mid == updated_board.get('creator_id', '')
-                })
-            elif mid == user_id:
-                members_info.append({
-                    'id': mid,
-                    'email': user_token.get('email', 'Your account'),
-                    'is_creator': mid == updated_board.get('creator_id', '')
-                })
-            elif mid.startswith('temp_'):
-                temp_email = mid.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
-                members_info.append({
-                    'id': mid,
-                    'email': temp_email,
-                    'is_creator': mid == updated_board.get('creator_id', '')
-                })
-            else:
-                members_info.append({
-                    'id': mid,
-                    'email': f"User {mid[:6]}...",
-                    'is_creator': mid == updated_board.get('creator_id', '')
-                })
+        members_info = get_board_members(updated_board, user_token)
 
         return templates.TemplateResponse('add_member.html', {
             'request': request,
             'user_token': user_token,
             'error_message': None,
             'success_message': f"User {email} has been added to the board.",
-            'board': updated_board,
+            'board': Board.from_doc(updated_board),
             'members_info': members_info
         })
 
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
     
-# Route to check user in Firestore
-@app.post("/ensure-user")
-async def ensure_user(request: Request):
+# Create the user record and email index entry on first sign in
+def ensure_user_record(data):
+    user_id = data.get('uid')
+    email = data.get('email')
 
-    try:
-        data = await request.json()
-        user_id = data.get('uid')
-        email = data.get('email')
+    if user_id and email:
 
-        if user_id and email:
+        email = canonical_email(email)
+        user = store.get_user(user_id)
+        
+        if user is None:
 
-            user_ref = db.collection('users').document(user_id)
-            user = user_ref.get()
-            
-            if not user.exists:
+            logger.info("Creating new user record", extra={'email': email, 'user_id': user_id})
+
+            user_data = {
+
+                'email': email,
+                'created_at': SERVER_TIMESTAMP
+            }
 
-                print(f"Creating new user record for {email}")
+            entry = store.claim_email(email, user_id, user_data, pending=False)
+            if entry['uid'] != user_id:
+                # the address already belongs to another account, keep the record without the index entry
+                logger.warning("Email already registered to another user", extra={'email': email, 'user_id': user_id})
+                store.set_user(user_id, user_data)
 
-                user_data = {
+            return {"status": "created"}
 
-                    'email': email,
-                    'created_at': firestore.SERVER_TIMESTAMP
-                }
+        entry = store.get_email_entry(email)
+        if entry is None or entry.get('pending'):
+            # registered before the index existed, or signed in again before the invite was taken over
+            store.claim_email(email, user_id, None, pending=False)
 
-                user_ref.set(user_data)
+        return {"status": "exists"}
 
-                return {"status": "created"}
+    return {"status": "error", "message": "Missing user ID or email"}
 
-            return {"status": "exists"}
+# Route to check user in Firestore
+@app.post("/ensure-user")
+async def ensure_user(request: Request):
 
-        return {"status": "error", "message": "Missing user ID or email"}
+    try:
+        data = await request.json()
+        # the body has to be read on the event loop, the backend calls go to a worker thread
+        return await run_in_threadpool(ensure_user_record, data)
 
     except Exception as e:
 
-        print(f"Error ensuring user: {str(e)}")
+        logger.exception("Error ensuring user")
 
         return {"status": "error", "message": str(e)}
        
 # Create Task
 @app.get("/board/{board_id}/create-task", response_class=HTMLResponse)
-async def create_task_page(request: Request, board_id: str):
+def create_task_page(request: Request, board_id: str):
     id_token = request.cookies.get("token")
     error_message = None
     user_token = None
@@ -638,61 +1154,37 @@ async def create_task_page(request: Request, board_id: str):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
         
         if user_id not in board.get('members', []):
             email = user_token.get('email', '')
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
             if temp_user_id not in board.get('members', []):
                 return RedirectResponse(url="/")
         
-        board_members = []
-        member_emails = board.get('member_emails', {})
-        
-        for member_id in board.get('members', []):
-            if member_id in member_emails:
-                board_members.append({
-                    'id': member_id,
-                    'email': member_emails[member_id]
-                })
-            elif member_id == user_id:
-                board_members.append({
-                    'id': member_id,
-                    'email': user_token.get('email', 'You')
-                })
-            elif member_id.startswith('temp_'):
-                email = member_id.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
-                board_members.append({
-                    'id': member_id,
-                    'email': email
-                })
-            else:
-                board_members.append({
-                    'id': member_id,
-                    'email': f"User {member_id[:6]}..."
-                })
+        board_members = get_board_members(board, user_token)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('create_task.html', {
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board,
+        'board': Board.from_doc(board),
         'board_members': board_members
     })
 
 
 @app.post("/board/{board_id}/create-task")
-async def create_task_submit(
+def create_task_submit(
 
     request: Request, 
     board_id: str, 
@@ -711,11 +1203,11 @@ async def create_task_submit(
 
     try:
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
 
         user_id = user_token['user_id']
 
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
 
         if not board:
 
@@ -725,24 +1217,27 @@ async def create_task_submit(
 
             email = user_token.get('email', '')
 
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
 
             if temp_user_id not in board.get('members', []):
 
                 return RedirectResponse(url="/")
 
-        existing_tasks = await get_board_tasks(board_id)
+        existing_tasks = get_board_tasks(board_id)
 
         for task in existing_tasks:
 
             if task['title'].lower() == title.lower():
 
+                if wants_fragment(request):
+                    return JSONResponse({"error": "A task with this name already exists on this board."}, status_code=409)
+
                 return templates.TemplateResponse('create_task.html', {
                     'request': request,
                     'user_token': user_token,
                     'error_message': "A task with this name already exists on this board.",
-                    'board': board,
-                    'board_members': await get_board_members(board)
+                    'board': Board.from_doc(board),
+                    'board_members': get_board_members(board, user_token)
 
                 })
 
@@ -751,26 +1246,36 @@ async def create_task_submit(
         if assigned_to and assigned_to != "none":
             assigned_users = [assigned_to]
 
-        task = await create_task(
+        task = create_task(
 
             board_id=board_id,
             title=title,
             description=description,
             creator_id=user_id,
             assigned_users=assigned_users,
-            due_date=due_date
+            due_date=due_date,
+            # new tasks go to the bottom of the board, unranked ones are ranked later by ranking.py
+            rank=ranking.key_after(ranking.last_rank(existing_tasks)) if board.get('ranked') else None,
+            event=activity.event(activity.TASK_CREATED, user_id, name=title)
         )
 
-        return RedirectResponse(url=f"/board/{board_id}", status_code=303)        
+        dashboard.tasks_changed(store, board, total=1)
+        background = rebalance_after(board_id, task['rank']) if task['rank'] else None
+
+        if wants_fragment(request):
+            return JSONResponse({"task_id": task['id'], "message": f'Task "{title}" created.'}, status_code=201,
+                                background=background)
+
+        return RedirectResponse(url=f"/board/{board_id}", status_code=303, background=background)
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
     
 # Routes for task marking
 @app.post("/board/{board_id}/task/{task_id}/complete")
-async def complete_task(request: Request, board_id: str, task_id: str):
+def complete_task(request: Request, board_id: str, task_id: str):
 
     id_token = request.cookies.get("token")
 
@@ -780,9 +1285,9 @@ async def complete_task(request: Request, board_id: str, task_id: str):
     
     try:
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
 
         if not board:
 
@@ -792,47 +1297,64 @@ async def complete_task(request: Request, board_id: str, task_id: str):
 
             email = user_token.get('email', '')
 
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
 
             if temp_user_id not in board.get('members', []):
 
                 return RedirectResponse(url="/")
 
     
-        task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task_id)
-
-        task = task_ref.get()
+        task = get_task(board_id, task_id)
 
-        if not task.exists:
+        if not task:
 
             return RedirectResponse(url=f"/board/{board_id}")
 
-        task_ref.update({
+        newly_completed = task.get('status') != 'completed'
 
-            'status': 'completed',
+        # completing it again keeps who completed it first, and when
+        if newly_completed:
 
-            'completed_at': firestore.SERVER_TIMESTAMP,
+            store.update_task(board_id, task_id, {
 
-            'completed_by': user_id
+                'status': 'completed',
 
-        })
+                'completed_at': SERVER_TIMESTAMP,
+
+                'completed_by': user_id
+
+            }, activity.event(activity.TASK_COMPLETED, user_id, task_id, task['title']))
+
+            dashboard.tasks_changed(store, board, completed=1)
+
+        if wants_fragment(request):
+            # render the updated task on its own rather than the whole board
+            task = Task.from_doc(task)
+            if newly_completed:
+                task.status = 'completed'
+                task.completed_at = datetime.datetime.now(datetime.timezone.utc)
+            return JSONResponse({
+                "task_id": task_id,
+                "html": render_task_item(Board.from_doc(board), task),
+                "counters": {"active": -1, "completed": 1} if newly_completed else {}
+            })
 
         return RedirectResponse(url=f"/board/{board_id}", status_code=303)
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
 
         return RedirectResponse(url="/")
     
     
 #Check user is in the board creator
-async def is_board_creator(board, user_id):
+def is_board_creator(board, user_id):
     return board.get('creator_id') == user_id
 
 
 @app.get("/board/{board_id}/edit", response_class=HTMLResponse)
-async def edit_board_page(request: Request, board_id: str):
+def edit_board_page(request: Request, board_id: str):
 
     id_token = request.cookies.get("token")
     error_message = None
@@ -845,9 +1367,9 @@ async def edit_board_page(request: Request, board_id: str):
 
     try:
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id, with_version=True)
 
         if not board:
 
@@ -860,7 +1382,7 @@ async def edit_board_page(request: Request, board_id: str):
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
 
         return RedirectResponse(url="/")
 
@@ -869,17 +1391,21 @@ async def edit_board_page(request: Request, board_id: str):
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board
+        'board': Board.from_doc(board),
+        'version': board['version'],
+        'base': conflicts.base(board, conflicts.BOARD_FIELDS)
 
     })
 
 
 @app.post("/board/{board_id}/edit")
-async def edit_board_submit(
+def edit_board_submit(
     request: Request, 
     board_id: str, 
     title: str = Form(...), 
-    description: str = Form("")
+    description: str = Form(""),
+    version: str = Form(None),
+    base: str = Form(None)
 
 ):
 
@@ -891,9 +1417,9 @@ async def edit_board_submit(
 
     try:
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
 
         if not board:
 
@@ -903,24 +1429,51 @@ async def edit_board_submit(
 
             return RedirectResponse(url=f"/board/{board_id}")
 
-        board_ref = db.collection('task_boards').document(board_id)
+        update_data = {'title': title, 'description': description}
 
-        board_ref.update({
-            'title': title,
-            'description': description
-        })
+        # written only if the board is unchanged since the form was rendered (see conflicts.py)
+        new_version, current = conflicts.save(
+            lambda version: store.update_board(board_id, update_data,
+                                               activity.event(activity.BOARD_EDITED, user_id), version=version),
+            lambda: store.get_board(board_id, with_version=True),
+            conflicts.BOARD_FIELDS, version, base)
+
+        if new_version is None:
+
+            if current is None:
+
+                return templates.TemplateResponse('edit_board.html', {
+
+                    'request': request,
+                    'user_token': user_token,
+                    'error_message': conflicts.DELETED_MESSAGE,
+                    'board': Board.from_doc({**board, **update_data})
+
+                }, status_code=404)
+
+            return templates.TemplateResponse('edit_board.html', {
+
+                'request': request,
+                'user_token': user_token,
+                'error_message': conflicts.CONFLICT_MESSAGE,
+                'board': Board.from_doc({**current, **update_data}),
+                'version': current['version'],
+                'base': conflicts.base(current, conflicts.BOARD_FIELDS),
+                'conflict': conflicts.differences(current, update_data, conflicts.BOARD_FIELDS)
+
+            }, status_code=409)
 
         return RedirectResponse(url=f"/board/{board_id}", status_code=303)
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
     
 
 
 @app.get("/board/{board_id}/members", response_class=HTMLResponse)
-async def manage_members_page(request: Request, board_id: str):
+def manage_members_page(request: Request, board_id: str):
     id_token = request.cookies.get("token")
     error_message = None
     success_message = None
@@ -932,10 +1485,10 @@ async def manage_members_page(request: Request, board_id: str):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
@@ -943,41 +1496,10 @@ async def manage_members_page(request: Request, board_id: str):
         if board.get('creator_id') != user_id:
             return RedirectResponse(url=f"/board/{board_id}")
         
-        member_emails = board.get('member_emails', {})
-        
-        for member_id in board.get('members', []):
-            if member_id in member_emails:
-                members_info.append({
-                    'id': member_id,
-                    'email': member_emails[member_id],
-                    'is_creator': member_id == board.get('creator_id', '')
-                })
-            elif member_id.startswith('temp_'):
-                email = member_id.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
-                members_info.append({
-                    'id': member_id,
-                    'email': email,
-                    'is_creator': member_id == board.get('creator_id', '')
-                })
-            else:
-                user_ref = db.collection('users').document(member_id)
-                user_doc = user_ref.get()
-                if user_doc.exists:
-                    user_data = user_doc.to_dict()
-                    members_info.append({
-                        'id': member_id,
-                        'email': user_data.get('email', 'Unknown email'),
-                        'is_creator': member_id == board.get('creator_id', '')
-                    })
-                else:
-                    members_info.append({
-                        'id': member_id,
-                        'email': f"User {member_id[:6]}...",
-                        'is_creator': member_id == board.get('creator_id', '')
-                    })
+        members_info = get_board_members(board, user_token)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('manage_members.html', {
@@ -985,22 +1507,22 @@ async def manage_members_page(request: Request, board_id: str):
         'user_token': user_token,
         'error_message': error_message,
         'success_message': success_message,
-        'board': board,
+        'board': Board.from_doc(board),
         'members_info': members_info
     })
 
 @app.post("/board/{board_id}/remove-member/{member_id}")
-async def remove_member(request: Request, board_id: str, member_id: str):
+def remove_member(request: Request, board_id: str, member_id: str):
     id_token = request.cookies.get("token")
     
     if not id_token:
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
@@ -1011,39 +1533,34 @@ async def remove_member(request: Request, board_id: str, member_id: str):
         if member_id == board.get('creator_id'):
             return RedirectResponse(url=f"/board/{board_id}/members", status_code=303)
         
-        tasks = await get_board_tasks(board_id)
+        tasks = get_board_tasks(board_id)
         tasks_to_update = []
         
         for task in tasks:
             if 'assigned_users' in task and member_id in task['assigned_users']:
-                task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task['id'])
-                task_ref.update({
+                store.update_task(board_id, task['id'], {
                     'assigned_users': [],
                     'unassigned': True,
                     'previously_assigned_to': member_id
                 })
                 tasks_to_update.append(task['id'])
         
-        board_ref = db.collection('task_boards').document(board_id)
-        members = board.get('members', [])
-        if member_id in members:
-            members.remove(member_id)
-            board_ref.update({'members': members})
-            
-            member_emails = board.get('member_emails', {})
-            if member_id in member_emails:
-                del member_emails[member_id]
-                board_ref.update({'member_emails': member_emails})
+        if member_id in board.get('members', []):
+            store.remove_member(board_id, member_id, activity.event(
+                activity.MEMBER_REMOVED, user_id, name=board.get('member_emails', {}).get(member_id),
+                member_id=member_id, count=len(tasks_to_update)))
+            board['members'].remove(member_id)
+            dashboard.members_changed(store, board, removed=[member_id])
         
         return RedirectResponse(url=f"/board/{board_id}/members", status_code=303)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
     
 
 @app.get("/board/{board_id}/delete", response_class=HTMLResponse)
-async def delete_board_page(request: Request, board_id: str):
+def delete_board_page(request: Request, board_id: str):
     id_token = request.cookies.get("token")
     error_message = None
     user_token = None
@@ -1055,10 +1572,10 @@ async def delete_board_page(request: Request, board_id: str):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
@@ -1066,64 +1583,76 @@ async def delete_board_page(request: Request, board_id: str):
         if board.get('creator_id') != user_id:
             return RedirectResponse(url=f"/board/{board_id}")
         
-        tasks = await get_board_tasks(board_id)
+        tasks = get_board_tasks(board_id)
         has_tasks = len(tasks) > 0
         
         members = board.get('members', [])
         has_other_members = len(members) > 1
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('delete_board.html', {
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board,
+        'board': Board.from_doc(board),
         'has_tasks': has_tasks,
         'has_other_members': has_other_members
     })
 
 
-async def get_board_members(board):
-    """Get member information for a board"""
+def resolve_email(email):
+    """The index entry for a canonical address, with one point read.
+
+    Accounts registered before the index existed have no entry yet; they are
+    found with the email query once and indexed so the next lookup is a read.
+    """
+    entry = store.get_email_entry(email)
+    if entry is not None:
+        return entry
+    users = [user for user in store.find_users_by_email(email) if not user.get('temp_user')]
+    if not users:
+        return None
+    return store.claim_email(email, users[0]['id'], None, pending=False)
+
+
+def get_board_members(board, user_token=None):
+    """Get member information for a board, remembering emails it had to look up"""
     board_members = []
     member_emails = board.get('member_emails', {})
-    
+    found_emails = {}
+
     for member_id in board.get('members', []):
-        if member_id in member_emails:
-            board_members.append({
-                'id': member_id,
-                'email': member_emails[member_id]
-            })
-        elif member_id.startswith('temp_'):
-            email = member_id.replace('temp_', '').replace('_at_', '@').replace('_dot_', '.')
-            board_members.append({
-                'id': member_id,
-                'email': email
-            })
-        else:
-            user_ref = db.collection('users').document(member_id)
-            user_doc = user_ref.get()
-            if user_doc.exists:
-                user_data = user_doc.to_dict()
-                board_members.append({
-                    'id': member_id,
-                    'email': user_data.get('email', f"User {member_id[:6]}...")
-                })
-            else:
-                board_members.append({
-                    'id': member_id,
-                    'email': f"User {member_id[:6]}..."
-                })
-    
+        email = member_emails.get(member_id)
+        if email is None:
+            if user_token and member_id == user_token['user_id']:
+                email = user_token.get('email')
+            if email is None:
+                email = member_directory.get(member_id)
+            if email is None:
+                user_data = store.get_user(member_id)
+                email = user_data.get('email') if user_data else None
+                if email:
+                    member_directory.set(member_id, email, time.time() + MEMBER_DIRECTORY_TTL)
+            if email:
+                found_emails[member_id] = email
+        board_members.append(Member(
+            id=member_id,
+            email=email or f"User {member_id[:6]}...",
+            is_creator=member_id == board.get('creator_id')
+        ))
+
+    if found_emails:
+        member_email_backfill.defer(board['id'], found_emails)
+
     return board_members
 
 
 # Editing Routes for board
 @app.get("/board/{board_id}/task/{task_id}/edit", response_class=HTMLResponse)
-async def edit_task_page(request: Request, board_id: str, task_id: str):
+def edit_task_page(request: Request, board_id: str, task_id: str):
     id_token = request.cookies.get("token")
     error_message = None
     user_token = None
@@ -1132,43 +1661,45 @@ async def edit_task_page(request: Request, board_id: str, task_id: str):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
         
         if user_id not in board.get('members', []):
             email = user_token.get('email', '')
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
             if temp_user_id not in board.get('members', []):
                 return RedirectResponse(url="/")
         
-        task = await get_task(board_id, task_id)
+        task = get_task(board_id, task_id, with_version=True)
         
         if not task:
             return RedirectResponse(url=f"/board/{board_id}")
         
-        board_members = await get_board_members(board)
+        board_members = get_board_members(board, user_token)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('edit_task.html', {
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board,
-        'task': task,
-        'board_members': board_members
+        'board': Board.from_doc(board),
+        'task': Task.from_doc(task),
+        'board_members': board_members,
+        'version': task['version'],
+        'base': conflicts.base(task, conflicts.TASK_FIELDS)
     })
 
 @app.post("/board/{board_id}/task/{task_id}/edit")
 
-async def edit_task_submit(
+def edit_task_submit(
 
     request: Request, 
 
@@ -1182,7 +1713,11 @@ async def edit_task_submit(
 
     due_date: str = Form(None),
 
-    assigned_to: str = Form(None)
+    assigned_to: str = Form(None),
+
+    version: str = Form(None),
+
+    base: str = Form(None)
 
 ):
 
@@ -1194,9 +1729,9 @@ async def edit_task_submit(
 
     try:
 
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
 
         if not board:
 
@@ -1206,20 +1741,20 @@ async def edit_task_submit(
 
             email = user_token.get('email', '')
 
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
 
             if temp_user_id not in board.get('members', []):
 
                 return RedirectResponse(url="/")
 
-        task = await get_task(board_id, task_id)
+        task = get_task(board_id, task_id)
 
         if not task:
 
             return RedirectResponse(url=f"/board/{board_id}")
   
 
-        existing_tasks = await get_board_tasks(board_id)
+        existing_tasks = get_board_tasks(board_id)
 
         for existing_task in existing_tasks:
 
@@ -1227,6 +1762,9 @@ async def edit_task_submit(
 
                 existing_task['id'] != task_id):
 
+                if wants_fragment(request):
+                    return JSONResponse({"error": "Another task with this name already exists on this board."}, status_code=409)
+
                 return templates.TemplateResponse('edit_task.html', {
 
                     'request': request,
@@ -1235,11 +1773,15 @@ async def edit_task_submit(
 
                     'error_message': "Another task with this name already exists on this board.",
 
-                    'board': board,
+                    'board': Board.from_doc(board),
+
+                    'task': Task.from_doc(task),
 
-                    'task': task,
+                    'board_members': get_board_members(board, user_token),
 
-                    'board_members': await get_board_members(board)
+                    'version': version,
+
+                    'base': base
 
                 })
 
@@ -1259,7 +1801,7 @@ async def edit_task_submit(
 
             'assigned_users': assigned_users,
 
-            'updated_at': firestore.SERVER_TIMESTAMP
+            'updated_at': SERVER_TIMESTAMP
 
         }
 
@@ -1269,23 +1811,81 @@ async def edit_task_submit(
 
         
 
-        task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task_id)
+        # written only if the task is unchanged since the form was rendered (see conflicts.py)
+        new_version, current = conflicts.save(
+            lambda version: store.update_task(board_id, task_id, update_data,
+                                              activity.task_edit_event(user_id, task_id, task, update_data),
+                                              version=version),
+            lambda: get_task(board_id, task_id, with_version=True),
+            conflicts.TASK_FIELDS, version, base)
+
+        if new_version is None:
+
+            if current is None:
+
+                if wants_fragment(request):
+                    return JSONResponse({"error": conflicts.DELETED_MESSAGE}, status_code=404)
+
+                return templates.TemplateResponse('edit_task.html', {
+
+                    'request': request,
+
+                    'user_token': user_token,
+
+                    'error_message': conflicts.DELETED_MESSAGE,
+
+                    'board': Board.from_doc(board),
+
+                    'task': Task.from_doc({**task, **update_data}),
+
+                    'board_members': get_board_members(board, user_token)
+
+                }, status_code=404)
+
+            if wants_fragment(request):
+                # the page posts the form again without JavaScript to get the conflict page
+                return JSONResponse({"error": conflicts.CONFLICT_MESSAGE, "conflict": True}, status_code=409)
+
+            return templates.TemplateResponse('edit_task.html', {
+
+                'request': request,
+
+                'user_token': user_token,
+
+                'error_message': conflicts.CONFLICT_MESSAGE,
+
+                'board': Board.from_doc(board),
+
+                'task': Task.from_doc({**current, **update_data}),
+
+                'board_members': get_board_members(board, user_token),
 
-        task_ref.update(update_data)
+                'version': current['version'],
 
+                'base': conflicts.base(current, conflicts.TASK_FIELDS),
+
+                'conflict': conflicts.differences(current, update_data, conflicts.TASK_FIELDS)
+
+            }, status_code=409)
+
+        search.index_task(store, board_id, task_id, task, update_data)
+
+        if wants_fragment(request):
+            return JSONResponse({"task_id": task_id, "message": "Changes saved.", "version": new_version,
+                                 "base": conflicts.base(update_data, conflicts.TASK_FIELDS)})
     
         return RedirectResponse(url=f"/board/{board_id}", status_code=303)
 
 
     except ValueError as err:
 
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
 
         return RedirectResponse(url="/")
 
 # Routes for Deleting board Get Method
 @app.get("/board/{board_id}/task/{task_id}/delete", response_class=HTMLResponse)
-async def delete_task_page(request: Request, board_id: str, task_id: str):
+def delete_task_page(request: Request, board_id: str, task_id: str):
     id_token = request.cookies.get("token")
     error_message = None
     user_token = None
@@ -1294,87 +1894,130 @@ async def delete_task_page(request: Request, board_id: str, task_id: str):
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
         
         if user_id not in board.get('members', []):
             email = user_token.get('email', '')
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
             if temp_user_id not in board.get('members', []):
                 return RedirectResponse(url="/")
         
-        task = await get_task(board_id, task_id)
+        task = get_task(board_id, task_id)
         
         if not task:
             return RedirectResponse(url=f"/board/{board_id}")
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
 
     return templates.TemplateResponse('delete_task.html', {
         'request': request,
         'user_token': user_token,
         'error_message': error_message,
-        'board': board,
-        'task': task
+        'board': Board.from_doc(board),
+        'task': Task.from_doc(task)
     })
 
 @app.post("/board/{board_id}/task/{task_id}/delete")
-async def delete_task_submit(request: Request, board_id: str, task_id: str):
+def delete_task_submit(request: Request, board_id: str, task_id: str):
     id_token = request.cookies.get("token")
     
     if not id_token:
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
         
         if user_id not in board.get('members', []):
             email = user_token.get('email', '')
-            temp_user_id = f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+            temp_user_id = temp_member_id(email)
             if temp_user_id not in board.get('members', []):
                 return RedirectResponse(url="/")
         
-        task_ref = db.collection('task_boards').document(board_id).collection('tasks').document(task_id)
-        task = task_ref.get()
+        task = get_task(board_id, task_id)
         
-        if not task.exists:
+        if not task:
             return RedirectResponse(url=f"/board/{board_id}")
         
-        task_ref.delete()
+        # soft delete, purge.py removes it for good once the undo window has passed
+        store.update_task(board_id, task_id, {'deleted_at': SERVER_TIMESTAMP},
+                          activity.event(activity.TASK_DELETED, user_id, task_id, task['title']))
+        search.index_task(store, board_id, task_id, task, None)
+        dashboard.tasks_changed(store, board, total=-1,
+                                completed=-1 if task.get('status') == 'completed' else 0)
+        
+        return RedirectResponse(url=f"/board/{board_id}?deleted={task_id}", status_code=303)
+        
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
+
+# Route for the undo link shown after deleting a task
+@app.post("/board/{board_id}/task/{task_id}/restore")
+def restore_task_submit(request: Request, board_id: str, task_id: str):
+    id_token = request.cookies.get("token")
+    
+    if not id_token:
+        return RedirectResponse(url="/")
+    
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
+        
+        board = get_task_board(board_id)
+        
+        if not board:
+            return RedirectResponse(url="/")
+        
+        if user_id not in board.get('members', []):
+            email = user_token.get('email', '')
+            temp_user_id = temp_member_id(email)
+            if temp_user_id not in board.get('members', []):
+                return RedirectResponse(url="/")
+        
+        task = store.get_task(board_id, task_id, include_deleted=True)
+        
+        if task and task.get('deleted_at') and purge.can_undo(task):
+            store.update_task(board_id, task_id, {'deleted_at': None},
+                              activity.event(activity.TASK_RESTORED, user_id, task_id, task['title']))
+            task['deleted_at'] = None
+            search.index_task(store, board_id, task_id, None, task)
+            dashboard.tasks_changed(store, board, total=1,
+                                    completed=1 if task.get('status') == 'completed' else 0)
         
         return RedirectResponse(url=f"/board/{board_id}", status_code=303)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
     
 
 
 @app.post("/board/{board_id}/delete")
-async def delete_board_submit(request: Request, board_id: str, force: bool = Form(False)):
+def delete_board_submit(request: Request, board_id: str, force: bool = Form(False)):
     id_token = request.cookies.get("token")
     
     if not id_token:
         return RedirectResponse(url="/")
     
     try:
-        user_token = google.oauth2.id_token.verify_firebase_token(id_token, firebase_request_adapter)
+        user_token = verify_token(id_token)
         user_id = user_token['user_id']
         
-        board = await get_task_board(board_id)
+        board = get_task_board(board_id)
         
         if not board:
             return RedirectResponse(url="/")
@@ -1386,17 +2029,37 @@ async def delete_board_submit(request: Request, board_id: str, force: bool = For
         if len(members) > 1 and not force:
             return RedirectResponse(url=f"/board/{board_id}/members", status_code=303)
         
-        tasks_ref = db.collection('task_boards').document(board_id).collection('tasks')
-        tasks = tasks_ref.stream()
+        # soft delete, its tasks go with it when purge.py removes the board
+        store.update_board(board_id, {'deleted_at': SERVER_TIMESTAMP}, activity.event(activity.BOARD_DELETED, user_id))
         
-        for task in tasks:
-            task.reference.delete()
+        return RedirectResponse(url=f"/?deleted_board={board_id}", status_code=303)
+        
+    except ValueError as err:
+        logger.warning("Token verification failed: %s", err)
+        return RedirectResponse(url="/")
+
+# Route for the undo link shown after deleting a board
+@app.post("/board/{board_id}/restore")
+def restore_board_submit(request: Request, board_id: str):
+    id_token = request.cookies.get("token")
+    
+    if not id_token:
+        return RedirectResponse(url="/")
+    
+    try:
+        user_token = verify_token(id_token)
+        user_id = user_token['user_id']
         
-        board_ref = db.collection('task_boards').document(board_id)
-        board_ref.delete()
+        board = store.get_board(board_id, include_deleted=True)
         
-        return RedirectResponse(url="/", status_code=303)
+        if not board or board.get('creator_id') != user_id:
+            return RedirectResponse(url="/")
+        
+        if board.get('deleted_at') and purge.can_undo(board):
+            store.update_board(board_id, {'deleted_at': None}, activity.event(activity.BOARD_RESTORED, user_id))
+        
+        return RedirectResponse(url=f"/board/{board_id}", status_code=303)
         
     except ValueError as err:
-        print(str(err))
+        logger.warning("Token verification failed: %s", err)
         return RedirectResponse(url="/")
\ No newline at end of file
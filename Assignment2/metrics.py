@@ -0,0 +1,206 @@
+"""Minimal Prometheus text-format metrics.
+
+Route handlers run on the thread pool (see loopmonitor.py), so samples are
+recorded from many threads at once. Each child series has its own lock,
+held only for the read-modify-write of its values, so updates aren't lost
+and threads recording different series never wait on each other.
+A child series is created once per label combination and reused after that,
+so recording a sample costs a dict lookup, an uncontended lock and a few
+attribute updates.
+"""
+import bisect
+import threading
+from typing import Dict, Tuple
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+
+class _Metric:
+    kind = ''
+    suffix = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[tuple, object] = {}
+        if not self.labelnames:
+            self._unlabelled = self._new_child()
+        _registry.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _series(self):
+        if not self.labelnames:
+            return [((), self._unlabelled)]
+        return list(self._children.items())
+
+    def expose(self):
+        name = self.name + self.suffix
+        lines = [f"# HELP {name} {self.documentation}", f"# TYPE {name} {self.kind}"]
+        for values, child in self._series():
+            lines.extend(self._expose_child(values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ('value', '_lock')
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+    suffix = '_total'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def _expose_child(self, values, child):
+        return [f"{self.name}_total{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._unlabelled.inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._unlabelled.dec(amount)
+
+    def set(self, value: float):
+        self._unlabelled.set(value)
+
+    def _expose_child(self, values, child):
+        return [f"{self.name}{_format_labels(self.labelnames, values)} {child.value}"]
+
+
+class _HistogramValue:
+    __slots__ = ('buckets', 'counts', 'sum', 'count', '_lock')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def snapshot(self):
+        """``(counts, sum, count)`` read together, so a scrape never sees a half-recorded sample."""
+        with self._lock:
+            return list(self.counts), self.sum, self.count
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self._unlabelled.observe(value)
+
+    def _expose_child(self, values, child):
+        lines = []
+        cumulative = 0
+        counts, total, count_all = child.snapshot()
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, values, [('le', le)])} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {total}")
+        lines.append(f"{self.name}_count{labels} {count_all}")
+        return lines
+
+
+def generate_latest() -> str:
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Metrics recorded by the app
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency by route template',
+    ('method', 'route', 'status'))
+REQUESTS_IN_FLIGHT = Gauge(
+    'http_requests_in_flight', 'Requests currently being handled')
+TOKEN_VERIFY_LATENCY = Histogram(
+    'token_verification_duration_seconds', 'Time spent verifying Firebase ID tokens')
+CACHE_REQUESTS = Counter(
+    'cache_requests', 'Cache lookups by cache and result', ('cache', 'result'))
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds', 'How late the event loop ran a task scheduled to wake up',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+EVENT_LOOP_STALLS = Counter(
+    'event_loop_stalls', 'Times the event loop was blocked past the lag threshold')
+BACKEND_LATENCY = Histogram(
+    'backend_call_duration_seconds', 'Storage backend call latency by operation', ('operation',))
+BACKEND_ERRORS = Counter(
+    'backend_errors', 'Storage backend calls that raised, by operation', ('operation',))
+BACKEND_RETRIES = Counter(
+    'backend_retries', 'Storage backend reads retried after a transient error, by operation', ('operation',))
+HEDGED_READS = Counter(
+    'hedged_reads', 'Hedged reads by which of the two calls answered first', ('winner',))
+DEADLINES_EXCEEDED = Counter(
+    'deadlines_exceeded', 'Requests that ran out of time budget, by route class', ('route_class',))
+ADMISSION_REJECTIONS = Counter(
+    'admission_rejections', 'Write requests turned away, by reason and route class', ('reason', 'route_class'))
+WRITE_BEHIND_UPDATES = Counter(
+    'write_behind_updates', 'Deferred cache-fill updates by queue and outcome', ('queue', 'result'))
+WRITE_BEHIND_PENDING = Gauge(
+    'write_behind_pending', 'Documents with deferred updates waiting to be written', ('queue',))
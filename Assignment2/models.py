@@ -0,0 +1,126 @@
+"""Typed view-models for the documents the routes render.
+
+Storage backends hand back plain dictionaries holding every field of a
+document. The routes decode them here once, keeping only the fields the
+pages use and converting timestamps as they go, so templates read
+attributes off small slotted objects instead of decorating dicts in place.
+"""
+import datetime
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+
+def to_datetime(value) -> Optional[datetime.datetime]:
+    """Timestamps come back as datetimes, or protobuf Timestamps from older Firestore clients."""
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    if hasattr(value, 'seconds'):
+        return datetime.datetime.fromtimestamp(value.seconds, datetime.timezone.utc)
+    if isinstance(value, str):
+        return datetime.datetime.fromisoformat(value)
+    # e.g. SERVER_TIMESTAMP on a document that hasn't been read back yet
+    return None
+
+
+def canonical_email(email: str) -> str:
+    """The form addresses are stored and looked up in, so case differences don't make new users."""
+    return email.strip().lower()
+
+
+def temp_member_id(email: str) -> str:
+    """Placeholder member id for someone invited by email before they signed up."""
+    email = canonical_email(email)
+    return f"temp_{email.replace('@', '_at_').replace('.', '_dot_')}"
+
+
+@dataclass(slots=True)
+class Member:
+    id: str
+    email: str
+    is_creator: bool = False
+
+
+# Document fields Task.from_doc reads, for projection queries
+TASK_FIELDS = ['title', 'description', 'status', 'due_date', 'assigned_users', 'completed_at', 'unassigned', 'rank']
+
+
+@dataclass(slots=True)
+class Task:
+    id: str
+    title: str = ''
+    description: str = ''
+    status: str = 'pending'
+    due_date: Optional[str] = None
+    assigned_users: List[str] = field(default_factory=list)
+    completed_at: Optional[datetime.datetime] = None
+    unassigned: bool = False
+    rank: Optional[str] = None
+    board_id: Optional[str] = None
+
+    @classmethod
+    def from_doc(cls, data: Dict[str, Any]) -> 'Task':
+        return cls(
+            id=data['id'],
+            title=data.get('title') or '',
+            description=data.get('description') or '',
+            status=data.get('status') or 'pending',
+            due_date=data.get('due_date'),
+            assigned_users=data.get('assigned_users') or [],
+            completed_at=to_datetime(data.get('completed_at')),
+            unassigned=bool(data.get('unassigned')),
+            rank=data.get('rank'),
+            board_id=data.get('board_id')
+        )
+
+    @property
+    def completed(self) -> bool:
+        return self.status == 'completed' and self.completed_at is not None
+
+    @property
+    def completed_at_formatted(self) -> str:
+        return self.completed_at.strftime('%Y-%m-%d %H:%M') if self.completed_at else ''
+
+
+@dataclass(slots=True)
+class Board:
+    id: str
+    title: str = ''
+    description: str = ''
+    creator_id: str = ''
+    members: List[str] = field(default_factory=list)
+    created_at: Optional[datetime.datetime] = None
+    member_count: int = 0
+    task_count: int = 0
+    completed_count: int = 0
+    archived_count: int = 0
+    is_creator: bool = False
+
+    @classmethod
+    def from_doc(cls, data: Dict[str, Any]) -> 'Board':
+        members = data.get('members') or []
+        return cls(
+            id=data['id'],
+            title=data.get('title') or '',
+            description=data.get('description') or '',
+            creator_id=data.get('creator_id') or '',
+            members=members,
+            created_at=to_datetime(data.get('created_at')),
+            member_count=len(members),
+            task_count=data.get('task_count', 0),
+            completed_count=data.get('completed_count', 0),
+            archived_count=data.get('archived_count', 0)
+        )
+
+    @classmethod
+    def from_summary(cls, board_id: str, summary: Dict[str, Any]) -> 'Board':
+        """A board as shown on the dashboard, from its summary (see dashboard.board_summary)."""
+        return cls(
+            id=board_id,
+            title=summary.get('title') or '',
+            description=summary.get('description') or '',
+            created_at=to_datetime(summary.get('created_at')),
+            member_count=summary.get('member_count', 0),
+            task_count=summary.get('task_count', 0),
+            completed_count=summary.get('completed_count', 0),
+            is_creator=summary.get('role') == 'creator'
+        )
@@ -0,0 +1,169 @@
+"""Opt-in sampling profiler for individual requests.
+
+A profiled request gets a background thread that samples the stack of the
+thread handling it every few milliseconds. Samples are written in the folded
+format understood by flamegraph.pl and speedscope, one file per request under
+``PROFILE_DIR/<route>/``. Only one request is profiled at a time so samples
+from concurrent requests on the same event loop don't get mixed together.
+
+Route handlers are plain functions run in a worker thread (see loopmonitor.py),
+so routes are registered with ProfiledRoute, which adds the worker thread to
+the sampler for as long as the profiled request's handler runs on it.
+Profiles are written, and old ones removed past MAX_BYTES, by a single
+writer thread, so a profiled request doesn't wait on the disk.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from fastapi.routing import APIRoute
+
+
+# Fraction of requests to profile, 0 disables sampling
+SAMPLE_RATE = float(os.environ.get('TASK_PROFILE_SAMPLE_RATE', '0'))
+
+# Requests sending this value in the X-Debug-Profile header are always profiled
+DEBUG_TOKEN = os.environ.get('TASK_PROFILE_DEBUG_TOKEN', '')
+
+PROFILE_DIR = os.environ.get('TASK_PROFILE_DIR', 'profiles')
+INTERVAL = float(os.environ.get('TASK_PROFILE_INTERVAL_MS', '5')) / 1000
+MAX_BYTES = int(os.environ.get('TASK_PROFILE_MAX_BYTES', str(50 * 1024 * 1024)))
+
+ENABLED = SAMPLE_RATE > 0 or bool(DEBUG_TOKEN)
+
+_active = threading.Lock()
+
+_current_sampler = contextvars.ContextVar('profile_sampler', default=None)
+
+# one thread, so disk limit sweeps never run concurrently
+_writer = concurrent.futures.ThreadPoolExecutor(1, thread_name_prefix='profile-writer')
+
+
+def should_profile(request) -> bool:
+    if DEBUG_TOKEN and request.headers.get('x-debug-profile') == DEBUG_TOKEN:
+        return True
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class Sampler:
+    def __init__(self, thread_id: int, interval: float = INTERVAL):
+        self.thread_ids = {thread_id}
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def follow(self, thread_id: int):
+        self.thread_ids = self.thread_ids | {thread_id}
+
+    def unfollow(self, thread_id: int):
+        self.thread_ids = self.thread_ids - {thread_id}
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self.thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                if stack:
+                    self.stacks[';'.join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.items())
+
+
+def _route_dir(route: str) -> str:
+    slug = re.sub(r'[^A-Za-z0-9_.-]+', '_', route.strip('/')) or 'root'
+    return os.path.join(PROFILE_DIR, slug)
+
+
+def _enforce_disk_limit():
+    files = []
+    for directory, _, names in os.walk(PROFILE_DIR):
+        for name in names:
+            path = os.path.join(directory, name)
+            stat = os.stat(path)
+            files.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in files)
+    for _, size, path in sorted(files):
+        if total <= MAX_BYTES:
+            break
+        os.remove(path)
+        total -= size
+
+
+def save_profile(route: str, sampler: Sampler):
+    if not sampler.stacks:
+        return None
+    directory = _route_dir(route)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{random.randrange(16 ** 6):06x}.folded")
+    with open(path, 'w') as f:
+        f.write(sampler.folded())
+    _enforce_disk_limit()
+    return path
+
+
+def _followed(endpoint):
+    @functools.wraps(endpoint)
+    def run(*args, **kwargs):
+        sampler = _current_sampler.get()
+        if sampler is None:
+            return endpoint(*args, **kwargs)
+        thread_id = threading.get_ident()
+        sampler.follow(thread_id)
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            sampler.unfollow(thread_id)
+    return run
+
+
+class ProfiledRoute(APIRoute):
+    """APIRoute whose plain-function handlers are sampled in the worker thread running them."""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if not asyncio.iscoroutinefunction(endpoint):
+            endpoint = _followed(endpoint)
+        super().__init__(path, endpoint, **kwargs)
+
+
+async def profile_request(request, call_next):
+    if not should_profile(request) or not _active.acquire(blocking=False):
+        return await call_next(request)
+    try:
+        sampler = Sampler(threading.get_ident())
+        _current_sampler.set(sampler)
+        sampler.start()
+        try:
+            response = await call_next(request)
+        finally:
+            sampler.stop()
+        route = request.scope.get('route')
+        _writer.submit(save_profile, route.path if route else 'unmatched', sampler)
+        return response
+    finally:
+        _active.release()
@@ -0,0 +1,116 @@
+"""Scheduled job that removes soft deleted tasks and boards for good.
+
+Deleting a task or a board only writes its ``deleted_at``. Reads, queries
+and the board counters leave it out straight away, and the page offers an
+undo for TASK_UNDO_WINDOW seconds. After that this job hard deletes them in
+batches, a board's contents included, pausing between batches to stay under
+``--rate`` deletes a second so it doesn't compete with interactive traffic. It also deletes activity
+events past their retention (see activity.py), which Firestore's TTL policy
+does on its own but the local backends can't. It only does anything inside
+the off-peak hours (UTC) unless ``--now`` is given, and stops between
+batches once they are over, so it can run hourly from cron or Cloud Scheduler:
+
+    python purge.py --hours 2-6 --rate 100
+"""
+import argparse
+import datetime
+import os
+import time
+
+import dashboard
+from models import to_datetime
+
+
+UNDO_WINDOW = datetime.timedelta(seconds=int(os.environ.get('TASK_UNDO_WINDOW', '600')))
+OFF_PEAK_HOURS = os.environ.get('TASK_PURGE_HOURS', '2-6')
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def can_undo(data, now=None):
+    """Whether a soft deleted board or task is still inside the undo window."""
+    deleted_at = to_datetime(data.get('deleted_at'))
+    return deleted_at is not None and (now or _now()) - deleted_at < UNDO_WINDOW
+
+
+def parse_hours(value):
+    start, _, end = value.partition('-')
+    return int(start), int(end)
+
+
+def in_off_peak(now, hours=OFF_PEAK_HOURS):
+    start, end = parse_hours(hours)
+    if start <= end:
+        return start <= now.hour < end
+    # a window across midnight, e.g. 22-4
+    return now.hour >= start or now.hour < end
+
+
+def purge_deleted(store, batch_size=200, rate=None, now=None, sleep=time.sleep, hours=None, clock=_now):
+    """Hard delete everything deleted longer than UNDO_WINDOW ago and expired events, returns the counts.
+
+    With ``hours`` it stops before any batch that would start outside them, the
+    next run picks up where it left off.
+    """
+    now = now or _now()
+    cutoff = now - UNDO_WINDOW
+    purged = {'tasks': 0, 'boards': 0, 'events': 0}
+
+    def pace(deletes):
+        if rate and deletes:
+            sleep(deletes / rate)
+
+    def may_continue():
+        return hours is None or in_off_peak(clock(), hours)
+
+    while may_continue():
+        tasks = store.list_deleted_tasks(cutoff, batch_size)
+        if not tasks:
+            break
+        store.purge_tasks([(task['board_id'], task['id']) for task in tasks])
+        purged['tasks'] += len(tasks)
+        pace(len(tasks))
+
+    while may_continue():
+        boards = store.list_deleted_boards(cutoff, batch_size)
+        if not boards:
+            break
+        for board in boards:
+            # a big board's tasks are removed a batch at a time like everything else
+            removed = batch_size
+            while removed == batch_size:
+                if not may_continue():
+                    return purged
+                removed = store.purge_board_contents(board['id'], batch_size)
+                pace(removed)
+            dashboard.board_deleted(store, board)
+            store.delete_board(board['id'])
+            purged['boards'] += 1
+            pace(1)
+
+    while may_continue():
+        expired = store.purge_expired_activity(now, batch_size)
+        purged['events'] += expired
+        pace(expired)
+        if expired < batch_size:
+            break
+
+    return purged
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Hard delete boards and tasks whose undo window has passed, and expired activity")
+    parser.add_argument('--batch-size', type=int, default=200, help="documents read per batch")
+    parser.add_argument('--rate', type=float, default=100, help="deletes per second, 0 for no limit")
+    parser.add_argument('--hours', default=OFF_PEAK_HOURS, help="off-peak hours in UTC, e.g. 2-6 or 22-4")
+    parser.add_argument('--now', action='store_true', help="run even outside the off-peak hours")
+    args = parser.parse_args()
+
+    if not args.now and not in_off_peak(_now(), args.hours):
+        print(f"Outside the off-peak hours {args.hours} UTC, nothing purged")
+    else:
+        from storage import get_storage
+        purged = purge_deleted(get_storage(), args.batch_size, args.rate, hours=None if args.now else args.hours)
+        print(f"Purged {purged['tasks']} tasks, {purged['boards']} boards and {purged['events']} activity events")
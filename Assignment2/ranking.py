@@ -0,0 +1,178 @@
+"""Manual task ordering with lexicographic rank keys.
+
+Every task carries a ``rank`` string and boards list their tasks ordered by
+it. Moving a task gives it a key between its new neighbours' keys, so a move
+writes only the moved task's document however long the board is. Keys use
+the base 62 digits below, which sort the same as strings and as numbers, and
+never end in '0' so there is always room below a key.
+
+Keys grow by a digit every few moves into the same gap. Once a key is longer
+than TASK_RANK_MAX_LENGTH the board is rebalanced behind the response,
+rewriting every task with evenly spaced fixed width keys; this is the only
+write that touches more than one task. Boards from before ranks existed are
+ranked by the scheduled job below (see ensure_ranked), or behind the answer
+to the first move on them, never inside a request. Until then they are shown
+in in_board_order and tasks added to them get a rank of None, which every
+backend lists after the ranked tasks. The job rebalances long keys too:
+
+    python ranking.py --max-length 12
+"""
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DIGITS = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+BASE = len(DIGITS)
+
+# Rebalanced and appended keys are this many digits, a new task lands this far after the last
+WIDTH = 6
+APPEND_STEP = BASE ** 3
+
+MAX_RANK_LENGTH = int(os.environ.get('TASK_RANK_MAX_LENGTH', '12'))
+
+
+def _encode(value, width=WIDTH):
+    digits = []
+    for _ in range(width):
+        value, digit = divmod(value, BASE)
+        digits.append(DIGITS[digit])
+    return ''.join(reversed(digits)).rstrip('0')
+
+
+def _decode(key, width=WIDTH):
+    value = 0
+    for char in key[:width].ljust(width, '0'):
+        value = value * BASE + DIGITS.index(char)
+    return value
+
+
+def _midpoint(low, high):
+    """A key strictly between ``low`` ('' for the start) and ``high`` (None for the end)."""
+    if high is not None:
+        # keep the common prefix, '0' padding low to high's length
+        prefix = 0
+        while (low[prefix] if prefix < len(low) else '0') == high[prefix]:
+            prefix += 1
+        if prefix:
+            return high[:prefix] + _midpoint(low[prefix:], high[prefix:])
+    low_digit = DIGITS.index(low[0]) if low else 0
+    high_digit = DIGITS.index(high[0]) if high is not None else BASE
+    if high_digit - low_digit > 1:
+        return DIGITS[(low_digit + high_digit) // 2]
+    if high is not None and len(high) > 1:
+        return high[0]
+    return DIGITS[low_digit] + _midpoint(low[1:], None)
+
+
+def key_after(rank):
+    """The key for a task added after ``rank``, None for the first task on a board."""
+    if rank is None:
+        return _encode(APPEND_STEP)
+    width = max(WIDTH, len(rank))
+    value = _decode(rank, width) + APPEND_STEP
+    while value >= BASE ** width:
+        # past the last key of this width, a digit longer has room for BASE times as many
+        width += 1
+        value = _decode(rank, width) + APPEND_STEP
+    return _encode(value, width)
+
+
+def key_between(before, after):
+    """The key for a task moved between the tasks ranked ``before`` and ``after``.
+
+    Either may be None for the top or the bottom of the board.
+    """
+    if after is None:
+        return key_after(before)
+    if before is not None and before >= after:
+        raise ValueError(f"rank {before!r} is not before {after!r}")
+    return _midpoint(before or '', after)
+
+
+def keys_after(rank, count):
+    """Keys for ``count`` tasks appended in order after ``rank``."""
+    keys = []
+    for _ in range(count):
+        rank = key_after(rank)
+        keys.append(rank)
+    return keys
+
+
+def spaced_keys(count):
+    """``count`` keys spaced like appended ones, or evenly when they don't fit in half the range.
+
+    The other half is left for tasks added later.
+    """
+    if (count + 1) * APPEND_STEP <= BASE ** WIDTH // 2:
+        return keys_after(None, count)
+    step = BASE ** WIDTH // (count + 1)
+    return [_encode(step * (index + 1)) for index in range(count)]
+
+
+def last_rank(tasks):
+    ranks = [task['rank'] for task in tasks if task.get('rank')]
+    return max(ranks) if ranks else None
+
+
+def needs_rebalance(rank, max_length=MAX_RANK_LENGTH):
+    return len(rank) > max_length
+
+
+def in_board_order(tasks):
+    """``tasks`` sorted as the board shows them, tasks without a rank after the ranked ones."""
+    return sorted(tasks, key=lambda task: (task.get('rank') is None, task.get('rank') or '', task['id']))
+
+
+def rebalance_board(store, board_id):
+    """Give every task on the board a fresh evenly spaced key, keeping their order.
+
+    Tasks without a rank keep their listing order after the ranked ones.
+    Returns the number of tasks rewritten.
+    """
+    tasks = in_board_order(store.list_tasks(board_id, ['rank']))
+    ranks = dict(zip((task['id'] for task in tasks), spaced_keys(len(tasks))))
+    store.set_task_ranks(board_id, ranks)
+    logger.info("Rebalanced task ranks", extra={'board_id': board_id, 'tasks': len(ranks)})
+    return len(ranks)
+
+
+def ensure_ranked(store, board):
+    """Rank the tasks of a board created before ranks existed, once."""
+    if board.get('ranked'):
+        return
+    rebalance_board(store, board['id'])
+    store.update_board(board['id'], {'ranked': True})
+    board['ranked'] = True
+
+
+def rebalance_boards(store, max_length=MAX_RANK_LENGTH, board_chunk_size=100):
+    """Rebalance the boards that have a key longer than ``max_length`` or unranked tasks, or no ranks yet."""
+    rebalanced = 0
+    cursor = None
+    while True:
+        boards, cursor = store.list_boards(board_chunk_size, cursor)
+        for board in boards:
+            if not board.get('ranked'):
+                ensure_ranked(store, board)
+                rebalanced += 1
+                continue
+            tasks = store.list_tasks(board['id'], ['rank'])
+            # tasks added while the board was being ranked are left without one
+            if any(task.get('rank') is None or needs_rebalance(task['rank'], max_length) for task in tasks):
+                rebalance_board(store, board['id'])
+                rebalanced += 1
+        if cursor is None:
+            return rebalanced
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Rebalance the task rank keys of boards whose keys grew long")
+    parser.add_argument('--max-length', type=int, default=MAX_RANK_LENGTH)
+    parser.add_argument('--board-chunk-size', type=int, default=100, help="boards read per page")
+    args = parser.parse_args()
+
+    from storage import get_storage
+    rebalanced = rebalance_boards(get_storage(), args.max_length, args.board_chunk_size)
+    print(f"Rebalanced {rebalanced} boards")
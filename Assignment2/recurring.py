@@ -0,0 +1,273 @@
+"""Recurring tasks and the scheduled job that creates their occurrences.
+
+A board's recurring tasks live in its ``recurring`` subcollection. Each has
+the task's title, description and assignee, a rule saying which days it
+falls on, and ``next_due``, the first day that has no task yet. Rules are the
+day fields of a crontab line, ``day-of-month month day-of-week``, with the
+usual ``*``, lists, ranges and steps (day of week 0 or 7 is Sunday), or one
+of the ALIASES:
+
+    @weekly         every Monday
+    * * 1,3         every Monday and Wednesday
+    1,15 * *        the 1st and 15th of each month
+
+This job creates each occurrence as an ordinary task due on its day, at most
+WINDOW ahead, so boards don't fill up with tasks for the months ahead. It
+reads the due recurring tasks in one pass across all boards, ordered by
+``next_due``. Their occurrences are written a board at a time, in batches
+that also move each recurring task's ``next_due`` past the window.
+
+Occurrence ids are made from the recurring task's id and the day, and an
+occurrence is only written if no task has its id yet. A rerun after a
+failure skips the tasks already there, so it neither adds copies nor undoes
+a completion, an edit or a deletion made since.
+Each batch is conditional on the recurring tasks being unchanged since they
+were read (see conflicts.py), so two runs at once don't both write. Days
+missed while the job wasn't running are skipped rather than filled in.
+Run it from cron or Cloud Scheduler at least once a day:
+
+    python recurring.py --window-days 14
+"""
+import argparse
+import datetime
+import os
+
+import activity
+import dashboard
+import ranking
+import search
+from storage import SERVER_TIMESTAMP, VersionConflict
+
+
+WINDOW = datetime.timedelta(days=int(os.environ.get('TASK_RECURRING_WINDOW_DAYS', '14')))
+MAX_WINDOW_DAYS = 366
+
+# Writes per batch, a recurring task's occurrences and its advance always go in the same one
+BATCH_SIZE = 400
+
+# Recurring tasks read from the stream before they are grouped by board and written
+CHUNK_SIZE = 500
+
+ALIASES = {
+    '@daily': '* * *',
+    '@weekdays': '* * 1-5',
+    '@weekly': '* * 1',
+    '@monthly': '1 * *',
+}
+
+# (lowest, highest) of day of month, month and day of week
+_FIELD_RANGES = ((1, 31), (1, 12), (0, 7))
+
+# every date a rule can match comes round within four years (29 February)
+_SEARCH_DAYS = 4 * 366
+
+
+def _today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+
+def _parse_field(text, lowest, highest):
+    values = set()
+    for part in text.split(','):
+        value_range, _, step = part.partition('/')
+        try:
+            if value_range == '*':
+                start, end = lowest, highest
+            else:
+                start, _, end = value_range.partition('-')
+                start = int(start)
+                end = int(end) if end else (highest if step else start)
+            step = int(step) if step else 1
+        except ValueError:
+            raise ValueError(f"{part!r} is not a number, range or step")
+        if not lowest <= start <= end <= highest or step < 1:
+            raise ValueError(f"{part!r} is out of range {lowest}-{highest}")
+        values.update(range(start, end + 1, step))
+    return values
+
+
+def parse_rule(rule):
+    """``(days, months, weekdays, any_day_of_month, any_weekday)`` for a rule, raises ValueError."""
+    text = ALIASES.get(rule.strip().lower(), rule)
+    fields = text.split()
+    if len(fields) != 3:
+        raise ValueError("a rule has three fields: day of month, month and day of week")
+    try:
+        days, months, weekdays = (_parse_field(field, lowest, highest)
+                                  for field, (lowest, highest) in zip(fields, _FIELD_RANGES))
+    except ValueError as err:
+        raise ValueError(f"invalid rule {rule!r}: {err}")
+    if 7 in weekdays:
+        weekdays = (weekdays - {7}) | {0}
+    parsed = (days, months, weekdays, fields[0] == '*', fields[2] == '*')
+    if next_on_or_after(parsed, _today()) is None:
+        raise ValueError(f"{rule!r} never falls on a real date")
+    return parsed
+
+
+def _matches(parsed, day):
+    days, months, weekdays, any_day, any_weekday = parsed
+    if day.month not in months:
+        return False
+    on_day = day.day in days
+    on_weekday = (day.weekday() + 1) % 7 in weekdays
+    # like cron, a day of month and a day of week are either-or when both are given
+    if not any_day and not any_weekday:
+        return on_day or on_weekday
+    return on_day and on_weekday
+
+
+def next_on_or_after(parsed, day):
+    """The first day on or after ``day`` the rule falls on, None if there is none."""
+    for offset in range(_SEARCH_DAYS):
+        candidate = day + datetime.timedelta(days=offset)
+        if _matches(parsed, candidate):
+            return candidate
+    return None
+
+
+def occurrences(parsed, start, end):
+    """Days from ``start`` to ``end`` inclusive that the rule falls on."""
+    days = []
+    day = start
+    while day <= end:
+        if _matches(parsed, day):
+            days.append(day)
+        day += datetime.timedelta(days=1)
+    return days
+
+
+def occurrence_id(rule_id, day):
+    return f"{rule_id}-{day:%Y%m%d}"
+
+
+def new_rule(title, description, rule, assigned_users, creator_id, today=None):
+    """The document for a recurring task, raises ValueError when the rule is invalid."""
+    parsed = parse_rule(rule)
+    return {
+        'title': title,
+        'description': description,
+        'rule': rule.strip(),
+        'assigned_users': assigned_users,
+        'creator_id': creator_id,
+        'created_at': SERVER_TIMESTAMP,
+        'next_due': next_on_or_after(parsed, today or _today()).isoformat()
+    }
+
+
+def _occurrence(rule, day, members):
+    return {
+        'title': f"{rule['title']} ({day.isoformat()})",
+        'description': rule.get('description') or '',
+        'creator_id': rule['creator_id'],
+        # assignees who have left the board are dropped like removed members are
+        'assigned_users': [user for user in rule.get('assigned_users') or [] if user in members],
+        'status': 'pending',
+        'created_at': SERVER_TIMESTAMP,
+        'due_date': day.isoformat(),
+        'completed_at': None,
+        'recurring_id': rule['id']
+    }
+
+
+def materialize_board(store, board_id, rules, today=None, window=WINDOW, batch_size=BATCH_SIZE):
+    """Create the occurrences of a board's due ``rules`` up to ``window`` ahead, returns the counts."""
+    today = today or _today()
+    horizon = today + window
+    counts = {'tasks': 0, 'recurring': 0, 'conflicts': 0}
+    board = store.get_board(board_id)
+    if board is None:
+        # soft deleted boards catch up once they are restored
+        return counts
+    members = set(board.get('members', []))
+    # unranked boards are left for ranking.py to rank
+    ranked = bool(board.get('ranked'))
+    rank = store.find_last_rank(board_id) if ranked else None
+    tasks, advances = {}, {}
+
+    def flush():
+        nonlocal rank
+        ids = list(tasks)
+        # occurrences go to the bottom of the board in date order
+        ids.sort(key=lambda task_id: tasks[task_id]['due_date'])
+        ranks = ranking.keys_after(rank, len(ids)) if ranked else [None] * len(ids)
+        for task_id, task_rank in zip(ids, ranks):
+            tasks[task_id]['rank'] = task_rank
+        event = activity.event(activity.TASKS_SCHEDULED, None, count=len(ids)) if ids else None
+        try:
+            created = store.materialize_recurring(board_id, tasks, advances, event)
+        except VersionConflict:
+            counts['conflicts'] += len(advances)
+        else:
+            if ids:
+                rank = tasks[ids[-1]]['rank']
+            if created:
+                # occurrences already on the board were left as they are
+                search.index_new_tasks(store, board_id, ((task_id, tasks[task_id]) for task_id in created))
+                dashboard.tasks_changed(store, board, total=len(created))
+            counts['tasks'] += len(created)
+            counts['recurring'] += len(advances)
+        tasks.clear()
+        advances.clear()
+
+    for rule in rules:
+        parsed = parse_rule(rule['rule'])
+        start = max(datetime.date.fromisoformat(rule['next_due']), today)
+        days = occurrences(parsed, start, horizon)
+        if len(tasks) + len(advances) + len(days) + 1 > batch_size:
+            flush()
+        for day in days:
+            tasks[occurrence_id(rule['id'], day)] = _occurrence(rule, day, members)
+        following = next_on_or_after(parsed, horizon + datetime.timedelta(days=1))
+        advances[rule['id']] = (rule.get('version'), following.isoformat())
+    if advances:
+        flush()
+    if rank is not None and ranking.needs_rebalance(rank):
+        ranking.rebalance_board(store, board_id)
+    return counts
+
+
+def materialize_added(store, board_id, rule_id, today=None, window=WINDOW):
+    """Create the occurrences of a recurring task just added, rather than waiting for the next run."""
+    today = today or _today()
+    horizon = (today + window).isoformat()
+    rule = store.get_recurring(board_id, rule_id)
+    rules = [rule] if rule is not None and rule['next_due'] <= horizon else []
+    return materialize_board(store, board_id, rules, today, window)
+
+
+def materialize_due(store, today=None, window=WINDOW, batch_size=BATCH_SIZE, chunk_size=CHUNK_SIZE):
+    """Create every board's occurrences up to ``window`` ahead, returns the counts."""
+    today = today or _today()
+    totals = {'tasks': 0, 'recurring': 0, 'conflicts': 0}
+    chunk = {}
+
+    def flush():
+        for board_id, rules in chunk.items():
+            for key, count in materialize_board(store, board_id, rules, today, window, batch_size).items():
+                totals[key] += count
+        chunk.clear()
+
+    pending = 0
+    for rule in store.iter_due_recurring((today + window).isoformat()):
+        chunk.setdefault(rule['board_id'], []).append(rule)
+        pending += 1
+        if pending >= chunk_size:
+            flush()
+            pending = 0
+    flush()
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Create the upcoming occurrences of every board's recurring tasks")
+    parser.add_argument('--window-days', type=int, default=WINDOW.days,
+                        help=f"how far ahead to create tasks, at most {MAX_WINDOW_DAYS}")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help="writes per batch")
+    args = parser.parse_args()
+
+    from storage import get_storage
+    window = datetime.timedelta(days=min(args.window_days, MAX_WINDOW_DAYS))
+    totals = materialize_due(get_storage(), window=window, batch_size=args.batch_size)
+    print(f"Created {totals['tasks']} tasks for {totals['recurring']} recurring tasks, "
+          f"{totals['conflicts']} skipped as changed by another run")
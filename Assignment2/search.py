@@ -0,0 +1,139 @@
+"""Task search backed by an inverted index of title/description tokens.
+
+The index is kept up to date incrementally by the task routes through
+index_task(). Run ``python search.py rebuild`` to rebuild it from scratch;
+boards are streamed in chunks so the job never holds the whole dataset.
+"""
+import argparse
+import re
+from collections import Counter
+
+
+TITLE_WEIGHT = 3
+DESCRIPTION_WEIGHT = 1
+MIN_TERM_LENGTH = 2
+MAX_TOKEN_LENGTH = 40
+
+# Postings read per page; every page of a term is read, so no match is missed
+POSTINGS_PAGE_SIZE = 500
+
+# Tasks read per page when rebuilding a board's index
+REBUILD_PAGE_SIZE = 500
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    if not text:
+        return []
+    return [word[:MAX_TOKEN_LENGTH] for word in _WORD.findall(text.lower()) if len(word) >= MIN_TERM_LENGTH]
+
+
+def task_tokens(task):
+    """Token weights for a task; title words count more than description words."""
+    if not task:
+        return {}
+    weights = Counter()
+    for token in tokenize(task.get('title')):
+        weights[token] += TITLE_WEIGHT
+    for token in tokenize(task.get('description')):
+        weights[token] += DESCRIPTION_WEIGHT
+    return dict(weights)
+
+
+def index_task(store, board_id, task_id, old_task, new_task):
+    """Apply the difference between a task's old and new text to the index."""
+    old_tokens = task_tokens(old_task)
+    new_tokens = task_tokens(new_task)
+    added = {token: weight for token, weight in new_tokens.items() if old_tokens.get(token) != weight}
+    removed = [token for token in old_tokens if token not in new_tokens]
+    if added or removed:
+        store.index_task_tokens(board_id, task_id, added, removed)
+
+
+def index_new_tasks(store, board_id, tasks):
+    """Index freshly created ``(task_id, task)`` pairs with one bulk write."""
+    postings = {}
+    for task_id, task in tasks:
+        for token, weight in task_tokens(task).items():
+            postings.setdefault(token, {})[task_id] = weight
+    if postings:
+        store.add_search_postings(board_id, postings)
+
+
+def _postings(store, board_ids, term):
+    cursor = None
+    while True:
+        postings, cursor = store.find_search_postings(board_ids, term, POSTINGS_PAGE_SIZE, cursor)
+        yield from postings
+        if cursor is None:
+            return
+
+
+def search_tasks(store, board_ids, query, limit=20):
+    """Tasks in ``board_ids`` matching every term of ``query`` as a prefix, best first.
+
+    Exact token matches score double, and title matches outweigh description
+    matches through the token weights. Terms are looked up longest first,
+    those usually match the fewest tasks, and each later term only in the
+    boards that still have a candidate.
+    """
+    terms = sorted(dict.fromkeys(tokenize(query)), key=len, reverse=True)
+    if not terms or not board_ids:
+        return []
+
+    scores = None
+    for term in terms:
+        term_scores = {}
+        for board_id, token, task_id, weight in _postings(store, board_ids, term):
+            ref = (board_id, task_id)
+            if scores is not None and ref not in scores:
+                continue
+            score = weight * (2 if token == term else 1)
+            if score > term_scores.get(ref, 0):
+                term_scores[ref] = score
+        if scores is None:
+            scores = term_scores
+        else:
+            scores = {ref: scores[ref] + score for ref, score in term_scores.items()}
+        if not scores:
+            return []
+        board_ids = sorted({board_id for board_id, _ in scores})
+
+    ranked = sorted(scores.items(), key=lambda item: -item[1])[:limit]
+    results = []
+    for (ref, score), task in zip(ranked, store.get_tasks([ref for ref, _ in ranked])):
+        if task is not None:
+            task['score'] = score
+            results.append(task)
+    return results
+
+
+def rebuild(store, chunk_size=100):
+    boards_done = tasks_done = 0
+    cursor = None
+    while True:
+        boards, cursor = store.list_boards(chunk_size, cursor)
+        for board in boards:
+            store.clear_search_index(board['id'])
+            task_cursor = None
+            while True:
+                tasks, task_cursor = store.list_tasks_page(board['id'], REBUILD_PAGE_SIZE, task_cursor)
+                index_new_tasks(store, board['id'], ((task['id'], task) for task in tasks))
+                tasks_done += len(tasks)
+                if task_cursor is None:
+                    break
+            boards_done += 1
+        print(f"Indexed {tasks_done} tasks from {boards_done} boards")
+        if cursor is None:
+            return boards_done, tasks_done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Task search index maintenance")
+    parser.add_argument('command', choices=['rebuild'])
+    parser.add_argument('--chunk-size', type=int, default=100, help="boards read per page")
+    args = parser.parse_args()
+
+    from storage import get_storage
+    rebuild(get_storage(), args.chunk_size)
@@ -0,0 +1,77 @@
+"""Production launcher: several uvicorn workers on uvloop and httptools.
+
+    python serve.py --workers 4 --port 8080
+
+Workers default to WEB_CONCURRENCY or the number of cores. With more than
+one worker the verified-token cache, the member directory and the rate limit
+buckets move to SQLite files under TASK_RUNTIME_DIR so every worker shares
+them. Send SIGHUP to the launcher to restart the workers one at a time
+(e.g. after a deploy); each finishes its in-flight requests first.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import tempfile
+
+import uvicorn
+
+
+def _available(module):
+    return importlib.util.find_spec(module) is not None
+
+
+def default_workers():
+    return int(os.environ.get('WEB_CONCURRENCY') or os.cpu_count() or 1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the app with multiple worker processes")
+    parser.add_argument('--host', default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=default_workers())
+    parser.add_argument('--keep-alive', type=int, default=int(os.environ.get('TASK_KEEP_ALIVE', '75')),
+                        help="seconds to hold idle connections open, keep above the load balancer's")
+    parser.add_argument('--graceful-timeout', type=int, default=30,
+                        help="seconds a stopping worker gets to finish in-flight requests")
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--max-requests', type=int, default=None,
+                        help="restart a worker after this many requests")
+    parser.add_argument('--reload', action='store_true', help="restart on code changes (development, one worker)")
+    args = parser.parse_args(argv)
+
+    # main.py expects to be imported from its own directory
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+
+    workers = 1 if args.reload else max(1, args.workers)
+    if workers > 1 and os.environ.get('TASK_STORAGE') == 'memory':
+        print("The memory backend can't be shared between processes, running one worker", file=sys.stderr)
+        workers = 1
+
+    if workers > 1:
+        runtime_dir = os.environ.get('TASK_RUNTIME_DIR') or os.path.join(tempfile.gettempdir(), f'task-management-{args.port}')
+        os.makedirs(runtime_dir, exist_ok=True)
+        # inherited by the worker processes, read when they import main
+        os.environ.setdefault('TASK_SHARED_CACHE_PATH', os.path.join(runtime_dir, 'cache.db'))
+        os.environ.setdefault('TASK_RATE_LIMIT_PATH', os.path.join(runtime_dir, 'rate_limits.db'))
+
+    uvicorn.run(
+        'main:app',
+        host=args.host,
+        port=args.port,
+        workers=workers,
+        reload=args.reload,
+        loop='uvloop' if _available('uvloop') else 'auto',
+        http='httptools' if _available('httptools') else 'auto',
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        backlog=args.backlog,
+        limit_max_requests=args.max_requests,
+        # the app writes its own structured access log
+        access_log=False,
+        proxy_headers=True
+    )
+
+
+if __name__ == '__main__':
+    main()
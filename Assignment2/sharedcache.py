@@ -0,0 +1,98 @@
+"""Caches that can be shared by every worker process on a host.
+
+Each worker keeps a small in-process cache. When TASK_SHARED_CACHE_PATH is
+set (serve.py sets it when running more than one worker) misses fall
+through to a SQLite file all workers read and write, so a token verified or
+an email looked up by one worker is a hit for the others instead of every
+worker filling its own cache from cold.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+SHARED_CACHE_PATH = os.environ.get('TASK_SHARED_CACHE_PATH', '')
+
+# Expired rows are purged from the shared file every this many writes
+PURGE_EVERY = 1000
+
+
+class LocalCache:
+    """Bounded in-process cache, entries expire at an absolute time."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            return None
+        return entry[0]
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            if key not in self._entries and len(self._entries) >= self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+            self._entries[key] = (value, expires_at)
+
+
+class SQLiteCache:
+    """Cache in a SQLite file shared between processes, values are stored as JSON."""
+
+    def __init__(self, path, name):
+        self.name = name
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS cache '
+                           '(name TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, expires REAL NOT NULL, '
+                           'PRIMARY KEY (name, key))')
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT value FROM cache WHERE name = ? AND key = ? AND expires > ?',
+                                     (self.name, key, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO cache (name, key, value, expires) VALUES (?, ?, ?, ?)',
+                               (self.name, key, json.dumps(value, default=str), expires_at))
+            self._writes += 1
+            if self._writes % PURGE_EVERY == 0:
+                self._conn.execute('DELETE FROM cache WHERE expires <= ?', (time.time(),))
+
+
+class TieredCache:
+    """In-process cache in front of the shared one."""
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+
+    def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            return value
+        entry = self.shared.get(key)
+        if entry is not None:
+            self.local.set(key, entry['value'], entry['expires_at'])
+            return entry['value']
+        return None
+
+    def set(self, key, value, expires_at):
+        self.local.set(key, value, expires_at)
+        self.shared.set(key, {'value': value, 'expires_at': expires_at}, expires_at)
+
+
+def get_cache(name, max_entries):
+    local = LocalCache(max_entries)
+    if not SHARED_CACHE_PATH:
+        return local
+    return TieredCache(local, SQLiteCache(SHARED_CACHE_PATH, name))
@@ -22,6 +22,34 @@ let registeredUsers = {};
 // Add token refresh handling
 let tokenRefreshInterval;
 
+// Static files and pages are cached by the service worker in sw.js, registered with
+// the fingerprint this module was loaded with so a deploy installs a fresh one
+const ASSET_VERSION = new URL(import.meta.url).searchParams.get('v');
+
+if ('serviceWorker' in navigator && ASSET_VERSION) {
+    navigator.serviceWorker.register(`/static/sw.js?v=${ASSET_VERSION}`, { scope: '/' })
+    .catch((error) => {
+        console.error("Service worker registration failed:", error);
+    });
+    // completions queued while offline are sent once the connection is back
+    window.addEventListener("online", function() {
+        if (navigator.serviceWorker.controller) {
+            navigator.serviceWorker.controller.postMessage({ type: 'online' });
+        }
+    });
+}
+
+// Cached pages and queued completions belong to whoever is signed in, drop them when that changes
+function forgetSession() {
+    if (!('serviceWorker' in navigator) || !('caches' in window)) {
+        return Promise.resolve();
+    }
+    if (navigator.serviceWorker.controller) {
+        navigator.serviceWorker.controller.postMessage({ type: 'session-changed' });
+    }
+    return caches.delete('pages').catch(() => false);
+}
+
 window.addEventListener("load", function() {
     const app = initializeApp(firebaseConfig);
     auth = getAuth(auth);
@@ -79,6 +107,7 @@ function clearAuthState() {
     }
     
     updateUIForUnauthenticatedUser();
+    return forgetSession();
 }
 
 // Set up token refresh
@@ -288,7 +317,9 @@ function setupSignUpButton() {
                 user.getIdToken().then((token) => {
                     document.cookie = "token=" + token + ";path=/;SameSite=Strict";
                     setupTokenRefresh(user);
-                    window.location = "/";
+                    forgetSession().then(() => {
+                        window.location = "/";
+                    });
                 });
             })
             .catch((error) => {
@@ -338,7 +369,9 @@ function setupLoginButton() {
                 user.getIdToken().then((token) => {
                     document.cookie = "token=" + token + ";path=/;SameSite=Strict";
                     setupTokenRefresh(user);
-                    window.location = "/";
+                    forgetSession().then(() => {
+                        window.location = "/";
+                    });
                 });
             })
             .catch((error) => {
@@ -374,13 +407,15 @@ function setupSignOutButton() {
             
             signOut(auth)
             .then(() => {
-                clearAuthState();
-                window.location = "/";
+                clearAuthState().then(() => {
+                    window.location = "/";
+                });
             })
             .catch((error) => {
                 console.error("Error signing out:", error);
-                clearAuthState();
-                window.location = "/";
+                clearAuthState().then(() => {
+                    window.location = "/";
+                });
             });
         });
     }
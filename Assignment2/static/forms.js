@@ -0,0 +1,108 @@
+'use strict';
+
+// Forms marked with data-fetch are posted in the background. The routes see the
+// X-Requested-With header and answer with JSON instead of redirecting, so the
+// page is updated in place rather than reloaded. Without JavaScript the forms
+// post normally and the redirects still apply.
+
+const MESSAGE_STYLES = {
+    success: 'background-color: #e8f5e9; color: #2e7d32;',
+    error: 'background-color: #ffebee; color: #c62828;'
+};
+
+function showMessage(form, kind, text) {
+    const container = form.closest('.form-container') || form;
+    let message = container.parentNode.querySelector('.fetch-message');
+    if (!message) {
+        message = document.createElement('div');
+        message.className = 'fetch-message';
+        container.parentNode.insertBefore(message, container);
+    }
+    message.style.cssText = MESSAGE_STYLES[kind] + ' padding: 10px 15px; border-radius: 4px; margin-bottom: 20px; font-size: 14px;';
+    message.textContent = text;
+}
+
+function updateCounters(deltas) {
+    for (const [name, delta] of Object.entries(deltas || {})) {
+        const counter = document.querySelector(`[data-counter="${name}"]`);
+        if (counter) {
+            counter.textContent = parseInt(counter.textContent, 10) + delta;
+        }
+    }
+}
+
+const handlers = {
+    complete(form, data) {
+        const item = form.closest('.task-item');
+        if (item && data.html) {
+            item.outerHTML = data.html;
+        }
+        updateCounters(data.counters);
+    },
+    create(form, data) {
+        showMessage(form, 'success', data.message);
+        form.reset();
+        form.querySelector('[name="title"]').focus();
+    },
+    edit(form, data) {
+        showMessage(form, 'success', data.message);
+        // the next save is checked against what was just written (see conflicts.py)
+        for (const name of ['version', 'base']) {
+            const input = form.querySelector(`[name="${name}"]`);
+            if (input && data[name]) {
+                input.value = data[name];
+            }
+        }
+    }
+};
+
+document.addEventListener('submit', async function(event) {
+    const form = event.target;
+    const handler = handlers[form.dataset.fetch];
+    if (!handler) {
+        return;
+    }
+    event.preventDefault();
+
+    const button = form.querySelector('[type="submit"]');
+    if (button) {
+        button.disabled = true;
+    }
+    let response;
+    try {
+        response = await fetch(form.action, {
+            method: 'POST',
+            body: new FormData(form),
+            headers: { 'X-Requested-With': 'fetch', 'Accept': 'application/json' },
+            credentials: 'same-origin'
+        });
+    } catch (err) {
+        // network trouble, let the browser post the form itself
+        form.submit();
+        return;
+    }
+    try {
+        const contentType = response.headers.get('content-type') || '';
+        if (response.redirected || !contentType.includes('application/json')) {
+            // signed out or no longer a member: follow the redirect like a normal post would
+            window.location.href = response.url;
+            return;
+        }
+        const data = await response.json();
+        if (data.queued) {
+            // offline: the service worker (sw.js) sends it once the connection is back
+            showMessage(form, 'success', "You're offline, this will be saved when you reconnect.");
+        } else if (response.ok) {
+            handler(form, data);
+        } else if (data.conflict) {
+            // changed by someone else: post normally, the server answers with the conflict page
+            form.submit();
+        } else {
+            showMessage(form, 'error', data.error || data.detail || 'Something went wrong, please try again.');
+        }
+    } finally {
+        if (button) {
+            button.disabled = false;
+        }
+    }
+});
@@ -0,0 +1,77 @@
+'use strict';
+
+// Tasks can be dragged to a new position on the board. The task is moved in the
+// page straight away and its new neighbours are posted to the move route, which
+// gives it a rank between theirs. If the board changed meanwhile the page is
+// reloaded to show the order everyone else sees.
+
+function neighbourId(item, direction) {
+    const sibling = item[direction];
+    return sibling && sibling.classList.contains('task-item') ? sibling.dataset.taskId : '';
+}
+
+async function saveMove(list, item) {
+    const body = new URLSearchParams({
+        before_id: neighbourId(item, 'previousElementSibling'),
+        after_id: neighbourId(item, 'nextElementSibling')
+    });
+    try {
+        const response = await fetch(`/api/board/${list.dataset.boardId}/task/${item.dataset.taskId}/move`, {
+            method: 'POST',
+            body: body,
+            headers: { 'X-Requested-With': 'fetch', 'Accept': 'application/json' },
+            credentials: 'same-origin'
+        });
+        if (!response.ok) {
+            window.location.reload();
+        }
+    } catch (err) {
+        window.location.reload();
+    }
+}
+
+document.addEventListener('DOMContentLoaded', function() {
+    const list = document.querySelector('.tasks-list[data-board-id]');
+    if (!list) {
+        return;
+    }
+    let dragged = null;
+    let startNext = null;
+
+    list.addEventListener('dragstart', function(event) {
+        dragged = event.target.closest('.task-item');
+        if (!dragged) {
+            return;
+        }
+        startNext = dragged.nextElementSibling;
+        dragged.classList.add('dragging');
+        event.dataTransfer.effectAllowed = 'move';
+        event.dataTransfer.setData('text/plain', dragged.dataset.taskId);
+    });
+
+    list.addEventListener('dragover', function(event) {
+        if (!dragged) {
+            return;
+        }
+        event.preventDefault();
+        const target = event.target.closest('.task-item');
+        if (!target || target === dragged) {
+            return;
+        }
+        const box = target.getBoundingClientRect();
+        const after = event.clientY > box.top + box.height / 2;
+        list.insertBefore(dragged, after ? target.nextElementSibling : target);
+    });
+
+    list.addEventListener('dragend', function() {
+        if (!dragged) {
+            return;
+        }
+        const item = dragged;
+        dragged = null;
+        item.classList.remove('dragging');
+        if (item.nextElementSibling !== startNext) {
+            saveMove(list, item);
+        }
+    });
+});
@@ -0,0 +1,218 @@
+'use strict';
+
+// Service worker for the whole site, registered from firebase-login.js with the
+// static files' fingerprint (see assets.py). It
+//  - precaches the static files under that fingerprint, and keeps the versioned
+//    Firebase SDK modules once they have been fetched,
+//  - shows the last copy of the dashboard and of each board straight away and
+//    refreshes it in the background, at most every REVALIDATE_AFTER_MS,
+//  - queues task completions made while offline and replays them once the
+//    connection is back, each client after a random delay so a crowd of
+//    reconnecting clients doesn't post all at once.
+// Any other write forgets the cached copies of the pages it changes, so the
+// redirect after it always shows the server's version.
+
+const VERSION = new URL(self.location).searchParams.get('v') || 'dev';
+const ASSET_CACHE = `assets-${VERSION}`;
+const PAGE_CACHE = 'pages';
+
+// every file in static/ except this one
+const ASSETS = ['/static/firebase-login.js', '/static/forms.js', '/static/ordering.js'];
+const SDK_PREFIX = 'https://www.gstatic.com/firebasejs/';
+
+const PAGE_PATH = /^\/(board\/[^/]+)?$/;
+const BOARD_PATH = /^\/(?:api\/)?board\/([^/]+)/;
+const COMPLETE_PATH = /^\/board\/([^/]+)\/task\/[^/]+\/complete$/;
+
+const REVALIDATE_AFTER_MS = 30 * 1000;
+const REPLAY_JITTER_MS = 15 * 1000;
+const CACHED_AT = 'X-Cached-At';
+
+self.addEventListener('install', function(event) {
+    event.waitUntil(caches.open(ASSET_CACHE)
+        .then(cache => cache.addAll(ASSETS.map(path => `${path}?v=${VERSION}`)))
+        .then(() => self.skipWaiting()));
+});
+
+self.addEventListener('activate', function(event) {
+    // cached pages link to the previous fingerprint, drop them with its assets
+    event.waitUntil(caches.keys()
+        .then(keys => Promise.all(keys.filter(key => key !== ASSET_CACHE).map(key => caches.delete(key))))
+        .then(() => self.clients.claim())
+        .then(replayLater));
+});
+
+self.addEventListener('fetch', function(event) {
+    const request = event.request;
+    const url = new URL(request.url);
+    if (url.href.startsWith(SDK_PREFIX)) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.origin !== self.location.origin) {
+        return;
+    } else if (request.method !== 'GET') {
+        event.respondWith(sendWrite(request, url));
+    } else if (url.pathname.startsWith('/static/')) {
+        event.respondWith(cacheFirst(request));
+    } else if (request.mode === 'navigate' && PAGE_PATH.test(url.pathname)) {
+        event.respondWith(staleWhileRevalidate(event, request, url));
+    }
+});
+
+self.addEventListener('message', function(event) {
+    if (event.data.type === 'online') {
+        event.waitUntil(replayLater());
+    } else if (event.data.type === 'session-changed') {
+        // the pages and queued completions belong to whoever was signed in
+        event.waitUntil(Promise.all([caches.delete(PAGE_CACHE), outbox('readwrite', store => store.clear())]));
+    }
+});
+
+self.addEventListener('sync', function(event) {
+    if (event.tag === 'replay-completions') {
+        event.waitUntil(replayLater());
+    }
+});
+
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok && request.url.startsWith(SDK_PREFIX)) {
+        const cache = await caches.open(ASSET_CACHE);
+        await cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function stamped(response) {
+    const headers = new Headers(response.headers);
+    headers.set(CACHED_AT, String(Date.now()));
+    return new Response(await response.blob(), { status: response.status, statusText: response.statusText, headers });
+}
+
+async function staleWhileRevalidate(event, request, url) {
+    const cache = await caches.open(PAGE_CACHE);
+    const cached = await cache.match(url.pathname);
+    // pages with a query (undo banners) always come from the server
+    const cacheable = !url.search;
+
+    async function refresh() {
+        const response = await fetch(request);
+        if (cacheable && response.ok && !response.redirected) {
+            await cache.put(url.pathname, await stamped(response.clone()));
+        }
+        return response;
+    }
+
+    if (!cached || !cacheable) {
+        try {
+            return await refresh();
+        } catch (err) {
+            if (cached) {
+                return cached;
+            }
+            throw err;
+        }
+    }
+    if (Date.now() - Number(cached.headers.get(CACHED_AT) || 0) > REVALIDATE_AFTER_MS) {
+        event.waitUntil(refresh().catch(() => undefined));
+    }
+    return cached;
+}
+
+async function forgetPages(url) {
+    const cache = await caches.open(PAGE_CACHE);
+    const board = url.pathname.match(BOARD_PATH);
+    await cache.delete('/');
+    if (board) {
+        await cache.delete(`/board/${board[1]}`);
+    }
+}
+
+async function sendWrite(request, url) {
+    const complete = url.pathname.match(COMPLETE_PATH);
+    const body = complete ? await request.clone().text() : null;
+    try {
+        const response = await fetch(request);
+        await forgetPages(url);
+        return response;
+    } catch (err) {
+        if (!complete) {
+            throw err;
+        }
+    }
+    await outbox('readwrite', store => store.add({
+        url: url.href,
+        body: body,
+        contentType: request.headers.get('Content-Type')
+    }));
+    if (self.registration.sync) {
+        await self.registration.sync.register('replay-completions').catch(() => undefined);
+    }
+    if (request.mode === 'navigate') {
+        // a plain form post, back to the board as the server would redirect
+        return Response.redirect(`/board/${complete[1]}`, 303);
+    }
+    return new Response(JSON.stringify({ queued: true }), {
+        status: 202,
+        headers: { 'Content-Type': 'application/json' }
+    });
+}
+
+function outbox(mode, action) {
+    return new Promise(function(resolve, reject) {
+        const open = indexedDB.open('outbox', 1);
+        open.onupgradeneeded = () => open.result.createObjectStore('requests', { autoIncrement: true });
+        open.onerror = () => reject(open.error);
+        open.onsuccess = function() {
+            const transaction = open.result.transaction('requests', mode);
+            const request = action(transaction.objectStore('requests'));
+            transaction.oncomplete = () => resolve(request.result);
+            transaction.onerror = () => reject(transaction.error);
+        };
+    });
+}
+
+let replaying = null;
+
+function replayLater() {
+    if (!replaying) {
+        const delay = Math.random() * REPLAY_JITTER_MS;
+        replaying = new Promise(resolve => setTimeout(resolve, delay))
+            .then(replayQueued)
+            .finally(() => { replaying = null; });
+    }
+    return replaying;
+}
+
+async function replayQueued() {
+    const keys = await outbox('readonly', store => store.getAllKeys());
+    for (const key of keys) {
+        const item = await outbox('readonly', store => store.get(key));
+        if (!item) {
+            continue;
+        }
+        let response;
+        try {
+            response = await fetch(item.url, {
+                method: 'POST',
+                body: item.body,
+                headers: { 'Content-Type': item.contentType, 'X-Requested-With': 'fetch', 'Accept': 'application/json' },
+                credentials: 'same-origin',
+                redirect: 'manual'
+            });
+        } catch (err) {
+            // still offline, the next reconnect tries again
+            return;
+        }
+        if (response.status === 429 || response.status >= 500) {
+            // rate limited or shedding load, leave the rest for later
+            return;
+        }
+        // done, or refused for good (signed out, task gone)
+        await outbox('readwrite', store => store.delete(key));
+        await forgetPages(new URL(item.url));
+    }
+}
@@ -0,0 +1,2361 @@
+import abc
+import bisect
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import sqlite3
+import string
+import threading
+from typing import Dict, Any, List, Optional
+
+from google.api_core.datetime_helpers import DatetimeWithNanoseconds
+from google.api_core.exceptions import AlreadyExists, FailedPrecondition, NotFound
+from google.cloud import firestore
+
+import deadlines
+
+
+# Sentinel used by callers for "set this to the time of the write".
+# Firestore resolves it server side, the local backends replace it with now().
+SERVER_TIMESTAMP = firestore.SERVER_TIMESTAMP
+
+_ID_ALPHABET = string.ascii_letters + string.digits
+
+
+def new_document_id():
+    # same shape as the ids Firestore hands out for auto-generated documents
+    return ''.join(random.choices(_ID_ALPHABET, k=20))
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _resolve_timestamps(data: Dict[str, Any], now=None) -> Dict[str, Any]:
+    resolved = {}
+    for key, value in data.items():
+        if value is SERVER_TIMESTAMP:
+            if now is None:
+                now = _now()
+            value = now
+        elif isinstance(value, dict):
+            value = _resolve_timestamps(value, now)
+        resolved[key] = value
+    return resolved
+
+
+class VersionConflict(Exception):
+    """The document changed after the version an update was based on was read."""
+
+
+class DocumentDeleted(KeyError):
+    """The document an update was for no longer exists, e.g. purged since it was read."""
+
+
+class Storage(abc.ABC):
+    """Data access interface used by the routes.
+
+    Boards and tasks are returned as plain dicts with their document id under
+    the ``id`` key, the same shape the Firestore helpers always returned.
+    Boards and tasks with a ``deleted_at`` are soft deleted: every read and
+    query leaves them out unless it says otherwise, until the purger removes
+    them for good. Methods that take an ``event`` add it to the board's
+    activity feed in the same write as the change (see activity.py).
+
+    Boards and tasks read ``with_version`` carry a ``version`` token that
+    changes whenever the document does: its update_time on Firestore, a
+    digest of its contents on the local backends. Passing it back to an
+    update makes the write conditional, it raises VersionConflict instead of
+    overwriting a change made since, without reading the document again.
+    Updates return the document's new version, and raise DocumentDeleted
+    when the document is gone.
+
+    Every method is abstract, so a backend that misses one fails when it is
+    created rather than on the first request that needs it.
+    """
+
+    # Users
+    @abc.abstractmethod
+    def get_user(self, user_id: str) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_user(self, user_id: str, data: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_email_entry(self, email: str) -> Optional[Dict[str, Any]]:
+        """The ``emails`` index entry for a canonical address: ``{'uid', 'email', 'pending'}``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def claim_email(self, email: str, user_id: str, user_data: Optional[Dict[str, Any]], pending: bool) -> Dict[str, Any]:
+        """Point a canonical address at ``user_id`` and write its user record, atomically.
+
+        A registered user's entry is never replaced, and an invite doesn't
+        replace an existing invite; in those cases nothing is written and the
+        existing entry is returned. Otherwise returns the new entry.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_users_by_email(self, email: str) -> List[Dict[str, Any]]:
+        raise NotImplementedError
+
+    # Boards
+    @abc.abstractmethod
+    def create_board(self, data: Dict[str, Any]) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_board(self, board_id: str, include_deleted: bool = False,
+                  with_version: bool = False) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_board(self, board_id: str, data: Dict[str, Any], event: Optional[Dict[str, Any]] = None,
+                     version: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_board(self, board_id: str) -> None:
+        """Delete the board together with all of its tasks, its activity and its recurring tasks."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_member_boards(self, member_id: str, fields: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """Boards ``member_id`` belongs to, with only ``fields`` (plus the id) when given."""
+        raise NotImplementedError
+
+    # Members
+    @abc.abstractmethod
+    def add_member(self, board_id: str, member_id: str, email: Optional[str] = None,
+                   event: Optional[Dict[str, Any]] = None) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def remove_member(self, board_id: str, member_id: str, event: Optional[Dict[str, Any]] = None) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def replace_member(self, board_id: str, old_member_id: str, new_member_id: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_member_emails(self, board_id: str, emails: Dict[str, str]) -> None:
+        """Fill in ``member_emails`` entries for current members, leaving the rest of the map alone."""
+        raise NotImplementedError
+
+    # Tasks
+    @abc.abstractmethod
+    def create_task(self, board_id: str, data: Dict[str, Any], event: Optional[Dict[str, Any]] = None) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_task(self, board_id: str, task_id: str, include_deleted: bool = False,
+                 with_version: bool = False) -> Optional[Dict[str, Any]]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_tasks(self, board_id: str, fields: Optional[List[str]] = None, by_rank: bool = False) -> List[Dict[str, Any]]:
+        """Every task on the board, with only ``fields`` (plus the id) when given.
+
+        ``by_rank`` orders them by their ``rank`` key, tasks whose rank is None
+        after the ranked ones in id order as ranking.in_board_order does.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update_task(self, board_id: str, task_id: str, data: Dict[str, Any],
+                    event: Optional[Dict[str, Any]] = None, version: Optional[str] = None) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_task(self, board_id: str, task_id: str) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def create_tasks(self, board_id: str, tasks: List[Dict[str, Any]],
+                     event: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Create many tasks with batched writes, returns their ids in order.
+
+        The event is written with the last batch.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_tasks_page(self, board_id: str, limit: int, cursor=None, by_rank: bool = False):
+        """Page through a board's tasks ordered by id, or by rank.
+
+        Returns ``(tasks, next_cursor)`` where the cursor is the last task id,
+        or a ``(rank, task_id)`` tuple when ordered by rank. Unranked tasks come
+        last as in list_tasks; their rank must be None rather than missing,
+        which Firestore can't query for, so every writer sets one and boards
+        from before ranks existed are only paged by rank once ranked.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_task_ranks(self, board_id: str, ranks: Dict[str, str]) -> None:
+        """Set the ``rank`` of many tasks with batched writes, skipping deleted ones."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_assigned_tasks(self, member_ids: List[str], board_ids: List[str], limit: int,
+                            cursor: Optional[tuple] = None):
+        """Tasks on ``board_ids`` assigned to any of ``member_ids``, ordered by due date.
+
+        Each task carries its ``board_id``. Returns ``(tasks, next_cursor)`` where
+        the cursor is a ``(due_date, board_id, task_id)`` tuple, or None on the
+        last page.
+        """
+        raise NotImplementedError
+
+
+    @abc.abstractmethod
+    def list_boards(self, limit: int, cursor: Optional[str] = None):
+        """Page through every board ordered by id, for maintenance jobs.
+
+        Returns ``(boards, next_cursor)`` where the cursor is the last board id.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_boards(self, board_ids: List[str], fields: Optional[List[str]] = None) -> List[Optional[Dict[str, Any]]]:
+        """Batch read of boards, with only ``fields`` (plus the id) when given; None for deleted ones."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_tasks(self, refs: List[tuple]) -> List[Optional[Dict[str, Any]]]:
+        """Batch read of ``(board_id, task_id)`` pairs, results carry ``board_id``."""
+        raise NotImplementedError
+
+    # Search index
+    @abc.abstractmethod
+    def index_task_tokens(self, board_id: str, task_id: str, added: Dict[str, int], removed: List[str]) -> None:
+        """Set the weight of ``added`` tokens for a task and drop it from ``removed`` ones."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_search_postings(self, board_ids: List[str], prefix: str, limit: int, cursor=None):
+        """Page through the postings for tokens starting with ``prefix`` in the given boards.
+
+        Returns ``(postings, next_cursor)``: at most ``limit`` postings as
+        ``(board_id, token, task_id, weight)`` tuples, and a cursor to pass back
+        for the next page, None on the last one.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def add_search_postings(self, board_id: str, postings: Dict[str, Dict[str, int]]) -> None:
+        """Bulk version of index_task_tokens for new tasks, ``{token: {task_id: weight}}``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def clear_search_index(self, board_id: str) -> None:
+        raise NotImplementedError
+
+    # Dashboard summaries, one per user, keyed by board id
+    @abc.abstractmethod
+    def get_dashboard(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """``{'complete': bool, 'boards': {board_id: entry}, 'version': str}`` or None.
+
+        ``complete`` is only set by save_dashboard; entries written before the
+        summary was first built may not cover all of the user's boards.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_dashboard(self, user_id: str, boards: Dict[str, Dict[str, Any]], version: Optional[str]) -> None:
+        """Replace the user's entries and mark them as complete.
+
+        Only done if the summary is unchanged since ``version`` was read, or
+        still missing when ``version`` is None; raises VersionConflict otherwise.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set_dashboard_entries(self, entries: List[tuple]) -> None:
+        """Apply ``(user_id, board_id, entry)`` entries; a None entry removes the board."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def increment_task_counts(self, board_id: str, deltas: Dict[str, int]) -> None:
+        """Add ``deltas`` to the board's counters; nothing is written once the board is gone."""
+        raise NotImplementedError
+
+    # Purging soft deleted documents
+    @abc.abstractmethod
+    def list_deleted_tasks(self, cutoff: datetime.datetime, limit: int) -> List[Dict[str, Any]]:
+        """Tasks on any board deleted before ``cutoff``, each carrying its ``board_id``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def purge_tasks(self, refs: List[tuple]) -> None:
+        """Remove ``(board_id, task_id)`` pairs for good, in one batch."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_deleted_boards(self, cutoff: datetime.datetime, limit: int) -> List[Dict[str, Any]]:
+        """Boards deleted before ``cutoff``, empty them with purge_board_contents then remove them with delete_board."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def purge_board_contents(self, board_id: str, limit: int) -> int:
+        """Remove up to ``limit`` of a board's tasks, archived tasks, activity, recurring tasks and index entries.
+
+        Returns how many were removed, fewer than ``limit`` once the board is empty.
+        """
+        raise NotImplementedError
+
+    # Archive
+    @abc.abstractmethod
+    def list_completed_before(self, board_id: str, cutoff: datetime.datetime, limit: int,
+                              cursor: Optional[tuple] = None):
+        """Completed tasks whose ``completed_at`` is older than ``cutoff``, oldest first.
+
+        Returns ``(tasks, next_cursor)``; the cursor is ``(completed_at, task_id)`` and
+        is None once a page comes back short. Soft deleted tasks are left out without
+        ending the pages early.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def archive_tasks(self, board_id: str, tasks: List[Dict[str, Any]]) -> int:
+        """Move tasks to the board's archive and add them to its ``archived_count``.
+
+        Tasks deleted since they were read are skipped; returns the number moved.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_archived_tasks(self, board_id: str, limit: int, cursor: Optional[tuple] = None):
+        """Archived tasks, most recently completed first.
+
+        Returns ``(tasks, next_cursor)``; the cursor is ``(completed_at, task_id)``.
+        """
+        raise NotImplementedError
+
+    # Activity
+    @abc.abstractmethod
+    def list_activity(self, board_id: str, limit: int, cursor: Optional[tuple] = None):
+        """The board's activity events, newest first, leaving out expired ones.
+
+        Returns ``(events, next_cursor)``; the cursor is ``(at, event_id)``.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def purge_expired_activity(self, now: datetime.datetime, limit: int) -> int:
+        """Delete up to ``limit`` events whose ``exp`` has passed, returns how many."""
+        raise NotImplementedError
+
+    # Recurring tasks (see recurring.py)
+    @abc.abstractmethod
+    def create_recurring(self, board_id: str, data: Dict[str, Any], event: Optional[Dict[str, Any]] = None) -> str:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def list_recurring(self, board_id: str) -> List[Dict[str, Any]]:
+        """The board's recurring tasks, each with its ``version``."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_recurring(self, board_id: str, rule_id: str) -> Optional[Dict[str, Any]]:
+        """One recurring task with its ``version``, None if it doesn't exist."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete_recurring(self, board_id: str, rule_id: str, event: Optional[Dict[str, Any]] = None) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def iter_due_recurring(self, horizon: str, page_size: int = 500):
+        """Recurring tasks on any board whose ``next_due`` is on or before ``horizon``.
+
+        Yields them in ``next_due`` order, reading ``page_size`` at a time, each
+        carrying its ``board_id`` and ``version``.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def materialize_recurring(self, board_id: str, tasks: Dict[str, Dict[str, Any]],
+                              advances: Dict[str, tuple], event: Optional[Dict[str, Any]] = None) -> List[str]:
+        """Write occurrences and move their recurring tasks on, in one batch.
+
+        ``tasks`` maps occurrence ids to task documents. Each is only created
+        if no task has its id yet, so a rerun neither adds copies nor undoes
+        what members did to an occurrence since; returns the ids created.
+        ``advances`` maps recurring task ids to ``(version, next_due)``; if any
+        of them changed since its version was read, nothing is written and
+        VersionConflict is raised. Takes at most 490 writes.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_last_rank(self, board_id: str) -> Optional[str]:
+        """The highest task ``rank`` on the board, None when it has no ranked tasks."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def find_task_titles(self, board_id: str, titles: List[str]) -> set:
+        """Which of ``titles`` are already the exact title of a task on the board."""
+        raise NotImplementedError
+
+
+def _rpc():
+    # timeouts come from the request deadline and reads are retried by
+    # deadlines.call, so the client library's own retries are turned off
+    return {'retry': None, 'timeout': deadlines.timeout()}
+
+
+class _DeadlineLock:
+    """Re-entrant lock for the local backends that stops waiting when the request deadline passes."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+
+    def __enter__(self):
+        if not self._lock.acquire(timeout=deadlines.timeout()):
+            raise deadlines.DeadlineExceeded("Request deadline exceeded waiting for the storage lock")
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+
+def _live(data):
+    return not data.get('deleted_at')
+
+
+def _claimable(entry, user_id, pending):
+    if entry is None or entry['uid'] == user_id:
+        return True
+    # a sign up takes over its pending invite
+    return entry.get('pending', False) and not pending
+
+
+def _project(data, fields):
+    if fields is None:
+        return data
+    return {key: data[key] for key in fields if key in data}
+
+
+def _due_key(due_date):
+    # Firestore orders null before any string, the local backends do the same
+    return '0' if due_date is None else '1' + due_date
+
+
+def _archive_cursor(tasks, limit):
+    if len(tasks) < limit:
+        return None
+    return (tasks[-1]['completed_at'], tasks[-1]['id'])
+
+
+def _rank_key(task):
+    # ranked tasks first, then those without a rank in id order
+    rank = task.get('rank')
+    return (rank is None, rank or '', task['id'])
+
+
+def _page_cursor(tasks, limit, by_rank):
+    if len(tasks) < limit:
+        return None
+    return (tasks[-1]['rank'], tasks[-1]['id']) if by_rank else tasks[-1]['id']
+
+
+def _activity_cursor(events, limit):
+    if len(events) < limit:
+        return None
+    return (events[-1]['at'], events[-1]['id'])
+
+
+def _next_cursor(tasks, limit):
+    if len(tasks) < limit:
+        return None
+    last = tasks[-1]
+    return (last.get('due_date'), last['board_id'], last['id'])
+
+
+class FirestoreStorage(Storage):
+
+    def __init__(self, client=None):
+        self.client = client or firestore.Client()
+
+    def _board_ref(self, board_id):
+        return self.client.collection('task_boards').document(board_id)
+
+    def _task_ref(self, board_id, task_id):
+        return self._board_ref(board_id).collection('tasks').document(task_id)
+
+    def _commit_with_event(self, board_id, event, write):
+        # the change and its activity event are committed together, in one round trip
+        batch = self.client.batch()
+        write(batch)
+        if event is not None:
+            batch.set(self._board_ref(board_id).collection('activity').document(), event)
+        return batch.commit(**_rpc())
+
+    def _unchanged_since(self, version):
+        # the precondition is checked by the server as part of the commit, no read needed
+        if version is None:
+            return None
+        try:
+            return self.client.write_option(last_update_time=DatetimeWithNanoseconds.from_rfc3339(version))
+        except ValueError:
+            raise VersionConflict(version)
+
+    def _update_versioned(self, board_id, ref, data, event, version):
+        option = self._unchanged_since(version)
+        try:
+            results = self._commit_with_event(board_id, event, lambda batch: batch.update(ref, data, option=option))
+        except FailedPrecondition as err:
+            raise VersionConflict(version) from err
+        except NotFound as err:
+            raise DocumentDeleted(ref.id) from err
+        return results[0].update_time.rfc3339()
+
+    def get_user(self, user_id):
+        user = self.client.collection('users').document(user_id).get(**_rpc())
+        if user.exists:
+            return user.to_dict()
+        return None
+
+    def set_user(self, user_id, data):
+        self.client.collection('users').document(user_id).set(data, **_rpc())
+
+    def get_email_entry(self, email):
+        entry = self.client.collection('emails').document(email).get(**_rpc())
+        return entry.to_dict() if entry.exists else None
+
+    def claim_email(self, email, user_id, user_data, pending):
+        email_ref = self.client.collection('emails').document(email)
+
+        @firestore.transactional
+        def claim(transaction):
+            snapshot = email_ref.get(transaction=transaction, **_rpc())
+            entry = snapshot.to_dict() if snapshot.exists else None
+            if not _claimable(entry, user_id, pending):
+                return entry
+            new_entry = {'uid': user_id, 'email': email, 'pending': pending}
+            if entry is not None and entry['uid'] != user_id:
+                new_entry['invite_id'] = entry['uid']
+            transaction.set(email_ref, new_entry)
+            if user_data is not None:
+                transaction.set(self.client.collection('users').document(user_id), user_data)
+            return new_entry
+
+        return claim(self.client.transaction())
+
+    def find_users_by_email(self, email):
+        users_query = self.client.collection('users').where('email', '==', email)
+        return [{"id": doc.id, **doc.to_dict()} for doc in users_query.stream(**_rpc())]
+
+    def create_board(self, data):
+        board_ref = self.client.collection('task_boards').document()
+        board_ref.set(data, **_rpc())
+        return board_ref.id
+
+    def get_board(self, board_id, include_deleted=False, with_version=False):
+        board = self._board_ref(board_id).get(**_rpc())
+        if board.exists and (include_deleted or _live(board.to_dict())):
+            if with_version:
+                return {"id": board_id, **board.to_dict(), "version": board.update_time.rfc3339()}
+            return {"id": board_id, **board.to_dict()}
+        return None
+
+    def update_board(self, board_id, data, event=None, version=None):
+        return self._update_versioned(board_id, self._board_ref(board_id), data, event, version)
+
+    def delete_board(self, board_id):
+        board_ref = self._board_ref(board_id)
+        for name in ('tasks', 'archived_tasks', 'activity', 'recurring'):
+            documents = board_ref.collection(name).select([]).stream(**_rpc())
+            self._delete_in_batches(document.reference for document in documents)
+        self.clear_search_index(board_id)
+        board_ref.delete(**_rpc())
+
+    def list_member_boards(self, member_id, fields=None):
+        boards_query = self.client.collection('task_boards').where('members', 'array_contains', member_id)
+        if fields is not None:
+            boards_query = boards_query.select(list(fields) + ['deleted_at'])
+        boards = [{"id": board.id, **board.to_dict()} for board in boards_query.stream(**_rpc())]
+        return [_project(board, None if fields is None else ['id'] + list(fields)) for board in boards if _live(board)]
+
+    def add_member(self, board_id, member_id, email=None, event=None):
+        update = {'members': firestore.ArrayUnion([member_id])}
+        if email is not None:
+            update[self.client.field_path('member_emails', member_id)] = email
+        self._commit_with_event(board_id, event, lambda batch: batch.update(self._board_ref(board_id), update))
+
+    def remove_member(self, board_id, member_id, event=None):
+        update = {
+            'members': firestore.ArrayRemove([member_id]),
+            self.client.field_path('member_emails', member_id): firestore.DELETE_FIELD
+        }
+        self._commit_with_event(board_id, event, lambda batch: batch.update(self._board_ref(board_id), update))
+
+    def replace_member(self, board_id, old_member_id, new_member_id):
+        board_ref = self._board_ref(board_id)
+        batch = self.client.batch()
+        batch.update(board_ref, {'members': firestore.ArrayRemove([old_member_id])})
+        batch.update(board_ref, {'members': firestore.ArrayUnion([new_member_id])})
+        batch.commit(**_rpc())
+
+    def set_member_emails(self, board_id, emails):
+        board_ref = self._board_ref(board_id)
+
+        @firestore.transactional
+        def fill(transaction):
+            # a member removed since their email was looked up must not get it back,
+            # the transaction retries if the member list changes before it commits
+            snapshot = board_ref.get(field_paths=['members'], transaction=transaction, **_rpc())
+            if not snapshot.exists:
+                return
+            members = set(snapshot.to_dict().get('members', []))
+            # one field path per member, so concurrent changes to other entries aren't overwritten
+            update = {self.client.field_path('member_emails', member_id): email
+                      for member_id, email in emails.items() if member_id in members}
+            if update:
+                transaction.update(board_ref, update)
+
+        fill(self.client.transaction())
+
+    def _task_data(self, board_id, data):
+        # the board id is kept on the task too, so collection group queries can filter on it
+        return {**data, 'board_id': board_id}
+
+    def create_task(self, board_id, data, event=None):
+        task_ref = self._board_ref(board_id).collection('tasks').document()
+        self._commit_with_event(board_id, event, lambda batch: batch.set(task_ref, self._task_data(board_id, data)))
+        return task_ref.id
+
+    def get_task(self, board_id, task_id, include_deleted=False, with_version=False):
+        task = self._task_ref(board_id, task_id).get(**_rpc())
+        if task.exists and (include_deleted or _live(task.to_dict())):
+            if with_version:
+                return {"id": task_id, **task.to_dict(), "version": task.update_time.rfc3339()}
+            return {"id": task_id, **task.to_dict()}
+        return None
+
+    def list_tasks(self, board_id, fields=None, by_rank=False):
+        tasks_query = self._board_ref(board_id).collection('tasks')
+        if fields is not None:
+            # projection query, the other fields never leave the server
+            # deleted_at is read too so deleted tasks can be left out
+            tasks_query = tasks_query.select(list(fields) + ['deleted_at'])
+        tasks = [{"id": task.id, **task.to_dict()} for task in tasks_query.stream(**_rpc())]
+        if by_rank:
+            # the whole board is read either way, and ordering by rank on the
+            # server would leave out the tasks that have none
+            tasks.sort(key=_rank_key)
+        return [_project(task, None if fields is None else ['id'] + list(fields)) for task in tasks if _live(task)]
+
+    def update_task(self, board_id, task_id, data, event=None, version=None):
+        return self._update_versioned(board_id, self._task_ref(board_id, task_id), data, event, version)
+
+    def delete_task(self, board_id, task_id):
+        self._task_ref(board_id, task_id).delete(**_rpc())
+
+    def create_tasks(self, board_id, tasks, event=None):
+        tasks_ref = self._board_ref(board_id).collection('tasks')
+        writes = [(tasks_ref.document(), self._task_data(board_id, data)) for data in tasks]
+        task_ids = [ref.id for ref, _ in writes]
+        if event is not None:
+            writes.append((self._board_ref(board_id).collection('activity').document(), event))
+        self._commit_in_batches(writes)
+        return task_ids
+
+    def list_tasks_page(self, board_id, limit, cursor=None, by_rank=False):
+        if by_rank:
+            tasks = self._rank_page(board_id, limit, cursor)
+        else:
+            tasks_query = (self._board_ref(board_id).collection('tasks')
+                           .order_by(firestore.FieldPath.document_id()).limit(limit))
+            if cursor is not None:
+                tasks_query = tasks_query.start_after({firestore.FieldPath.document_id(): self._task_ref(board_id, cursor)})
+            tasks = [{"id": task.id, **task.to_dict()} for task in tasks_query.stream(**_rpc())]
+        # the cursor comes from the full page, deleted tasks are dropped after
+        return [task for task in tasks if _live(task)], _page_cursor(tasks, limit, by_rank)
+
+    def _rank_page(self, board_id, limit, cursor):
+        # ordering by rank leaves out null ranks, so the ranked tasks are paged
+        # first and the unranked ones after them by id; both queries are served
+        # by the automatic single field index on rank
+        tasks_ref = self._board_ref(board_id).collection('tasks')
+        document_id = firestore.FieldPath.document_id()
+        tasks = []
+        after_id = None
+        if cursor is None or cursor[0] is not None:
+            ranked_query = tasks_ref.where('rank', '>', '').order_by('rank').order_by(document_id).limit(limit)
+            if cursor is not None:
+                rank, task_id = cursor
+                ranked_query = ranked_query.start_after({'rank': rank, document_id: self._task_ref(board_id, task_id)})
+            tasks = [{"id": task.id, **task.to_dict()} for task in ranked_query.stream(**_rpc())]
+            if len(tasks) == limit:
+                return tasks
+        else:
+            after_id = cursor[1]
+        unranked_query = tasks_ref.where('rank', '==', None).order_by(document_id).limit(limit - len(tasks))
+        if after_id is not None:
+            unranked_query = unranked_query.start_after({document_id: self._task_ref(board_id, after_id)})
+        return tasks + [{"id": task.id, **task.to_dict()} for task in unranked_query.stream(**_rpc())]
+
+    def set_task_ranks(self, board_id, ranks):
+        items = list(ranks.items())
+        for start in range(0, len(items), 500):
+            chunk = items[start:start + 500]
+            batch = self.client.batch()
+            for task_id, rank in chunk:
+                batch.update(self._task_ref(board_id, task_id), {'rank': rank})
+            try:
+                batch.commit(**_rpc())
+            except NotFound:
+                # a task was deleted meanwhile, the batch failed as a whole so retry one at a time
+                for task_id, rank in chunk:
+                    try:
+                        self._task_ref(board_id, task_id).update({'rank': rank}, **_rpc())
+                    except NotFound:
+                        pass
+
+    def list_assigned_tasks(self, member_ids, board_ids, limit, cursor=None):
+        member_ids = list(member_ids)
+        board_ids = sorted(board_ids)
+        # an in filter next to array_contains_any may have 30 combinations of the two
+        chunk_size = max(1, 30 // max(1, len(member_ids)))
+        tasks = []
+        for start in range(0, len(board_ids), chunk_size):
+            # served by the collection group index in firestore.indexes.json
+            tasks_query = (self.client.collection_group('tasks')
+                           .where('board_id', 'in', board_ids[start:start + chunk_size])
+                           .where('assigned_users', 'array_contains_any', member_ids)
+                           .order_by('due_date')
+                           .order_by(firestore.FieldPath.document_id())
+                           .limit(limit))
+            if cursor is not None:
+                due_date, board_id, task_id = cursor
+                tasks_query = tasks_query.start_after({
+                    'due_date': due_date,
+                    firestore.FieldPath.document_id(): self._task_ref(board_id, task_id)
+                })
+            tasks.extend({"id": task.id, **task.to_dict(), "board_id": task.reference.parent.parent.id}
+                         for task in tasks_query.stream(**_rpc()))
+        # each chunk is in order, the first ``limit`` of them all make the page
+        tasks.sort(key=lambda task: (_due_key(task.get('due_date')), task['board_id'], task['id']))
+        tasks = tasks[:limit]
+        return [task for task in tasks if _live(task)], _next_cursor(tasks, limit)
+
+    def backfill_task_board_ids(self, page_size=500):
+        """Add ``board_id`` to tasks written before it was kept on them, returns the number updated."""
+        updated = 0
+        last = None
+        while True:
+            tasks_query = (self.client.collection_group('tasks')
+                           .order_by(firestore.FieldPath.document_id())
+                           .select(['board_id'])
+                           .limit(page_size))
+            if last is not None:
+                tasks_query = tasks_query.start_after(last)
+            page = list(tasks_query.stream(**_rpc()))
+            writes = [(task.reference, {'board_id': task.reference.parent.parent.id})
+                      for task in page if 'board_id' not in task.to_dict()]
+            self._commit_in_batches(writes)
+            updated += len(writes)
+            if len(page) < page_size:
+                return updated
+            last = page[-1]
+
+
+    def list_boards(self, limit, cursor=None):
+        boards_query = (self.client.collection('task_boards')
+                        .order_by(firestore.FieldPath.document_id())
+                        .limit(limit))
+        if cursor is not None:
+            boards_query = boards_query.start_after({firestore.FieldPath.document_id(): self._board_ref(cursor)})
+        boards = [{"id": board.id, **board.to_dict()} for board in boards_query.stream(**_rpc())]
+        return [board for board in boards if _live(board)], (boards[-1]['id'] if len(boards) == limit else None)
+
+    def get_boards(self, board_ids, fields=None):
+        # deleted_at is read along with the fields so deleted boards can be left out
+        field_paths = None if fields is None else list(fields) + ['deleted_at']
+        snapshots = {snapshot.id: snapshot for snapshot in
+                     self.client.get_all([self._board_ref(board_id) for board_id in board_ids],
+                                         field_paths=field_paths, **_rpc())}
+        boards = []
+        for board_id in board_ids:
+            snapshot = snapshots.get(board_id)
+            if snapshot is not None and snapshot.exists and _live(snapshot.to_dict()):
+                boards.append({"id": board_id, **_project(snapshot.to_dict(), fields)})
+            else:
+                boards.append(None)
+        return boards
+
+    def get_tasks(self, refs):
+        snapshots = {snapshot.reference.path: snapshot for snapshot in
+                     self.client.get_all([self._task_ref(board_id, task_id) for board_id, task_id in refs], **_rpc())}
+        tasks = []
+        for board_id, task_id in refs:
+            snapshot = snapshots.get(self._task_ref(board_id, task_id).path)
+            if snapshot is not None and snapshot.exists and _live(snapshot.to_dict()):
+                tasks.append({"id": task_id, "board_id": board_id, **snapshot.to_dict()})
+            else:
+                tasks.append(None)
+        return tasks
+
+    def _search_ref(self, board_id, token, task_id):
+        # one document per posting: a common word on a big board would outgrow a single
+        # document's size and index entry limits, and every task write would contend on it
+        return self.client.collection('search_index').document(f"{board_id}~{token}~{task_id}")
+
+    def _posting(self, board_id, token, task_id, weight):
+        return {'board_id': board_id, 'token': token, 'task_id': task_id, 'weight': weight}
+
+    def index_task_tokens(self, board_id, task_id, added, removed):
+        writes = [(self._search_ref(board_id, token, task_id), self._posting(board_id, token, task_id, weight))
+                  for token, weight in added.items()]
+        writes += [(self._search_ref(board_id, token, task_id), None) for token in removed if token not in added]
+        # a batch holds at most 500 writes
+        for start in range(0, len(writes), 500):
+            batch = self.client.batch()
+            for ref, data in writes[start:start + 500]:
+                if data is None:
+                    batch.delete(ref)
+                else:
+                    batch.set(ref, data)
+            batch.commit(**_rpc())
+
+    def find_search_postings(self, board_ids, prefix, limit, cursor=None):
+        postings = []
+        board_ids = sorted(board_ids)
+        # the cursor is (first board of the chunk, token, document id) of the last posting read
+        first, after = (0, None) if cursor is None else (cursor[0], cursor[1:])
+        read = 0
+        # "in" filters take at most 30 values
+        for start in range(first, len(board_ids), 30):
+            postings_query = (self.client.collection('search_index')
+                              .where('board_id', 'in', board_ids[start:start + 30])
+                              .where('token', '>=', prefix)
+                              .where('token', '<', prefix + '\uf8ff')
+                              .order_by('token')
+                              .order_by(firestore.FieldPath.document_id())
+                              .limit(limit - read))
+            if after is not None and start == first:
+                token, doc_id = after
+                postings_query = postings_query.start_after({
+                    'token': token,
+                    firestore.FieldPath.document_id(): self.client.collection('search_index').document(doc_id)
+                })
+            for doc in postings_query.stream(**_rpc()):
+                entry = doc.to_dict()
+                read += 1
+                cursor = (start, entry['token'], doc.id)
+                if 'task_id' not in entry:
+                    # a whole token's postings in one document, from before ``search.py rebuild``
+                    continue
+                postings.append((entry['board_id'], entry['token'], entry['task_id'], entry['weight']))
+            if read >= limit:
+                return postings, cursor
+        return postings, None
+
+    def add_search_postings(self, board_id, postings):
+        self._commit_in_batches([
+            (self._search_ref(board_id, token, task_id), self._posting(board_id, token, task_id, weight))
+            for token, tasks in postings.items() for task_id, weight in tasks.items()
+        ])
+
+    def clear_search_index(self, board_id):
+        entries = self.client.collection('search_index').where('board_id', '==', board_id).select([])
+        self._delete_in_batches(entry.reference for entry in entries.stream(**_rpc()))
+
+    def _dashboard_ref(self, user_id):
+        return self.client.collection('user_dashboards').document(user_id)
+
+    def get_dashboard(self, user_id):
+        dashboard = self._dashboard_ref(user_id).get(**_rpc())
+        if not dashboard.exists:
+            return None
+        data = dashboard.to_dict()
+        return {'complete': bool(data.get('complete')), 'boards': data.get('boards', {}),
+                'version': dashboard.update_time.rfc3339()}
+
+    def save_dashboard(self, user_id, boards, version):
+        dashboard_ref = self._dashboard_ref(user_id)
+        data = {'complete': True, 'boards': boards}
+        try:
+            if version is None:
+                dashboard_ref.create(data, **_rpc())
+            else:
+                # update replaces the whole boards map, so entries written since must fail it
+                dashboard_ref.update(data, option=self._unchanged_since(version), **_rpc())
+        except (AlreadyExists, FailedPrecondition, NotFound) as err:
+            raise VersionConflict(version) from err
+
+    def _commit_in_batches(self, writes):
+        # a batch holds at most 500 writes
+        for start in range(0, len(writes), 500):
+            batch = self.client.batch()
+            for ref, data in writes[start:start + 500]:
+                batch.set(ref, data, merge=True)
+            batch.commit(**_rpc())
+
+    def _delete_in_batches(self, refs):
+        # a batch holds at most 500 writes, refs may be a stream that is deleted as it is read
+        batch, pending = self.client.batch(), 0
+        for ref in refs:
+            batch.delete(ref)
+            pending += 1
+            if pending == 500:
+                batch.commit(**_rpc())
+                batch, pending = self.client.batch(), 0
+        if pending:
+            batch.commit(**_rpc())
+
+    def set_dashboard_entries(self, entries):
+        writes = []
+        for user_id, board_id, summary in entries:
+            value = firestore.DELETE_FIELD if summary is None else summary
+            writes.append((self._dashboard_ref(user_id), {'boards': {board_id: value}}))
+        self._commit_in_batches(writes)
+
+    def increment_task_counts(self, board_id, deltas):
+        # update, unlike set, fails on a missing document: deltas arriving after a
+        # purge must not bring back a partial board
+        try:
+            self._board_ref(board_id).update({field: firestore.Increment(delta) for field, delta in deltas.items()},
+                                             **_rpc())
+        except NotFound:
+            pass
+
+    def list_completed_before(self, board_id, cutoff, limit, cursor=None):
+        # served by the (status, completed_at) index in firestore.indexes.json
+        tasks_query = (self._board_ref(board_id).collection('tasks')
+                       .where('status', '==', 'completed')
+                       .where('completed_at', '<', cutoff)
+                       .order_by('completed_at')
+                       .order_by(firestore.FieldPath.document_id())
+                       .limit(limit))
+        if cursor is not None:
+            completed_at, task_id = cursor
+            tasks_query = tasks_query.start_after({
+                'completed_at': completed_at,
+                firestore.FieldPath.document_id(): self._task_ref(board_id, task_id)
+            })
+        tasks = [{"id": task.id, **task.to_dict()} for task in tasks_query.stream(**_rpc())]
+        # tasks without deleted_at can't be matched by a query, so soft deleted ones are
+        # dropped here and the cursor, taken from the whole page, steps over them
+        return [task for task in tasks if _live(task)], _archive_cursor(tasks, limit)
+
+    def list_deleted_tasks(self, cutoff, limit):
+        # served by the collection group field override in firestore.indexes.json
+        tasks_query = (self.client.collection_group('tasks')
+                       .where('deleted_at', '<', cutoff)
+                       .limit(limit))
+        return [{"id": task.id, "board_id": task.reference.parent.parent.id, **task.to_dict()}
+                for task in tasks_query.stream(**_rpc())]
+
+    def purge_tasks(self, refs):
+        self._delete_in_batches(self._task_ref(board_id, task_id) for board_id, task_id in refs)
+
+    def list_deleted_boards(self, cutoff, limit):
+        boards_query = (self.client.collection('task_boards')
+                        .where('deleted_at', '<', cutoff)
+                        .limit(limit))
+        return [{"id": board.id, **board.to_dict()} for board in boards_query.stream(**_rpc())]
+
+    def purge_board_contents(self, board_id, limit):
+        board_ref = self._board_ref(board_id)
+        queries = [self.client.collection('search_index').where('board_id', '==', board_id)]
+        queries += [board_ref.collection(name) for name in ('tasks', 'archived_tasks', 'activity', 'recurring')]
+        refs = []
+        for documents_query in queries:
+            documents = documents_query.select([]).limit(limit - len(refs)).stream(**_rpc())
+            refs += [document.reference for document in documents]
+            if len(refs) == limit:
+                break
+        self._delete_in_batches(refs)
+        return len(refs)
+
+    def archive_tasks(self, board_id, tasks):
+        board_ref = self._board_ref(board_id)
+        archive = board_ref.collection('archived_tasks')
+        # the delete fails the batch if the task is gone, so it is never archived or counted
+        present = self.client.write_option(exists=True)
+
+        def move(chunk):
+            batch = self.client.batch()
+            for task in chunk:
+                data = {key: value for key, value in task.items() if key != 'id'}
+                data['archived_at'] = firestore.SERVER_TIMESTAMP
+                batch.set(archive.document(task['id']), data)
+                batch.delete(board_ref.collection('tasks').document(task['id']), option=present)
+            batch.update(board_ref, {'archived_count': firestore.Increment(len(chunk))})
+            batch.commit(**_rpc())
+
+        moved = 0
+        # two writes per task plus the counter must fit in one 500 write batch
+        for start in range(0, len(tasks), 249):
+            chunk = tasks[start:start + 249]
+            try:
+                move(chunk)
+                moved += len(chunk)
+            except NotFound:
+                # a task was deleted meanwhile, the batch failed as a whole so retry one at a time
+                for task in chunk:
+                    try:
+                        move([task])
+                        moved += 1
+                    except NotFound:
+                        pass
+        return moved
+
+    def list_archived_tasks(self, board_id, limit, cursor=None):
+        archive_query = (self._board_ref(board_id).collection('archived_tasks')
+                         .order_by('completed_at', direction=firestore.Query.DESCENDING)
+                         .order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+                         .limit(limit))
+        if cursor is not None:
+            completed_at, task_id = cursor
+            archive_query = archive_query.start_after({
+                'completed_at': completed_at,
+                firestore.FieldPath.document_id(): self._board_ref(board_id).collection('archived_tasks').document(task_id)
+            })
+        tasks = [{"id": task.id, **task.to_dict()} for task in archive_query.stream(**_rpc())]
+        return tasks, _archive_cursor(tasks, limit)
+
+    def list_activity(self, board_id, limit, cursor=None):
+        activity = self._board_ref(board_id).collection('activity')
+        # served by the (at, __name__) index in firestore.indexes.json
+        activity_query = (activity
+                          .order_by('at', direction=firestore.Query.DESCENDING)
+                          .order_by(firestore.FieldPath.document_id(), direction=firestore.Query.DESCENDING)
+                          .limit(limit))
+        if cursor is not None:
+            at, event_id = cursor
+            activity_query = activity_query.start_after({
+                'at': at,
+                firestore.FieldPath.document_id(): activity.document(event_id)
+            })
+        events = [{"id": event.id, **event.to_dict()} for event in activity_query.stream(**_rpc())]
+        # the cursor comes from the whole page, events the TTL hasn't removed yet are left out after
+        now = _now()
+        return [event for event in events if event['exp'] > now], _activity_cursor(events, limit)
+
+    def purge_expired_activity(self, now, limit):
+        # the TTL policy on exp normally gets there first, see activity.py
+        expired = list(self.client.collection_group('activity').where('exp', '<=', now).limit(limit).stream(**_rpc()))
+        batch = self.client.batch()
+        for event in expired:
+            batch.delete(event.reference)
+        if expired:
+            batch.commit(**_rpc())
+        return len(expired)
+
+    def create_recurring(self, board_id, data, event=None):
+        rule_ref = self._board_ref(board_id).collection('recurring').document()
+        self._commit_with_event(board_id, event, lambda batch: batch.set(rule_ref, data))
+        return rule_ref.id
+
+    def list_recurring(self, board_id):
+        rules = self._board_ref(board_id).collection('recurring').stream(**_rpc())
+        return [{"id": rule.id, **rule.to_dict(), "version": rule.update_time.rfc3339()} for rule in rules]
+
+    def get_recurring(self, board_id, rule_id):
+        rule = self._board_ref(board_id).collection('recurring').document(rule_id).get(**_rpc())
+        if not rule.exists:
+            return None
+        return {"id": rule.id, **rule.to_dict(), "version": rule.update_time.rfc3339()}
+
+    def delete_recurring(self, board_id, rule_id, event=None):
+        rule_ref = self._board_ref(board_id).collection('recurring').document(rule_id)
+        self._commit_with_event(board_id, event, lambda batch: batch.delete(rule_ref))
+
+    def iter_due_recurring(self, horizon, page_size=500):
+        # served by the collection group field override on next_due in firestore.indexes.json
+        rules_query = (self.client.collection_group('recurring')
+                       .where('next_due', '<=', horizon)
+                       .order_by('next_due')
+                       .order_by(firestore.FieldPath.document_id())
+                       .limit(page_size))
+        last = None
+        while True:
+            page = list((rules_query if last is None else rules_query.start_after(last)).stream(**_rpc()))
+            for rule in page:
+                yield {"id": rule.id, "board_id": rule.reference.parent.parent.id, **rule.to_dict(),
+                       "version": rule.update_time.rfc3339()}
+            if len(page) < page_size:
+                return
+            last = page[-1]
+
+    def materialize_recurring(self, board_id, tasks, advances, event=None):
+        board_ref = self._board_ref(board_id)
+        refs = {task_id: board_ref.collection('tasks').document(task_id) for task_id in tasks}
+        # a failed create fails the whole batch, so occurrences already there are left out first
+        existing = {snapshot.id for snapshot in self.client.get_all(list(refs.values()), field_paths=[], **_rpc())
+                    if snapshot.exists} if refs else set()
+        created = [task_id for task_id in tasks if task_id not in existing]
+        batch = self.client.batch()
+        for task_id in created:
+            batch.create(refs[task_id], self._task_data(board_id, tasks[task_id]))
+        for rule_id, (version, next_due) in advances.items():
+            batch.update(board_ref.collection('recurring').document(rule_id), {'next_due': next_due},
+                         option=self._unchanged_since(version))
+        if event is not None:
+            batch.set(board_ref.collection('activity').document(), event)
+        try:
+            batch.commit(**_rpc())
+        except (FailedPrecondition, NotFound, AlreadyExists) as err:
+            # another run got there first, or the recurring task was deleted
+            raise VersionConflict(board_id) from err
+        return created
+
+    def find_last_rank(self, board_id):
+        # served by the automatic single field index on rank
+        tasks_query = (self._board_ref(board_id).collection('tasks')
+                       .order_by('rank', direction=firestore.Query.DESCENDING)
+                       .select(['rank'])
+                       .limit(1))
+        for task in tasks_query.stream(**_rpc()):
+            return task.to_dict().get('rank')
+        return None
+
+    def find_task_titles(self, board_id, titles):
+        # served by the automatic single field index on title, 30 values per in filter
+        titles = list(set(titles))
+        found = set()
+        for start in range(0, len(titles), 30):
+            tasks_query = (self._board_ref(board_id).collection('tasks')
+                           .where('title', 'in', titles[start:start + 30])
+                           .select(['title', 'deleted_at']))
+            found.update(task.get('title') for task in tasks_query.stream(**_rpc()) if _live(task.to_dict()))
+        return found
+
+class MemoryStorage(Storage):
+    """Process-local backend for development and load testing.
+
+    Documents are copied on the way in and out so callers can mutate what
+    they get back, just like with Firestore snapshots.
+    """
+
+    def __init__(self):
+        self._lock = _DeadlineLock()
+        self._users = {}
+        self._boards = {}
+        self._tasks = {}
+        self._member_boards = {}
+        self._assigned = {}
+        self._search = {}
+        self._search_tokens = {}
+        self._dashboards = {}
+        self._archived = {}
+        self._emails = {}
+        self._activity = {}
+        self._recurring = {}
+
+    def _index_assignees(self, board_id, task_id, old_task, new_task):
+        for member_id in (old_task or {}).get('assigned_users') or []:
+            self._assigned.get(member_id, set()).discard((board_id, task_id))
+        for member_id in (new_task or {}).get('assigned_users') or []:
+            self._assigned.setdefault(member_id, set()).add((board_id, task_id))
+
+    def _record_event(self, board_id, event):
+        # called with the lock held, in the same step as the change it records
+        if event is not None:
+            self._activity.setdefault(board_id, {})[new_document_id()] = copy.deepcopy(_resolve_timestamps(event))
+
+    def get_user(self, user_id):
+        with self._lock:
+            user = self._users.get(user_id)
+            return copy.deepcopy(user) if user is not None else None
+
+    def set_user(self, user_id, data):
+        with self._lock:
+            self._users[user_id] = copy.deepcopy(_resolve_timestamps(data))
+
+    def get_email_entry(self, email):
+        with self._lock:
+            entry = self._emails.get(email)
+            return dict(entry) if entry is not None else None
+
+    def claim_email(self, email, user_id, user_data, pending):
+        with self._lock:
+            entry = self._emails.get(email)
+            if not _claimable(entry, user_id, pending):
+                return dict(entry)
+            new_entry = {'uid': user_id, 'email': email, 'pending': pending}
+            if entry is not None and entry['uid'] != user_id:
+                new_entry['invite_id'] = entry['uid']
+            self._emails[email] = new_entry
+            if user_data is not None:
+                self._users[user_id] = copy.deepcopy(_resolve_timestamps(user_data))
+            return dict(new_entry)
+
+    def find_users_by_email(self, email):
+        with self._lock:
+            return [{"id": user_id, **copy.deepcopy(user)}
+                    for user_id, user in self._users.items() if user.get('email') == email]
+
+    def create_board(self, data):
+        board_id = new_document_id()
+        with self._lock:
+            board = copy.deepcopy(_resolve_timestamps(data))
+            self._boards[board_id] = board
+            self._tasks[board_id] = {}
+            for member_id in board.get('members', []):
+                self._member_boards.setdefault(member_id, set()).add(board_id)
+        return board_id
+
+    def get_board(self, board_id, include_deleted=False, with_version=False):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None or not (include_deleted or _live(board)):
+                return None
+            if with_version:
+                return {"id": board_id, **copy.deepcopy(board), "version": _local_version(board)}
+            return {"id": board_id, **copy.deepcopy(board)}
+
+    def update_board(self, board_id, data, event=None, version=None):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                raise DocumentDeleted(board_id)
+            _check_version(board, version)
+            data = copy.deepcopy(_resolve_timestamps(data))
+            if 'members' in data:
+                for member_id in board.get('members', []):
+                    self._member_boards.get(member_id, set()).discard(board_id)
+                for member_id in data['members']:
+                    self._member_boards.setdefault(member_id, set()).add(board_id)
+            board.update(data)
+            self._record_event(board_id, event)
+            return _local_version(board)
+
+    def delete_board(self, board_id):
+        with self._lock:
+            board = self._boards.pop(board_id, None)
+            for task_id, task in self._tasks.pop(board_id, {}).items():
+                self._index_assignees(board_id, task_id, task, None)
+            self._archived.pop(board_id, None)
+            self._activity.pop(board_id, None)
+            self._recurring.pop(board_id, None)
+            self.clear_search_index(board_id)
+            if board is not None:
+                for member_id in board.get('members', []):
+                    self._member_boards.get(member_id, set()).discard(board_id)
+
+    def list_member_boards(self, member_id, fields=None):
+        with self._lock:
+            return [{"id": board_id, **copy.deepcopy(_project(self._boards[board_id], fields))}
+                    for board_id in self._member_boards.get(member_id, ()) if _live(self._boards[board_id])]
+
+    def add_member(self, board_id, member_id, email=None, event=None):
+        with self._lock:
+            board = self._boards[board_id]
+            members = board.setdefault('members', [])
+            if member_id not in members:
+                members.append(member_id)
+            self._member_boards.setdefault(member_id, set()).add(board_id)
+            if email is not None:
+                board.setdefault('member_emails', {})[member_id] = email
+            self._record_event(board_id, event)
+
+    def remove_member(self, board_id, member_id, event=None):
+        with self._lock:
+            board = self._boards[board_id]
+            members = board.get('members', [])
+            if member_id in members:
+                members.remove(member_id)
+            board.get('member_emails', {}).pop(member_id, None)
+            self._member_boards.get(member_id, set()).discard(board_id)
+            self._record_event(board_id, event)
+
+    def replace_member(self, board_id, old_member_id, new_member_id):
+        with self._lock:
+            board = self._boards[board_id]
+            members = [m for m in board.get('members', []) if m != old_member_id]
+            if new_member_id not in members:
+                members.append(new_member_id)
+            board['members'] = members
+            self._member_boards.get(old_member_id, set()).discard(board_id)
+            self._member_boards.setdefault(new_member_id, set()).add(board_id)
+
+    def set_member_emails(self, board_id, emails):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                return
+            member_emails = board.setdefault('member_emails', {})
+            for member_id, email in emails.items():
+                if member_id in board.get('members', []):
+                    member_emails[member_id] = email
+
+    def create_task(self, board_id, data, event=None):
+        task_id = new_document_id()
+        with self._lock:
+            task = copy.deepcopy(_resolve_timestamps(data))
+            self._tasks.setdefault(board_id, {})[task_id] = task
+            self._index_assignees(board_id, task_id, None, task)
+            self._record_event(board_id, event)
+        return task_id
+
+    def get_task(self, board_id, task_id, include_deleted=False, with_version=False):
+        with self._lock:
+            task = self._tasks.get(board_id, {}).get(task_id)
+            if task is None or not (include_deleted or _live(task)):
+                return None
+            if with_version:
+                return {"id": task_id, **copy.deepcopy(task), "version": _local_version(task)}
+            return {"id": task_id, **copy.deepcopy(task)}
+
+    def list_tasks(self, board_id, fields=None, by_rank=False):
+        with self._lock:
+            board_tasks = self._tasks.get(board_id, {})
+            task_ids = [task_id for task_id, task in board_tasks.items() if _live(task)]
+            if by_rank:
+                task_ids.sort(key=lambda task_id: _rank_key({'id': task_id, **board_tasks[task_id]}))
+            return [{"id": task_id, **copy.deepcopy(_project(board_tasks[task_id], fields))}
+                    for task_id in task_ids]
+
+    def update_task(self, board_id, task_id, data, event=None, version=None):
+        with self._lock:
+            task = self._tasks.get(board_id, {}).get(task_id)
+            if task is None:
+                raise DocumentDeleted(task_id)
+            _check_version(task, version)
+            old_task = {'assigned_users': list(task.get('assigned_users') or [])}
+            task.update(copy.deepcopy(_resolve_timestamps(data)))
+            self._index_assignees(board_id, task_id, old_task, task)
+            self._record_event(board_id, event)
+            return _local_version(task)
+
+    def delete_task(self, board_id, task_id):
+        with self._lock:
+            task = self._tasks.get(board_id, {}).pop(task_id, None)
+            self._index_assignees(board_id, task_id, task, None)
+
+    def create_tasks(self, board_id, tasks, event=None):
+        task_ids = []
+        with self._lock:
+            board_tasks = self._tasks.setdefault(board_id, {})
+            for data in tasks:
+                task_id = new_document_id()
+                task = copy.deepcopy(_resolve_timestamps(data))
+                board_tasks[task_id] = task
+                self._index_assignees(board_id, task_id, None, task)
+                task_ids.append(task_id)
+            self._record_event(board_id, event)
+        return task_ids
+
+    def list_tasks_page(self, board_id, limit, cursor=None, by_rank=False):
+        with self._lock:
+            board_tasks = self._tasks.get(board_id, {})
+            live_ids = [task_id for task_id, task in board_tasks.items() if _live(task)]
+            if by_rank:
+                keyed = sorted(_rank_key({'id': task_id, **board_tasks[task_id]}) for task_id in live_ids)
+            else:
+                keyed = sorted(live_ids)
+            if cursor is not None:
+                after = _rank_key({'id': cursor[1], 'rank': cursor[0]}) if by_rank else cursor
+                keyed = [key for key in keyed if key > after]
+            task_ids = [key[2] if by_rank else key for key in keyed[:limit]]
+            tasks = [{"id": task_id, **copy.deepcopy(board_tasks[task_id])} for task_id in task_ids]
+        return tasks, _page_cursor(tasks, limit, by_rank)
+
+    def set_task_ranks(self, board_id, ranks):
+        with self._lock:
+            board_tasks = self._tasks.get(board_id, {})
+            for task_id, rank in ranks.items():
+                if task_id in board_tasks and _live(board_tasks[task_id]):
+                    board_tasks[task_id]['rank'] = rank
+
+    def list_assigned_tasks(self, member_ids, board_ids, limit, cursor=None):
+        board_ids = set(board_ids)
+        with self._lock:
+            refs = set()
+            for member_id in member_ids:
+                refs |= self._assigned.get(member_id, set())
+            keyed = []
+            for board_id, task_id in refs:
+                task = self._tasks[board_id][task_id]
+                if board_id not in board_ids or not _live(task):
+                    continue
+                keyed.append(((_due_key(task.get('due_date')), board_id, task_id), board_id, task_id, task))
+            keyed.sort(key=lambda item: item[0])
+            if cursor is not None:
+                after = (_due_key(cursor[0]), cursor[1], cursor[2])
+                keyed = [item for item in keyed if item[0] > after]
+            tasks = [{"id": task_id, "board_id": board_id, **copy.deepcopy(task)}
+                     for _, board_id, task_id, task in keyed[:limit]]
+        return tasks, _next_cursor(tasks, limit)
+
+
+    def list_boards(self, limit, cursor=None):
+        with self._lock:
+            board_ids = sorted(board_id for board_id, board in self._boards.items()
+                               if _live(board) and (cursor is None or board_id > cursor))[:limit]
+            boards = [{"id": board_id, **copy.deepcopy(self._boards[board_id])} for board_id in board_ids]
+        return boards, (boards[-1]['id'] if len(boards) == limit else None)
+
+    def get_boards(self, board_ids, fields=None):
+        with self._lock:
+            boards = []
+            for board_id in board_ids:
+                board = self._boards.get(board_id)
+                live = board is not None and _live(board)
+                boards.append({"id": board_id, **copy.deepcopy(_project(board, fields))} if live else None)
+            return boards
+
+    def get_tasks(self, refs):
+        with self._lock:
+            tasks = []
+            for board_id, task_id in refs:
+                task = self._tasks.get(board_id, {}).get(task_id)
+                live = task is not None and _live(task)
+                tasks.append({"id": task_id, "board_id": board_id, **copy.deepcopy(task)} if live else None)
+            return tasks
+
+    def index_task_tokens(self, board_id, task_id, added, removed):
+        with self._lock:
+            board_index = self._search.setdefault(board_id, {})
+            for token in removed:
+                postings = board_index.get(token)
+                if postings is not None:
+                    postings.pop(task_id, None)
+                    if not postings:
+                        del board_index[token]
+                        self._search_tokens[board_id].remove(token)
+            for token, weight in added.items():
+                if token not in board_index:
+                    board_index[token] = {}
+                    bisect.insort(self._search_tokens.setdefault(board_id, []), token)
+                board_index[token][task_id] = weight
+
+    def find_search_postings(self, board_ids, prefix, limit, cursor=None):
+        # postings in (board_id, token, task_id) order, the cursor is the last one's key
+        after = cursor or ('', '', '')
+        postings = []
+        with self._lock:
+            for board_id in sorted(board_id for board_id in board_ids if board_id >= after[0]):
+                tokens = self._search_tokens.get(board_id, [])
+                start = bisect.bisect_left(tokens, max(prefix, after[1]) if board_id == after[0] else prefix)
+                for token in tokens[start:]:
+                    if not token.startswith(prefix):
+                        break
+                    for task_id in sorted(self._search[board_id][token]):
+                        if (board_id, token, task_id) <= after:
+                            continue
+                        postings.append((board_id, token, task_id, self._search[board_id][token][task_id]))
+                        if len(postings) == limit:
+                            return postings, postings[-1][:3]
+        return postings, None
+
+    def add_search_postings(self, board_id, postings):
+        with self._lock:
+            board_index = self._search.setdefault(board_id, {})
+            for token, tasks in postings.items():
+                if token not in board_index:
+                    board_index[token] = {}
+                    bisect.insort(self._search_tokens.setdefault(board_id, []), token)
+                board_index[token].update(tasks)
+
+    def clear_search_index(self, board_id):
+        with self._lock:
+            self._search.pop(board_id, None)
+            self._search_tokens.pop(board_id, None)
+
+    def get_dashboard(self, user_id):
+        with self._lock:
+            dashboard = self._dashboards.get(user_id)
+            if dashboard is None:
+                return None
+            return {**copy.deepcopy(dashboard), 'version': _local_version(dashboard['boards'])}
+
+    def save_dashboard(self, user_id, boards, version):
+        with self._lock:
+            dashboard = self._dashboards.get(user_id)
+            current = None if dashboard is None else _local_version(dashboard['boards'])
+            if current != version:
+                raise VersionConflict(version)
+            self._dashboards[user_id] = {'complete': True, 'boards': copy.deepcopy(_resolve_timestamps(boards))}
+
+    def set_dashboard_entries(self, entries):
+        with self._lock:
+            for user_id, board_id, summary in entries:
+                boards = self._dashboards.setdefault(user_id, {'complete': False, 'boards': {}})['boards']
+                if summary is None:
+                    boards.pop(board_id, None)
+                else:
+                    boards.setdefault(board_id, {}).update(copy.deepcopy(_resolve_timestamps(summary)))
+
+    def increment_task_counts(self, board_id, deltas):
+        with self._lock:
+            board = self._boards.get(board_id)
+            if board is None:
+                return
+            for field, delta in deltas.items():
+                board[field] = board.get(field, 0) + delta
+
+    def list_completed_before(self, board_id, cutoff, limit, cursor=None):
+        with self._lock:
+            tasks = sorted(({"id": task_id, **copy.deepcopy(task)} for task_id, task in self._tasks.get(board_id, {}).items()
+                            if _live(task) and task.get('status') == 'completed'
+                            and task.get('completed_at') and task['completed_at'] < cutoff),
+                           key=lambda task: (task['completed_at'], task['id']))
+        if cursor is not None:
+            tasks = [task for task in tasks if (task['completed_at'], task['id']) > cursor]
+        tasks = tasks[:limit]
+        return tasks, _archive_cursor(tasks, limit)
+
+    def list_deleted_tasks(self, cutoff, limit):
+        with self._lock:
+            tasks = [{"id": task_id, "board_id": board_id, **copy.deepcopy(task)}
+                     for board_id, board_tasks in self._tasks.items() for task_id, task in board_tasks.items()
+                     if task.get('deleted_at') and task['deleted_at'] < cutoff]
+            return tasks[:limit]
+
+    def purge_tasks(self, refs):
+        with self._lock:
+            for board_id, task_id in refs:
+                task = self._tasks.get(board_id, {}).pop(task_id, None)
+                self._index_assignees(board_id, task_id, task, None)
+
+    def list_deleted_boards(self, cutoff, limit):
+        with self._lock:
+            boards = [{"id": board_id, **copy.deepcopy(board)} for board_id, board in self._boards.items()
+                      if board.get('deleted_at') and board['deleted_at'] < cutoff]
+            return boards[:limit]
+
+    def purge_board_contents(self, board_id, limit):
+        removed = 0
+        with self._lock:
+            self.clear_search_index(board_id)
+            for documents in (self._tasks, self._archived, self._activity, self._recurring):
+                board_documents = documents.get(board_id, {})
+                for document_id in list(board_documents)[:limit - removed]:
+                    document = board_documents.pop(document_id)
+                    if documents is self._tasks:
+                        self._index_assignees(board_id, document_id, document, None)
+                    removed += 1
+        return removed
+
+    def archive_tasks(self, board_id, tasks):
+        with self._lock:
+            archive = self._archived.setdefault(board_id, {})
+            now = _now()
+            moved = 0
+            for task in tasks:
+                stored = self._tasks.get(board_id, {}).pop(task['id'], None)
+                if stored is None:
+                    continue
+                self._index_assignees(board_id, task['id'], stored, None)
+                archive[task['id']] = {**stored, 'archived_at': now}
+                moved += 1
+            board = self._boards.get(board_id)
+            if board is not None:
+                board['archived_count'] = board.get('archived_count', 0) + moved
+            return moved
+
+    def list_archived_tasks(self, board_id, limit, cursor=None):
+        with self._lock:
+            ordered = sorted(self._archived.get(board_id, {}).items(),
+                             key=lambda item: (item[1].get('completed_at'), item[0]), reverse=True)
+            if cursor is not None:
+                ordered = [item for item in ordered if (item[1].get('completed_at'), item[0]) < tuple(cursor)]
+            tasks = [{"id": task_id, **copy.deepcopy(task)} for task_id, task in ordered[:limit]]
+        return tasks, _archive_cursor(tasks, limit)
+
+    def list_activity(self, board_id, limit, cursor=None):
+        now = _now()
+        with self._lock:
+            ordered = sorted(((event['at'], event_id) for event_id, event in self._activity.get(board_id, {}).items()
+                              if event['exp'] > now), reverse=True)
+            if cursor is not None:
+                ordered = [key for key in ordered if key < tuple(cursor)]
+            events = [{"id": event_id, **copy.deepcopy(self._activity[board_id][event_id])}
+                      for _, event_id in ordered[:limit]]
+        return events, _activity_cursor(events, limit)
+
+    def purge_expired_activity(self, now, limit):
+        with self._lock:
+            expired = [(board_id, event_id) for board_id, events in self._activity.items()
+                       for event_id, event in events.items() if event['exp'] <= now][:limit]
+            for board_id, event_id in expired:
+                del self._activity[board_id][event_id]
+            return len(expired)
+
+    def create_recurring(self, board_id, data, event=None):
+        rule_id = new_document_id()
+        with self._lock:
+            self._recurring.setdefault(board_id, {})[rule_id] = copy.deepcopy(_resolve_timestamps(data))
+            self._record_event(board_id, event)
+        return rule_id
+
+    def list_recurring(self, board_id):
+        with self._lock:
+            return [{"id": rule_id, **copy.deepcopy(rule), "version": _local_version(rule)}
+                    for rule_id, rule in self._recurring.get(board_id, {}).items()]
+
+    def get_recurring(self, board_id, rule_id):
+        with self._lock:
+            rule = self._recurring.get(board_id, {}).get(rule_id)
+            if rule is None:
+                return None
+            return {"id": rule_id, **copy.deepcopy(rule), "version": _local_version(rule)}
+
+    def delete_recurring(self, board_id, rule_id, event=None):
+        with self._lock:
+            self._recurring.get(board_id, {}).pop(rule_id, None)
+            self._record_event(board_id, event)
+
+    def iter_due_recurring(self, horizon, page_size=500):
+        with self._lock:
+            due = sorted((rule['next_due'], board_id, rule_id) for board_id, rules in self._recurring.items()
+                         for rule_id, rule in rules.items() if rule['next_due'] <= horizon)
+            rules = [{"id": rule_id, "board_id": board_id, **copy.deepcopy(self._recurring[board_id][rule_id]),
+                      "version": _local_version(self._recurring[board_id][rule_id])} for _, board_id, rule_id in due]
+        yield from rules
+
+    def materialize_recurring(self, board_id, tasks, advances, event=None):
+        with self._lock:
+            rules = self._recurring.get(board_id, {})
+            for rule_id, (version, _) in advances.items():
+                if rule_id not in rules:
+                    raise VersionConflict(rule_id)
+                _check_version(rules[rule_id], version)
+            board_tasks = self._tasks.setdefault(board_id, {})
+            created = [task_id for task_id in tasks if task_id not in board_tasks]
+            for task_id in created:
+                task = copy.deepcopy(_resolve_timestamps(tasks[task_id]))
+                self._index_assignees(board_id, task_id, None, task)
+                board_tasks[task_id] = task
+            for rule_id, (_, next_due) in advances.items():
+                rules[rule_id]['next_due'] = next_due
+            self._record_event(board_id, event)
+            return created
+
+    def find_last_rank(self, board_id):
+        with self._lock:
+            ranks = [task['rank'] for task in self._tasks.get(board_id, {}).values() if task.get('rank')]
+            return max(ranks) if ranks else None
+
+    def find_task_titles(self, board_id, titles):
+        titles = set(titles)
+        with self._lock:
+            return {task.get('title') for task in self._tasks.get(board_id, {}).values()
+                    if _live(task) and task.get('title') in titles}
+
+def _json_default(value):
+    if isinstance(value, datetime.datetime):
+        return {'__datetime__': value.isoformat()}
+    raise TypeError(f"Cannot store value of type {type(value).__name__}")
+
+
+def _json_object_hook(value):
+    if len(value) == 1 and '__datetime__' in value:
+        return datetime.datetime.fromisoformat(value['__datetime__'])
+    return value
+
+
+def _dumps(data):
+    return json.dumps(_resolve_timestamps(data), default=_json_default, separators=(',', ':'))
+
+
+def _loads(text):
+    return json.loads(text, object_hook=_json_object_hook)
+
+
+def _text_version(text):
+    return hashlib.sha256(text.encode()).hexdigest()[:20]
+
+
+def _local_version(data):
+    # the stored JSON round trips exactly, so equal contents always give the same version
+    return _text_version(_dumps(data))
+
+
+def _check_version(data, version):
+    if version is not None and version != _local_version(data):
+        raise VersionConflict(version)
+
+
+class SQLiteStorage(Storage):
+    """Single-file backend with indexed lookups, run in WAL mode.
+
+    Documents are stored as JSON; the columns queried by the routes (user
+    email, board membership, task's board) are kept in indexed columns.
+    """
+
+    _SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            id TEXT PRIMARY KEY,
+            email TEXT,
+            data TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS users_email ON users (email);
+        CREATE TABLE IF NOT EXISTS boards (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS board_members (
+            board_id TEXT NOT NULL,
+            member_id TEXT NOT NULL,
+            PRIMARY KEY (board_id, member_id)
+        );
+        CREATE INDEX IF NOT EXISTS board_members_member ON board_members (member_id);
+        CREATE TABLE IF NOT EXISTS tasks (
+            board_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (board_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS tasks_rank ON tasks (board_id, json_extract(data, '$.rank'), id);
+        CREATE INDEX IF NOT EXISTS tasks_title ON tasks (board_id, json_extract(data, '$.title'));
+        CREATE INDEX IF NOT EXISTS tasks_deleted ON tasks (json_extract(data, '$.deleted_at.__datetime__'))
+            WHERE json_extract(data, '$.deleted_at') IS NOT NULL;
+        CREATE TABLE IF NOT EXISTS task_assignees (
+            member_id TEXT NOT NULL,
+            board_id TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            due_key TEXT NOT NULL,
+            PRIMARY KEY (member_id, board_id, task_id)
+        );
+        CREATE INDEX IF NOT EXISTS task_assignees_due ON task_assignees (member_id, due_key, board_id, task_id);
+        CREATE TABLE IF NOT EXISTS search_postings (
+            board_id TEXT NOT NULL,
+            token TEXT NOT NULL,
+            task_id TEXT NOT NULL,
+            weight INTEGER NOT NULL,
+            PRIMARY KEY (board_id, token, task_id)
+        );
+        CREATE TABLE IF NOT EXISTS archived_tasks (
+            board_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            completed_key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (board_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS archived_tasks_completed ON archived_tasks (board_id, completed_key, id);
+        CREATE TABLE IF NOT EXISTS activity (
+            board_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            at_key TEXT NOT NULL,
+            expires_key TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (board_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS activity_at ON activity (board_id, at_key, id);
+        CREATE INDEX IF NOT EXISTS activity_expires ON activity (expires_key);
+        CREATE TABLE IF NOT EXISTS emails (
+            email TEXT PRIMARY KEY,
+            data TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS recurring (
+            board_id TEXT NOT NULL,
+            id TEXT NOT NULL,
+            next_due TEXT NOT NULL,
+            data TEXT NOT NULL,
+            PRIMARY KEY (board_id, id)
+        );
+        CREATE INDEX IF NOT EXISTS recurring_due ON recurring (next_due, board_id, id);
+        CREATE TABLE IF NOT EXISTS dashboards (
+            user_id TEXT PRIMARY KEY,
+            complete INTEGER NOT NULL,
+            data TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, path: str = 'tasks.db'):
+        # re-entrant so read-modify-write helpers can hold it across both steps
+        self._lock = _DeadlineLock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        # lets a statement compare a stored document with the version it was read at,
+        # so the check holds across processes sharing the database
+        self._conn.create_function('doc_version', 1, _text_version, deterministic=True)
+        self._conn.executescript(self._SCHEMA)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def _write(self, statements, conditional=False):
+        """Run the statements in one transaction, returning the rows each one changed.
+
+        With ``conditional`` the rest are skipped when the first one changes no rows.
+        """
+        with self._lock:
+            self._conn.execute('BEGIN')
+            try:
+                rowcounts = []
+                for sql, params in statements:
+                    rowcounts.append(self._conn.execute(sql, params).rowcount)
+                    if conditional and rowcounts == [0]:
+                        break
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+            return rowcounts
+
+    def _read_board(self, board_id):
+        rows = self._query('SELECT data FROM boards WHERE id = ?', (board_id,))
+        if not rows:
+            return None
+        return _loads(rows[0][0])
+
+    def _save_board(self, board_id, board, event=None, read_version=None):
+        """Write the board; when ``read_version`` is given, only over the board it was read from.
+
+        Returns False when the stored board has changed since, and nothing is written.
+        """
+        if read_version is None:
+            statements = [('INSERT OR REPLACE INTO boards (id, data) VALUES (?, ?)', (board_id, _dumps(board)))]
+        else:
+            statements = [('UPDATE boards SET data = ? WHERE id = ? AND doc_version(data) = ?',
+                           (_dumps(board), board_id, read_version))]
+        statements.append(('DELETE FROM board_members WHERE board_id = ?', (board_id,)))
+        for member_id in board.get('members', []):
+            statements.append(('INSERT OR IGNORE INTO board_members (board_id, member_id) VALUES (?, ?)',
+                               (board_id, member_id)))
+        statements += self._activity_statements(board_id, event)
+        return self._write(statements, conditional=read_version is not None)[0] == 1
+
+    def _change_board(self, board_id, change, event=None, version=None):
+        """Apply ``change`` to the stored board and write it back, returns the board or None if there is none.
+
+        The version check and the write are one statement, so another worker
+        process writing in between is never overwritten: the change is made
+        again on a fresh read, or VersionConflict is raised if ``version`` was given.
+        """
+        with self._lock:
+            while True:
+                rows = self._query('SELECT data FROM boards WHERE id = ?', (board_id,))
+                if not rows:
+                    return None
+                board = _loads(rows[0][0])
+                _check_version(board, version)
+                change(board)
+                if self._save_board(board_id, board, event, _text_version(rows[0][0])):
+                    return board
+                if version is not None:
+                    raise VersionConflict(version)
+
+    def _activity_statements(self, board_id, event):
+        if event is None:
+            return []
+        event = _resolve_timestamps(event)
+        return [('INSERT INTO activity (board_id, id, at_key, expires_key, data) VALUES (?, ?, ?, ?, ?)',
+                 (board_id, new_document_id(), event['at'].isoformat(), event['exp'].isoformat(), _dumps(event)))]
+
+    def _assignee_statements(self, board_id, task_id, task):
+        statements = [('DELETE FROM task_assignees WHERE board_id = ? AND task_id = ?', (board_id, task_id))]
+        if task is not None:
+            due_key = _due_key(task.get('due_date'))
+            for member_id in set(task.get('assigned_users') or []):
+                statements.append(('INSERT INTO task_assignees (member_id, board_id, task_id, due_key) '
+                                   'VALUES (?, ?, ?, ?)', (member_id, board_id, task_id, due_key)))
+        return statements
+
+    def get_user(self, user_id):
+        rows = self._query('SELECT data FROM users WHERE id = ?', (user_id,))
+        return _loads(rows[0][0]) if rows else None
+
+    def set_user(self, user_id, data):
+        self._write([('INSERT OR REPLACE INTO users (id, email, data) VALUES (?, ?, ?)',
+                      (user_id, data.get('email'), _dumps(data)))])
+
+    def get_email_entry(self, email):
+        rows = self._query('SELECT data FROM emails WHERE email = ?', (email,))
+        return _loads(rows[0][0]) if rows else None
+
+    def claim_email(self, email, user_id, user_data, pending):
+        with self._lock:
+            entry = self.get_email_entry(email)
+            if not _claimable(entry, user_id, pending):
+                return entry
+            new_entry = {'uid': user_id, 'email': email, 'pending': pending}
+            if entry is not None and entry['uid'] != user_id:
+                new_entry['invite_id'] = entry['uid']
+            statements = [('INSERT OR REPLACE INTO emails (email, data) VALUES (?, ?)', (email, _dumps(new_entry)))]
+            if user_data is not None:
+                statements.append(('INSERT OR REPLACE INTO users (id, email, data) VALUES (?, ?, ?)',
+                                   (user_id, user_data.get('email'), _dumps(user_data))))
+            self._write(statements)
+            return new_entry
+
+    def find_users_by_email(self, email):
+        rows = self._query('SELECT id, data FROM users WHERE email = ?', (email,))
+        return [{"id": user_id, **_loads(data)} for user_id, data in rows]
+
+    def create_board(self, data):
+        board_id = new_document_id()
+        self._save_board(board_id, data)
+        return board_id
+
+    def get_board(self, board_id, include_deleted=False, with_version=False):
+        board = self._read_board(board_id)
+        if board is None or not (include_deleted or _live(board)):
+            return None
+        if with_version:
+            return {"id": board_id, **board, "version": _local_version(board)}
+        return {"id": board_id, **board}
+
+    def update_board(self, board_id, data, event=None, version=None):
+        # resolved here so the version returned is the version stored
+        data = _resolve_timestamps(data)
+        board = self._change_board(board_id, lambda board: board.update(data), event, version)
+        if board is None:
+            raise DocumentDeleted(board_id)
+        return _local_version(board)
+
+    def delete_board(self, board_id):
+        self._write([
+            ('DELETE FROM task_assignees WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM search_postings WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM archived_tasks WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM activity WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM recurring WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM tasks WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM board_members WHERE board_id = ?', (board_id,)),
+            ('DELETE FROM boards WHERE id = ?', (board_id,)),
+        ])
+
+    def list_member_boards(self, member_id, fields=None):
+        rows = self._query(
+            'SELECT boards.id, boards.data FROM board_members '
+            'JOIN boards ON boards.id = board_members.board_id '
+            "WHERE board_members.member_id = ? AND json_extract(boards.data, '$.deleted_at') IS NULL", (member_id,))
+        return [{"id": board_id, **_project(_loads(data), fields)} for board_id, data in rows]
+
+    def add_member(self, board_id, member_id, email=None, event=None):
+        def add(board):
+            members = board.setdefault('members', [])
+            if member_id not in members:
+                members.append(member_id)
+            if email is not None:
+                board.setdefault('member_emails', {})[member_id] = email
+
+        if self._change_board(board_id, add, event) is None:
+            raise KeyError(board_id)
+
+    def remove_member(self, board_id, member_id, event=None):
+        def remove(board):
+            board['members'] = [m for m in board.get('members', []) if m != member_id]
+            board.get('member_emails', {}).pop(member_id, None)
+
+        if self._change_board(board_id, remove, event) is None:
+            raise KeyError(board_id)
+
+    def replace_member(self, board_id, old_member_id, new_member_id):
+        def replace(board):
+            members = [m for m in board.get('members', []) if m != old_member_id]
+            if new_member_id not in members:
+                members.append(new_member_id)
+            board['members'] = members
+
+        if self._change_board(board_id, replace) is None:
+            raise KeyError(board_id)
+
+    def set_member_emails(self, board_id, emails):
+        def fill(board):
+            member_emails = board.setdefault('member_emails', {})
+            for member_id, email in emails.items():
+                if member_id in board.get('members', []):
+                    member_emails[member_id] = email
+
+        self._change_board(board_id, fill)
+
+    def create_task(self, board_id, data, event=None):
+        task_id = new_document_id()
+        self._write([('INSERT INTO tasks (board_id, id, data) VALUES (?, ?, ?)',
+                      (board_id, task_id, _dumps(data)))]
+                    + self._assignee_statements(board_id, task_id, data)
+                    + self._activity_statements(board_id, event))
+        return task_id
+
+    def get_task(self, board_id, task_id, include_deleted=False, with_version=False):
+        rows = self._query('SELECT data FROM tasks WHERE board_id = ? AND id = ?', (board_id, task_id))
+        if not rows:
+            return None
+        task = _loads(rows[0][0])
+        if not (include_deleted or _live(task)):
+            return None
+        if with_version:
+            return {"id": task_id, **task, "version": _local_version(task)}
+        return {"id": task_id, **task}
+
+    def list_tasks(self, board_id, fields=None, by_rank=False):
+        sql = "SELECT id, data FROM tasks WHERE board_id = ? AND json_extract(data, '$.deleted_at') IS NULL"
+        if by_rank:
+            # unranked tasks last, SQLite sorts NULL first on its own
+            sql += " ORDER BY json_extract(data, '$.rank') IS NULL, json_extract(data, '$.rank'), id"
+        rows = self._query(sql, (board_id,))
+        return [{"id": task_id, **_project(_loads(data), fields)} for task_id, data in rows]
+
+    def update_task(self, board_id, task_id, data, event=None, version=None):
+        data = _resolve_timestamps(data)
+        with self._lock:
+            # compared and written in one statement, see _change_board
+            while True:
+                rows = self._query('SELECT data FROM tasks WHERE board_id = ? AND id = ?', (board_id, task_id))
+                if not rows:
+                    raise DocumentDeleted(task_id)
+                task = _loads(rows[0][0])
+                _check_version(task, version)
+                task.update(data)
+                rowcounts = self._write(
+                    [('UPDATE tasks SET data = ? WHERE board_id = ? AND id = ? AND doc_version(data) = ?',
+                      (_dumps(task), board_id, task_id, _text_version(rows[0][0])))]
+                    + self._assignee_statements(board_id, task_id, task)
+                    + self._activity_statements(board_id, event), conditional=True)
+                if rowcounts[0] == 1:
+                    return _local_version(task)
+                if version is not None:
+                    raise VersionConflict(version)
+
+    def delete_task(self, board_id, task_id):
+        self._write([('DELETE FROM tasks WHERE board_id = ? AND id = ?', (board_id, task_id))]
+                    + self._assignee_statements(board_id, task_id, None))
+
+    def create_tasks(self, board_id, tasks, event=None):
+        task_ids = [new_document_id() for _ in tasks]
+        statements = []
+        for task_id, data in zip(task_ids, tasks):
+            statements.append(('INSERT INTO tasks (board_id, id, data) VALUES (?, ?, ?)',
+                               (board_id, task_id, _dumps(data))))
+            statements += self._assignee_statements(board_id, task_id, data)
+        self._write(statements + self._activity_statements(board_id, event))
+        return task_ids
+
+    def list_tasks_page(self, board_id, limit, cursor=None, by_rank=False):
+        if by_rank:
+            sql = "SELECT id, data FROM tasks WHERE board_id = ? AND json_extract(data, '$.deleted_at') IS NULL"
+            params = [board_id]
+            if cursor is not None and cursor[0] is None:
+                sql += " AND json_extract(data, '$.rank') IS NULL AND id > ?"
+                params.append(cursor[1])
+            elif cursor is not None:
+                sql += " AND (json_extract(data, '$.rank') IS NULL OR (json_extract(data, '$.rank'), id) > (?, ?))"
+                params += list(cursor)
+            rows = self._query(sql + " ORDER BY json_extract(data, '$.rank') IS NULL, json_extract(data, '$.rank'), id "
+                                     "LIMIT ?", params + [limit])
+        else:
+            rows = self._query("SELECT id, data FROM tasks WHERE board_id = ? AND id > ? AND json_extract(data, '$.deleted_at') IS NULL "
+                               "ORDER BY id LIMIT ?", (board_id, cursor or '', limit))
+        tasks = [{"id": task_id, **_loads(data)} for task_id, data in rows]
+        return tasks, _page_cursor(tasks, limit, by_rank)
+
+    def set_task_ranks(self, board_id, ranks):
+        self._write([("UPDATE tasks SET data = json_set(data, '$.rank', ?) WHERE board_id = ? AND id = ? "
+                      "AND json_extract(data, '$.deleted_at') IS NULL",
+                      (rank, board_id, task_id)) for task_id, rank in ranks.items()])
+
+    def list_assigned_tasks(self, member_ids, board_ids, limit, cursor=None):
+        member_ids, board_ids = list(member_ids), list(board_ids)
+        sql = ('SELECT DISTINCT a.due_key, a.board_id, a.task_id, t.data FROM task_assignees a '
+               'JOIN tasks t ON t.board_id = a.board_id AND t.id = a.task_id '
+               f"WHERE a.member_id IN ({','.join('?' * len(member_ids))}) "
+               f"AND a.board_id IN ({','.join('?' * len(board_ids))}) "
+               "AND json_extract(t.data, '$.deleted_at') IS NULL")
+        params = member_ids + board_ids
+        if cursor is not None:
+            sql += ' AND (a.due_key, a.board_id, a.task_id) > (?, ?, ?)'
+            params = params + [_due_key(cursor[0]), cursor[1], cursor[2]]
+        sql += ' ORDER BY a.due_key, a.board_id, a.task_id LIMIT ?'
+        rows = self._query(sql, params + [limit])
+        tasks = [{"id": task_id, "board_id": board_id, **_loads(data)} for _, board_id, task_id, data in rows]
+        return tasks, _next_cursor(tasks, limit)
+
+
+    def list_boards(self, limit, cursor=None):
+        rows = self._query("SELECT id, data FROM boards WHERE id > ? AND json_extract(data, '$.deleted_at') IS NULL ORDER BY id LIMIT ?",
+                           (cursor or '', limit))
+        boards = [{"id": board_id, **_loads(data)} for board_id, data in rows]
+        return boards, (boards[-1]['id'] if len(boards) == limit else None)
+
+    def get_boards(self, board_ids, fields=None):
+        boards = []
+        for board_id in board_ids:
+            board = self.get_board(board_id)
+            boards.append({"id": board_id, **_project(board, fields)} if board is not None else None)
+        return boards
+
+    def get_tasks(self, refs):
+        tasks = []
+        for board_id, task_id in refs:
+            task = self.get_task(board_id, task_id)
+            tasks.append({"board_id": board_id, **task} if task is not None else None)
+        return tasks
+
+    def index_task_tokens(self, board_id, task_id, added, removed):
+        statements = [('DELETE FROM search_postings WHERE board_id = ? AND token = ? AND task_id = ?',
+                       (board_id, token, task_id)) for token in removed]
+        statements += [('INSERT OR REPLACE INTO search_postings (board_id, token, task_id, weight) '
+                        'VALUES (?, ?, ?, ?)', (board_id, token, task_id, weight))
+                       for token, weight in added.items()]
+        self._write(statements)
+
+    def find_search_postings(self, board_ids, prefix, limit, cursor=None):
+        # postings in (board_id, token, task_id) order, the cursor is the last one's key
+        after = list(cursor or ('', '', ''))
+        postings = []
+        board_ids = sorted(board_id for board_id in board_ids if board_id >= after[0])
+        for start in range(0, len(board_ids), 500):
+            chunk = board_ids[start:start + 500]
+            postings += self._query(
+                'SELECT board_id, token, task_id, weight FROM search_postings '
+                f"WHERE board_id IN ({','.join('?' * len(chunk))}) AND token >= ? AND token < ? "
+                'AND (board_id, token, task_id) > (?, ?, ?) ORDER BY board_id, token, task_id LIMIT ?',
+                chunk + [prefix, prefix + '\uffff'] + after + [limit - len(postings)])
+            if len(postings) == limit:
+                return [tuple(row) for row in postings], tuple(postings[-1][:3])
+        return [tuple(row) for row in postings], None
+
+    def add_search_postings(self, board_id, postings):
+        self._write([('INSERT OR REPLACE INTO search_postings (board_id, token, task_id, weight) '
+                      'VALUES (?, ?, ?, ?)', (board_id, token, task_id, weight))
+                     for token, tasks in postings.items() for task_id, weight in tasks.items()])
+
+    def clear_search_index(self, board_id):
+        self._write([('DELETE FROM search_postings WHERE board_id = ?', (board_id,))])
+
+    def get_dashboard(self, user_id):
+        rows = self._query('SELECT complete, data FROM dashboards WHERE user_id = ?', (user_id,))
+        if not rows:
+            return None
+        complete, data = rows[0]
+        return {'complete': bool(complete), 'boards': _loads(data), 'version': _text_version(data)}
+
+    def save_dashboard(self, user_id, boards, version):
+        if version is None:
+            statement = ('INSERT OR IGNORE INTO dashboards (user_id, complete, data) VALUES (?, 1, ?)',
+                         (user_id, _dumps(boards)))
+        else:
+            statement = ('UPDATE dashboards SET complete = 1, data = ? WHERE user_id = ? AND doc_version(data) = ?',
+                         (_dumps(boards), user_id, version))
+        if self._write([statement]) == [0]:
+            raise VersionConflict(version)
+
+    def set_dashboard_entries(self, entries):
+        # each entry is changed in place by its statement, so writes from other processes aren't overwritten
+        statements = []
+        for user_id, board_id, entry in entries:
+            path = f'$."{board_id}"'
+            if entry is None:
+                statements.append(('UPDATE dashboards SET data = json_remove(data, ?) WHERE user_id = ?',
+                                   (path, user_id)))
+            else:
+                statements.append(("INSERT INTO dashboards (user_id, complete, data) VALUES (?, 0, json_object(?, json(?))) "
+                                   "ON CONFLICT (user_id) DO UPDATE SET data = json_set(data, ?, json(?))",
+                                   (user_id, board_id, _dumps(entry), path, _dumps(entry))))
+        self._write(statements)
+
+    def increment_task_counts(self, board_id, deltas):
+        statements = [("UPDATE boards SET data = json_set(data, ?, COALESCE(json_extract(data, ?), 0) + ?) WHERE id = ?",
+                       (f'$.{field}', f'$.{field}', delta, board_id)) for field, delta in deltas.items()]
+        self._write(statements)
+
+    def list_completed_before(self, board_id, cutoff, limit, cursor=None):
+        sql = ("SELECT id, data FROM tasks WHERE board_id = ? AND json_extract(data, '$.status') = 'completed' "
+               "AND json_extract(data, '$.deleted_at') IS NULL "
+               "AND json_extract(data, '$.completed_at.__datetime__') < ?")
+        params = [board_id, cutoff.isoformat()]
+        if cursor is not None:
+            sql += " AND (json_extract(data, '$.completed_at.__datetime__'), id) > (?, ?)"
+            params += [cursor[0].isoformat(), cursor[1]]
+        sql += " ORDER BY json_extract(data, '$.completed_at.__datetime__'), id LIMIT ?"
+        rows = self._query(sql, params + [limit])
+        tasks = [{"id": task_id, **_loads(data)} for task_id, data in rows]
+        return tasks, _archive_cursor(tasks, limit)
+
+    def list_deleted_tasks(self, cutoff, limit):
+        rows = self._query("SELECT board_id, id, data FROM tasks WHERE json_extract(data, '$.deleted_at') IS NOT NULL "
+                           "AND json_extract(data, '$.deleted_at.__datetime__') < ? LIMIT ?",
+                           (cutoff.isoformat(), limit))
+        return [{"id": task_id, "board_id": board_id, **_loads(data)} for board_id, task_id, data in rows]
+
+    def purge_tasks(self, refs):
+        statements = []
+        for board_id, task_id in refs:
+            statements.append(('DELETE FROM tasks WHERE board_id = ? AND id = ?', (board_id, task_id)))
+            statements += self._assignee_statements(board_id, task_id, None)
+        self._write(statements)
+
+    def list_deleted_boards(self, cutoff, limit):
+        rows = self._query("SELECT id, data FROM boards WHERE json_extract(data, '$.deleted_at.__datetime__') < ? LIMIT ?",
+                           (cutoff.isoformat(), limit))
+        return [{"id": board_id, **_loads(data)} for board_id, data in rows]
+
+    def purge_board_contents(self, board_id, limit):
+        removed = 0
+        # the index rows go first so none is left pointing at a removed task
+        for table in ('task_assignees', 'search_postings', 'tasks', 'archived_tasks', 'activity', 'recurring'):
+            removed += self._write([(f'DELETE FROM {table} WHERE rowid IN '
+                                     f'(SELECT rowid FROM {table} WHERE board_id = ? LIMIT ?)',
+                                     (board_id, limit - removed))])[0]
+            if removed == limit:
+                break
+        return removed
+
+    def archive_tasks(self, board_id, tasks):
+        with self._lock:
+            statements = []
+            archived_at = _now()
+            # tasks deleted since they were listed are neither archived nor counted
+            present = {task_id for task_id, in self._query(
+                f"SELECT id FROM tasks WHERE board_id = ? AND id IN ({','.join('?' * len(tasks))})",
+                [board_id] + [task['id'] for task in tasks])} if tasks else set()
+            tasks = [task for task in tasks if task['id'] in present]
+            for task in tasks:
+                data = {key: value for key, value in task.items() if key != 'id'}
+                data['archived_at'] = archived_at
+                statements.append(('INSERT OR REPLACE INTO archived_tasks (board_id, id, completed_key, data) '
+                                   'VALUES (?, ?, ?, ?)',
+                                   (board_id, task['id'], task['completed_at'].isoformat(), _dumps(data))))
+                statements.append(('DELETE FROM tasks WHERE board_id = ? AND id = ?', (board_id, task['id'])))
+                statements += self._assignee_statements(board_id, task['id'], None)
+            statements.append(("UPDATE boards SET data = json_set(data, '$.archived_count', "
+                               "COALESCE(json_extract(data, '$.archived_count'), 0) + ?) WHERE id = ?",
+                               (len(tasks), board_id)))
+            self._write(statements)
+            return len(tasks)
+
+    def list_archived_tasks(self, board_id, limit, cursor=None):
+        sql = 'SELECT id, data FROM archived_tasks WHERE board_id = ?'
+        params = [board_id]
+        if cursor is not None:
+            sql += ' AND (completed_key, id) < (?, ?)'
+            params += [cursor[0].isoformat(), cursor[1]]
+        sql += ' ORDER BY completed_key DESC, id DESC LIMIT ?'
+        rows = self._query(sql, params + [limit])
+        tasks = [{"id": task_id, **_loads(data)} for task_id, data in rows]
+        return tasks, _archive_cursor(tasks, limit)
+
+    def list_activity(self, board_id, limit, cursor=None):
+        sql = 'SELECT id, data FROM activity WHERE board_id = ? AND expires_key > ?'
+        params = [board_id, _now().isoformat()]
+        if cursor is not None:
+            sql += ' AND (at_key, id) < (?, ?)'
+            params += [cursor[0].isoformat(), cursor[1]]
+        sql += ' ORDER BY at_key DESC, id DESC LIMIT ?'
+        rows = self._query(sql, params + [limit])
+        events = [{"id": event_id, **_loads(data)} for event_id, data in rows]
+        return events, _activity_cursor(events, limit)
+
+    def purge_expired_activity(self, now, limit):
+        with self._lock:
+            rows = self._query('SELECT board_id, id FROM activity WHERE expires_key <= ? LIMIT ?',
+                               (now.isoformat(), limit))
+            self._write([('DELETE FROM activity WHERE board_id = ? AND id = ?', row) for row in rows])
+            return len(rows)
+
+    def create_recurring(self, board_id, data, event=None):
+        rule_id = new_document_id()
+        self._write([('INSERT INTO recurring (board_id, id, next_due, data) VALUES (?, ?, ?, ?)',
+                      (board_id, rule_id, data['next_due'], _dumps(data)))]
+                    + self._activity_statements(board_id, event))
+        return rule_id
+
+    def list_recurring(self, board_id):
+        rows = self._query('SELECT id, data FROM recurring WHERE board_id = ?', (board_id,))
+        return [{"id": rule_id, **rule, "version": _local_version(rule)}
+                for rule_id, rule in ((rule_id, _loads(data)) for rule_id, data in rows)]
+
+    def get_recurring(self, board_id, rule_id):
+        rows = self._query('SELECT data FROM recurring WHERE board_id = ? AND id = ?', (board_id, rule_id))
+        if not rows:
+            return None
+        rule = _loads(rows[0][0])
+        return {"id": rule_id, **rule, "version": _local_version(rule)}
+
+    def delete_recurring(self, board_id, rule_id, event=None):
+        self._write([('DELETE FROM recurring WHERE board_id = ? AND id = ?', (board_id, rule_id))]
+                    + self._activity_statements(board_id, event))
+
+    def iter_due_recurring(self, horizon, page_size=500):
+        cursor = ('', '', '')
+        while True:
+            rows = self._query('SELECT board_id, id, next_due, data FROM recurring '
+                               'WHERE next_due <= ? AND (next_due, board_id, id) > (?, ?, ?) '
+                               'ORDER BY next_due, board_id, id LIMIT ?', (horizon, *cursor, page_size))
+            for board_id, rule_id, _, data in rows:
+                rule = _loads(data)
+                yield {"id": rule_id, "board_id": board_id, **rule, "version": _local_version(rule)}
+            if len(rows) < page_size:
+                return
+            cursor = (rows[-1][2], rows[-1][0], rows[-1][1])
+
+    def materialize_recurring(self, board_id, tasks, advances, event=None):
+        with self._lock:
+            statements = []
+            for rule_id, (version, next_due) in advances.items():
+                rows = self._query('SELECT data FROM recurring WHERE board_id = ? AND id = ?', (board_id, rule_id))
+                if not rows:
+                    raise VersionConflict(rule_id)
+                rule = _loads(rows[0][0])
+                _check_version(rule, version)
+                rule['next_due'] = next_due
+                statements.append(('UPDATE recurring SET next_due = ?, data = ? WHERE board_id = ? AND id = ?',
+                                   (next_due, _dumps(rule), board_id, rule_id)))
+            existing = set()
+            task_ids = list(tasks)
+            # chunked to stay under SQLite's bound parameter limit
+            for start in range(0, len(task_ids), 500):
+                chunk = task_ids[start:start + 500]
+                rows = self._query(f"SELECT id FROM tasks WHERE board_id = ? AND id IN ({','.join('?' * len(chunk))})",
+                                   [board_id] + chunk)
+                existing.update(task_id for task_id, in rows)
+            created = [task_id for task_id in task_ids if task_id not in existing]
+            for task_id in created:
+                # IGNORE keeps an occurrence another worker wrote since
+                statements.append(('INSERT OR IGNORE INTO tasks (board_id, id, data) VALUES (?, ?, ?)',
+                                   (board_id, task_id, _dumps(tasks[task_id]))))
+                statements += self._assignee_statements(board_id, task_id, tasks[task_id])
+            self._write(statements + self._activity_statements(board_id, event))
+            return created
+
+    def find_last_rank(self, board_id):
+        rows = self._query("SELECT max(json_extract(data, '$.rank')) FROM tasks WHERE board_id = ?", (board_id,))
+        return rows[0][0]
+
+    def find_task_titles(self, board_id, titles):
+        titles = list(set(titles))
+        found = set()
+        # chunked to stay under SQLite's bound parameter limit
+        for start in range(0, len(titles), 500):
+            chunk = titles[start:start + 500]
+            rows = self._query("SELECT json_extract(data, '$.title') FROM tasks WHERE board_id = ? "
+                               f"AND json_extract(data, '$.title') IN ({','.join('?' * len(chunk))}) "
+                               "AND json_extract(data, '$.deleted_at') IS NULL", [board_id] + chunk)
+            found.update(title for title, in rows)
+        return found
+
+
+def get_storage(backend: Optional[str] = None) -> Storage:
+    """Build the backend named by ``backend`` or the TASK_STORAGE env variable.
+
+    Supported values are ``firestore`` (default), ``memory`` and ``sqlite``;
+    the SQLite file is taken from TASK_SQLITE_PATH.
+    """
+    backend = (backend or os.environ.get('TASK_STORAGE', 'firestore')).lower()
+    if backend == 'firestore':
+        return FirestoreStorage()
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(os.environ.get('TASK_SQLITE_PATH', 'tasks.db'))
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="One-off Firestore data migrations")
+    parser.add_argument('migration', choices=['task-board-ids'],
+                        help="task-board-ids: add board_id to tasks written before it was kept on them")
+    args = parser.parse_args()
+
+    updated = FirestoreStorage().backfill_task_board_ids()
+    print(f"Added board_id to {updated} tasks")
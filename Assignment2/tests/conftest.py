@@ -0,0 +1,91 @@
+"""Fixtures shared by the tests, run from Assignment2 with ``python -m pytest``.
+
+Every test that takes ``store`` runs once against each local backend; the
+Firestore backend needs a project and credentials, so it isn't covered here.
+Route tests take ``client``, the app on a fresh memory backend signed in as
+``u1`` (the other USERS sign in with their own token cookie).
+"""
+import os
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+# main.py builds its backend when it is imported
+os.environ.setdefault('TASK_STORAGE', 'memory')
+
+from storage import SERVER_TIMESTAMP, MemoryStorage, SQLiteStorage  # noqa: E402
+
+USERS = {
+    'token-u1': {'user_id': 'u1', 'email': 'u1@example.com'},
+    'token-u2': {'user_id': 'u2', 'email': 'u2@example.com'},
+}
+
+
+def _verify_token(id_token):
+    if id_token not in USERS:
+        raise ValueError("Unknown test token")
+    return dict(USERS[id_token])
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStorage()
+    return SQLiteStorage(str(tmp_path / 'tasks.db'))
+
+
+@pytest.fixture
+def board(store):
+    """A board with one member, ``u1``, made the way the create board route makes it."""
+    board_id = store.create_board({
+        'title': 'Board',
+        'description': '',
+        'creator_id': 'u1',
+        'members': ['u1'],
+        'task_count': 0,
+        'completed_count': 0,
+        'ranked': True,
+        'created_at': SERVER_TIMESTAMP
+    })
+    return store.get_board(board_id)
+
+
+def add_task(store, board_id, title, **fields):
+    return store.create_task(board_id, {
+        'title': title,
+        'description': '',
+        'creator_id': 'u1',
+        'assigned_users': [],
+        'status': 'pending',
+        'created_at': SERVER_TIMESTAMP,
+        'due_date': None,
+        'completed_at': None,
+        **fields
+    })
+
+
+@pytest.fixture
+def app(monkeypatch):
+    """main.py with a fresh memory backend and USERS as the only valid tokens."""
+    import admission
+    from instrumentation import InstrumentedStorage
+    from writebehind import WriteBehind
+    monkeypatch.chdir(APP_DIR)
+    import main
+    store = InstrumentedStorage(MemoryStorage())
+    monkeypatch.setattr(main, 'store', store)
+    monkeypatch.setattr(main, 'member_email_backfill', WriteBehind('member_emails', store.set_member_emails))
+    monkeypatch.setattr(main, 'verify_token', _verify_token)
+    monkeypatch.setattr(admission, 'buckets', admission.LocalBuckets())
+    return main
+
+
+@pytest.fixture
+def client(app):
+    from fastapi.testclient import TestClient
+    client = TestClient(app.app)
+    client.cookies.set('token', 'token-u1')
+    return client
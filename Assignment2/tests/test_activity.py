@@ -0,0 +1,86 @@
+import datetime
+
+import activity
+from conftest import add_task
+
+UTC = datetime.timezone.utc
+NOW = datetime.datetime(2026, 10, 19, 8, 30, tzinfo=UTC)
+
+
+def _event_at(minutes, name):
+    return {**activity.event(activity.TASK_CREATED, 'u1', name=name), 'at': NOW + datetime.timedelta(minutes=minutes)}
+
+
+def test_events_keep_only_the_keys_they_need():
+    record = activity.event(activity.TASK_CREATED, 'u1', 't1', 'x' * 100, now=NOW)
+
+    assert set(record) == {'t', 'a', 'k', 'n', 'at', 'exp'}
+    assert len(record['n']) == activity.TITLE_LIMIT
+    assert record['exp'] == NOW + activity.RETENTION
+
+
+def test_an_edit_that_changes_the_assignee_is_an_assignment():
+    task = {'title': 'Task', 'description': '', 'assigned_users': ['u1']}
+
+    record = activity.task_edit_event('u1', 't1', task, {'assigned_users': ['u2'], 'description': 'More'})
+
+    assert (record['t'], record['m'], record['f']) == (activity.TASK_ASSIGNED, 'u2', 'd')
+    assert activity.task_edit_event('u1', 't1', task, {'title': 'Task', 'due_date': ''}) is None
+
+
+def test_former_members_are_named_from_their_events():
+    removed = activity.event(activity.MEMBER_REMOVED, 'u1', name='u2@example.com', member_id='u2', count=2)
+    names = activity.member_names([removed], {'u1': 'u1@example.com'})
+
+    assert activity.describe(removed, names) == "u1@example.com removed u2@example.com, unassigning 2 tasks"
+    assert activity.describe(activity.event(activity.TASK_COMPLETED, 'gone', name='Task'), names) == \
+        'A former member completed "Task"'
+
+
+def test_events_are_written_with_the_change_they_describe(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+
+    store.update_task(board['id'], task_id, {'status': 'completed'},
+                      activity.event(activity.TASK_COMPLETED, 'u1', task_id, 'Task'))
+
+    events, cursor = store.list_activity(board['id'], 10)
+    assert [(event['t'], event['k']) for event in events] == [(activity.TASK_COMPLETED, task_id)]
+    assert cursor is None
+
+
+def test_the_feed_pages_newest_first(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    for minutes in range(5):
+        store.update_task(board['id'], task_id, {'description': str(minutes)}, _event_at(minutes, f"Event {minutes}"))
+
+    names, cursor = [], None
+    while True:
+        events, cursor = store.list_activity(board['id'], 2, cursor)
+        names += [event['n'] for event in events]
+        if cursor is None:
+            break
+
+    assert names == [f"Event {minutes}" for minutes in reversed(range(5))]
+
+
+def test_expired_events_are_hidden_then_purged(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    expired = {**_event_at(0, 'Expired'), 'exp': datetime.datetime.now(UTC) - datetime.timedelta(seconds=1)}
+    store.update_task(board['id'], task_id, {'description': 'old'}, expired)
+    store.update_task(board['id'], task_id, {'description': 'new'}, _event_at(1, 'Kept'))
+
+    assert [event['n'] for event in store.list_activity(board['id'], 10)[0]] == ['Kept']
+    assert store.purge_expired_activity(datetime.datetime.now(UTC), 10) == 1
+    assert store.purge_expired_activity(datetime.datetime.now(UTC), 10) == 0
+
+
+def test_the_feed_route_describes_each_event(client, app):
+    client.post('/create-board', data={'title': 'Board'})
+    board_id = app.store.list_member_boards('u1')[0]['id']
+    client.post(f'/board/{board_id}/create-task', data={'title': 'Write docs'})
+
+    body = client.get(f'/api/board/{board_id}/activity').json()
+
+    assert body['events'][0]['text'] == 'u1@example.com created "Write docs"'
+    assert body['next_cursor'] is None
+    assert client.get(f'/api/board/{board_id}/activity', params={'cursor': 'not a cursor'}).status_code == 400
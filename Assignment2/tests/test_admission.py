@@ -0,0 +1,91 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import admission
+import deadlines
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    """One board write per user, then a hundred seconds to wait for the next."""
+    monkeypatch.setattr(admission, 'RATE_LIMIT_ENABLED', True)
+    monkeypatch.setitem(admission.RATE_LIMITS, 'board', (1, 0.01))
+
+
+def _metrics(app):
+    return TestClient(app.app, client=('127.0.0.1', 50000)).get('/metrics').text
+
+
+def test_buckets_allow_a_burst_then_say_how_long_to_wait():
+    buckets = admission.LocalBuckets()
+
+    assert [buckets.take('u1', 2, 0.5, now=0) for _ in range(2)] == [0, 0]
+    assert buckets.take('u1', 2, 0.5, now=0) == 2.0
+    assert buckets.take('u1', 2, 0.5, now=2) == 0
+    assert buckets.take('u2', 2, 0.5, now=2) == 0
+
+
+def test_sqlite_buckets_are_shared_between_workers(tmp_path):
+    path = str(tmp_path / 'buckets.db')
+    first, second = admission.SQLiteBuckets(path), admission.SQLiteBuckets(path)
+
+    assert first.take('u1', 1, 1.0, now=0) == 0
+    assert second.take('u1', 1, 1.0, now=0) == 1.0
+
+
+@pytest.mark.parametrize('method, path, expected', [
+    ('POST', '/board/b1/create-task', 'task'),
+    ('POST', '/api/board/b1/task/t1/move', 'task'),
+    ('POST', '/board/b1/remove-member/u2', 'member'),
+    ('POST', '/create-board', 'board'),
+    ('POST', '/api/board/b1/import', 'import'),
+    ('GET', '/board/b1/create-task', None),
+    ('POST', '/logout', None),
+])
+def test_write_routes_are_classified(method, path, expected):
+    assert admission.route_class(method, path) == expected
+
+
+def test_writes_past_the_rate_limit_get_429_with_retry_after(client, limited):
+    assert client.post('/create-board', data={'title': 'First'}, follow_redirects=False).status_code == 303
+
+    response = client.post('/create-board', data={'title': 'Second'}, follow_redirects=False)
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '100'
+    # other users have their own buckets
+    client.cookies.set('token', 'token-u2')
+    assert client.post('/create-board', data={'title': 'Theirs'}, follow_redirects=False).status_code == 303
+
+
+def test_writes_past_the_concurrency_limit_get_503(client, monkeypatch):
+    monkeypatch.setattr(admission, 'write_limiter', admission.ConcurrencyLimiter(0))
+
+    response = client.post('/create-board', data={'title': 'Busy'}, follow_redirects=False)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == str(admission.SHED_RETRY_AFTER)
+    assert client.get('/').status_code == 200
+
+
+def test_rejected_requests_are_in_the_request_metrics(app, client, limited):
+    client.post('/create-board', data={'title': 'First'}, follow_redirects=False)
+    client.post('/create-board', data={'title': 'Second'}, follow_redirects=False)
+
+    text = _metrics(app)
+
+    assert 'http_request_duration_seconds_count{method="POST",route="unmatched",status="429"}' in text
+    assert 'admission_rejections_total{reason="rate_limited",route_class="board"}' in text
+    assert 'http_requests_in_flight 1.0' in text
+
+
+def test_a_deadline_spent_verifying_the_token_answers_504(app, client, monkeypatch):
+    def slow_verify(id_token):
+        raise deadlines.DeadlineExceeded("Request deadline exceeded verifying the token")
+
+    monkeypatch.setattr(app, 'verify_token', slow_verify)
+
+    response = client.post('/create-board', data={'title': 'Late'}, follow_redirects=False)
+
+    assert response.status_code == 504
+    assert 'Retry-After' in response.headers
@@ -0,0 +1,57 @@
+import datetime
+
+import archive
+import search
+from conftest import add_task
+from storage import SERVER_TIMESTAMP
+
+NOW = datetime.datetime(2026, 10, 19, tzinfo=datetime.timezone.utc)
+
+
+def _completed(store, board_id, title, days_ago, **fields):
+    return add_task(store, board_id, title, status='completed',
+                    completed_at=NOW - datetime.timedelta(days=days_ago), **fields)
+
+
+def test_old_completed_tasks_are_moved_in_batches(store, board):
+    old = [_completed(store, board['id'], f"Old {index}", 40 + index) for index in range(5)]
+    recent = _completed(store, board['id'], 'Recent', 2)
+    pending = add_task(store, board['id'], 'Pending')
+
+    assert archive.archive_board(store, board['id'], NOW - datetime.timedelta(days=30), batch_size=2) == 5
+
+    assert sorted(task['id'] for task in store.list_tasks(board['id'])) == sorted([recent, pending])
+    archived, _ = store.list_archived_tasks(board['id'], 10)
+    assert sorted(task['id'] for task in archived) == sorted(old)
+    assert store.get_board(board['id'])['archived_count'] == 5
+
+
+def test_soft_deleted_tasks_do_not_end_the_run_early(store, board):
+    deleted = [_completed(store, board['id'], f"Deleted {index}", 60 + index, deleted_at=SERVER_TIMESTAMP)
+               for index in range(3)]
+    kept = [_completed(store, board['id'], f"Kept {index}", 40 + index) for index in range(3)]
+
+    assert archive.archive_board(store, board['id'], NOW - datetime.timedelta(days=30), batch_size=2) == 3
+
+    archived, _ = store.list_archived_tasks(board['id'], 10)
+    assert sorted(task['id'] for task in archived) == sorted(kept)
+    assert all(store.get_task(board['id'], task_id, include_deleted=True) for task_id in deleted)
+
+
+def test_completed_tasks_page_oldest_first(store, board):
+    ids = [_completed(store, board['id'], f"Task {index}", 50 - index) for index in range(3)]
+
+    tasks, cursor = store.list_completed_before(board['id'], NOW, 2)
+    assert [task['id'] for task in tasks] == ids[:2]
+    tasks, cursor = store.list_completed_before(board['id'], NOW, 2, cursor)
+    assert [task['id'] for task in tasks] == ids[2:]
+    assert cursor is None
+
+
+def test_archived_tasks_leave_the_search_index(store, board):
+    task_id = _completed(store, board['id'], 'Quarterly report', 90)
+    search.index_task(store, board['id'], task_id, None, store.get_task(board['id'], task_id))
+
+    archive.archive_board(store, board['id'], NOW - datetime.timedelta(days=30))
+
+    assert search.search_tasks(store, [board['id']], 'quarterly') == []
@@ -0,0 +1,36 @@
+import assets
+
+
+def test_fingerprinted_files_are_cached_for_good(client):
+    response = client.get(assets.asset_url('/forms.js'))
+
+    assert response.status_code == 200
+    assert response.headers['cache-control'] == assets.IMMUTABLE
+
+
+def test_files_without_the_current_fingerprint_are_revalidated(client):
+    for url in ('/static/forms.js', '/static/forms.js?v=stale'):
+        assert client.get(url).headers.get('cache-control') != assets.IMMUTABLE
+
+
+def test_the_service_worker_is_never_cached_and_controls_the_site(client):
+    response = client.get(assets.asset_url('/' + assets.SERVICE_WORKER))
+
+    assert response.headers['cache-control'] == 'no-cache'
+    assert response.headers['service-worker-allowed'] == '/'
+
+
+def test_missing_files_get_no_caching_headers(client):
+    response = client.get(assets.asset_url('/missing.js'))
+
+    assert response.status_code == 404
+    assert 'cache-control' not in response.headers
+
+
+def test_any_change_under_static_changes_the_fingerprint(tmp_path):
+    (tmp_path / 'app.js').write_text('one')
+    before = assets._version(str(tmp_path))
+
+    (tmp_path / 'app.js').write_text('two')
+
+    assert assets._version(str(tmp_path)) != before
@@ -0,0 +1,52 @@
+import argparse
+import asyncio
+from collections import Counter
+
+import benchmark
+
+
+def test_percentile_picks_the_nearest_sample():
+    samples = list(range(1, 101))
+    assert benchmark.percentile(samples, 50) == 51
+    assert benchmark.percentile(samples, 99) == 99
+    assert benchmark.percentile(samples, 100) == 100
+    assert benchmark.percentile([], 95) == 0.0
+
+
+def test_summarize_averages_backend_ops_per_request():
+    summary = benchmark.summarize('scenario', [0.01, 0.02], Counter(reads=6, queries=2), 0.5)
+    assert summary['requests'] == 2
+    assert summary['throughput_rps'] == 4.0
+    assert summary['backend_ops_per_request'] == {'reads': 3, 'writes': 0, 'queries': 1, 'documents': 0}
+
+
+def test_compare_flags_p95_regressions_over_the_threshold():
+    baseline = {'results': [{'scenario': 'fast', 'p95_ms': 10.0}, {'scenario': 'slow', 'p95_ms': 10.0}]}
+    results = [{'scenario': 'fast', 'p95_ms': 11.0}, {'scenario': 'slow', 'p95_ms': 13.0},
+               {'scenario': 'new', 'p95_ms': 1.0}]
+    assert benchmark.compare(results, baseline, 0.2) == ['slow']
+
+
+def test_seed_board_ranks_its_tasks_in_order(store):
+    board_id = benchmark.seed_board(store, 5, 3)
+
+    board = store.get_board(board_id)
+    assert len(board['members']) == 3
+    tasks = store.list_tasks(board_id, ['title'], by_rank=True)
+    assert [task['title'] for task in tasks] == [f"Task {index}" for index in range(5)]
+
+
+def test_run_benchmarks_covers_every_scenario(app, monkeypatch):
+    monkeypatch.setattr(app, 'verify_token', app.verify_token)
+    args = argparse.Namespace(boards=2, tasks=[3], members=[1, 2], iterations=2, delete_iterations=1)
+
+    results = asyncio.run(benchmark.run_benchmarks(args))
+
+    assert [result['scenario'] for result in results] == [
+        'root boards=2',
+        'view_board tasks=3 members=1', 'delete_board_submit tasks=3 members=1',
+        'view_board tasks=3 members=2', 'remove_member tasks=3 members=2', 'delete_board_submit tasks=3 members=2',
+    ]
+    view_board = results[1]
+    assert view_board['requests'] == 2
+    assert view_board['backend_ops_per_request']['reads'] + view_board['backend_ops_per_request']['queries'] > 0
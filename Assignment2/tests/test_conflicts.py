@@ -0,0 +1,132 @@
+import pytest
+
+import conflicts
+from conftest import add_task
+from storage import DocumentDeleted, VersionConflict
+
+
+def test_update_with_the_current_version_returns_the_next_one(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    version = store.get_task(board['id'], task_id, with_version=True)['version']
+
+    new_version = store.update_task(board['id'], task_id, {'title': 'Renamed'}, version=version)
+
+    assert new_version != version
+    assert store.get_task(board['id'], task_id, with_version=True)['version'] == new_version
+
+
+def test_update_with_a_stale_version_raises_and_writes_nothing(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    version = store.get_task(board['id'], task_id, with_version=True)['version']
+    store.update_task(board['id'], task_id, {'title': 'Theirs'})
+
+    with pytest.raises(VersionConflict):
+        store.update_task(board['id'], task_id, {'title': 'Mine'}, version=version)
+
+    assert store.get_task(board['id'], task_id)['title'] == 'Theirs'
+
+
+def test_board_update_with_a_stale_version_raises(store, board):
+    version = store.get_board(board['id'], with_version=True)['version']
+    store.update_board(board['id'], {'description': 'Theirs'})
+
+    with pytest.raises(VersionConflict):
+        store.update_board(board['id'], {'title': 'Mine'}, version=version)
+
+
+def test_update_of_a_purged_task_raises_document_deleted(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    version = store.get_task(board['id'], task_id, with_version=True)['version']
+    store.purge_tasks([(board['id'], task_id)])
+
+    with pytest.raises(DocumentDeleted):
+        store.update_task(board['id'], task_id, {'title': 'Mine'}, version=version)
+
+
+def _save(store, board_id, task_id, data, version, form_base):
+    return conflicts.save(
+        lambda version: store.update_task(board_id, task_id, data, version=version),
+        lambda: store.get_task(board_id, task_id, with_version=True),
+        conflicts.TASK_FIELDS, version, form_base)
+
+
+def test_save_merges_over_a_change_to_another_field(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    task = store.get_task(board['id'], task_id, with_version=True)
+    store.update_task(board['id'], task_id, {'status': 'completed'})
+
+    new_version, current = _save(store, board['id'], task_id, {'title': 'Mine'},
+                                 task['version'], conflicts.base(task, conflicts.TASK_FIELDS))
+
+    assert new_version is not None and current is None
+    saved = store.get_task(board['id'], task_id)
+    assert (saved['title'], saved['status']) == ('Mine', 'completed')
+
+
+def test_save_returns_the_current_document_when_an_edited_field_changed(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    task = store.get_task(board['id'], task_id, with_version=True)
+    store.update_task(board['id'], task_id, {'title': 'Theirs'})
+
+    new_version, current = _save(store, board['id'], task_id, {'title': 'Mine'},
+                                 task['version'], conflicts.base(task, conflicts.TASK_FIELDS))
+
+    assert new_version is None
+    assert current['title'] == 'Theirs'
+    assert conflicts.differences(current, {'title': 'Mine'}, ('title',)) == [('title', 'Theirs', 'Mine')]
+    assert store.get_task(board['id'], task_id)['title'] == 'Theirs'
+
+
+def test_save_reports_a_task_purged_while_the_form_was_open(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    task = store.get_task(board['id'], task_id, with_version=True)
+    store.purge_tasks([(board['id'], task_id)])
+
+    assert _save(store, board['id'], task_id, {'title': 'Mine'},
+                 task['version'], conflicts.base(task, conflicts.TASK_FIELDS)) == (None, None)
+
+
+def test_base_treats_empty_and_missing_fields_alike():
+    assert conflicts.base({'title': 'A', 'description': ''}, conflicts.BOARD_FIELDS) == \
+        conflicts.base({'title': 'A', 'description': None}, conflicts.BOARD_FIELDS)
+
+
+FETCH = {'X-Requested-With': 'fetch'}
+
+
+@pytest.fixture
+def edit(client, app):
+    """Posts the edit form for a new task as it was rendered, with its version and base."""
+    client.post('/create-board', data={'title': 'Board'})
+    board_id = app.store.list_member_boards('u1')[0]['id']
+    task_id = add_task(app.store, board_id, 'Task')
+    task = app.store.get_task(board_id, task_id, with_version=True)
+    form = {'version': task['version'], 'base': conflicts.base(task, conflicts.TASK_FIELDS)}
+
+    def post(**fields):
+        return client.post(f'/board/{board_id}/task/{task_id}/edit', data={**form, **fields}, headers=FETCH)
+    post.board_id, post.task_id = board_id, task_id
+    return post
+
+
+def test_editing_a_field_someone_else_changed_answers_409(edit, app):
+    app.store.update_task(edit.board_id, edit.task_id, {'title': 'Theirs'})
+
+    response = edit(title='Mine')
+
+    assert response.status_code == 409 and response.json()['conflict']
+    assert app.store.get_task(edit.board_id, edit.task_id)['title'] == 'Theirs'
+
+
+def test_editing_a_task_purged_while_the_form_was_open_answers_404(edit, app, monkeypatch):
+    update_task = app.store.update_task
+
+    def purged_first(board_id, task_id, *args, **kwargs):
+        app.store.purge_tasks([(board_id, task_id)])
+        return update_task(board_id, task_id, *args, **kwargs)
+    monkeypatch.setattr(app.store, 'update_task', purged_first)
+
+    response = edit(title='Mine')
+
+    assert response.status_code == 404
+    assert response.json()['error'] == conflicts.DELETED_MESSAGE
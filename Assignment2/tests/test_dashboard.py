@@ -0,0 +1,89 @@
+import pytest
+
+import dashboard
+from conftest import add_task
+from storage import SERVER_TIMESTAMP, VersionConflict
+
+
+def _summaries(store, user_id='u1'):
+    summaries, built = dashboard.load_dashboard(store, user_id, 'temp_' + user_id)
+    if built is not None:
+        dashboard.save_built(store, user_id, built)
+    return summaries
+
+
+def test_task_counts_are_kept_on_the_board_only(store, board):
+    dashboard.members_changed(store, board, added=['u1'])
+    dashboard.tasks_changed(store, board, total=3)
+    dashboard.tasks_changed(store, board, completed=1)
+
+    stored = store.get_board(board['id'])
+    assert (stored['task_count'], stored['completed_count']) == (3, 1)
+    assert store.get_dashboard('u1')['boards'] == {board['id']: {'role': 'creator'}}
+
+
+def test_the_dashboard_reads_titles_and_counts_from_the_boards(store, board):
+    assert _summaries(store)[board['id']]['title'] == 'Board'
+    assert store.get_dashboard('u1')['complete']
+
+    store.update_board(board['id'], {'title': 'Renamed'})
+    dashboard.tasks_changed(store, board, total=2, completed=1)
+
+    summary = _summaries(store)[board['id']]
+    assert (summary['title'], summary['task_count'], summary['completed_count']) == ('Renamed', 2, 1)
+    assert (summary['role'], summary['member_count']) == ('creator', 1)
+
+
+def test_a_board_joined_while_the_dashboard_was_built_is_kept(store, board):
+    summaries, built = dashboard.load_dashboard(store, 'u1', 'temp_u1')
+    joined = store.create_board({'title': 'Joined', 'creator_id': 'u2', 'members': ['u2', 'u1'],
+                                 'task_count': 0, 'completed_count': 0})
+    dashboard.members_changed(store, store.get_board(joined), added=['u1'])
+
+    dashboard.save_built(store, 'u1', built)
+
+    assert list(summaries) == [board['id']]
+    assert sorted(_summaries(store)) == sorted([board['id'], joined])
+
+
+def test_saving_a_stale_dashboard_is_refused(store, board):
+    store.save_dashboard('u1', {board['id']: {'role': 'creator'}}, None)
+    with pytest.raises(VersionConflict):
+        store.save_dashboard('u1', {}, None)
+
+    version = store.get_dashboard('u1')['version']
+    store.set_dashboard_entries([('u1', 'other', {'role': 'member'})])
+    with pytest.raises(VersionConflict):
+        store.save_dashboard('u1', {}, version)
+
+
+def test_deleted_boards_drop_off_until_restored(store, board):
+    _summaries(store)
+    store.update_board(board['id'], {'deleted_at': SERVER_TIMESTAMP})
+    assert _summaries(store) == {}
+
+    store.update_board(board['id'], {'deleted_at': None})
+    assert list(_summaries(store)) == [board['id']]
+
+
+def test_counts_are_worked_out_once_for_boards_without_them(store):
+    board_id = store.create_board({'title': 'Old', 'creator_id': 'u1', 'members': ['u1']})
+    add_task(store, board_id, 'Done', status='completed')
+    add_task(store, board_id, 'Open')
+
+    summary = _summaries(store)[board_id]
+
+    assert (summary['task_count'], summary['completed_count']) == (2, 1)
+    stored = store.get_board(board_id)
+    assert (stored['task_count'], stored['completed_count']) == (2, 1)
+
+
+def test_pending_invites_show_on_the_dashboard(client, app):
+    board_id = app.store.create_board({'title': 'Invited', 'creator_id': 'u2',
+                                       'members': ['u2', 'temp_u1_at_example_dot_com']})
+    dashboard.members_changed(app.store, app.store.get_board(board_id), added=['temp_u1_at_example_dot_com'])
+    client.post('/create-board', data={'title': 'Mine'})
+
+    for _ in range(2):
+        response = client.get('/')
+        assert 'Invited' in response.text and 'Mine' in response.text
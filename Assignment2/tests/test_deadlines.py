@@ -0,0 +1,122 @@
+import sqlite3
+import threading
+
+import pytest
+from google.api_core import exceptions as api_exceptions
+
+import deadlines
+
+
+@pytest.fixture
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(deadlines.time, 'sleep', lambda seconds: None)
+
+
+def _failing(*errors, result='read'):
+    calls = []
+
+    def fn():
+        calls.append(1)
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+    return fn, calls
+
+
+@pytest.mark.parametrize('method, path, expected', [
+    ('GET', '/board/b1', 'read'),
+    ('GET', '/board/b1/export', 'export'),
+    ('POST', '/board/b1/edit', 'write'),
+])
+def test_requests_get_the_budget_of_their_class(method, path, expected):
+    assert deadlines.route_class(method, path) == expected
+    assert deadlines.route_class(method, path, write_class='task') == 'task'
+
+
+def test_calls_get_what_is_left_of_the_budget():
+    assert deadlines.timeout() == deadlines.DEFAULT_TIMEOUT
+
+    token = deadlines.start(5)
+    try:
+        assert 0 < deadlines.timeout() <= 5
+        assert deadlines.detached(deadlines.remaining) is None
+    finally:
+        deadlines.reset(token)
+
+
+def test_a_spent_budget_fails_fast():
+    token = deadlines.start(0)
+    try:
+        with pytest.raises(deadlines.DeadlineExceeded):
+            deadlines.timeout()
+    finally:
+        deadlines.reset(token)
+
+
+def test_reads_are_retried_on_transient_errors(no_backoff):
+    fn, calls = _failing(api_exceptions.ServiceUnavailable('down'), sqlite3.OperationalError('database is locked'))
+
+    assert deadlines.call(fn, (), {}, 'get_board', idempotent=True) == 'read'
+    assert len(calls) == 3
+
+
+def test_reads_give_up_after_the_last_attempt(no_backoff):
+    fn, calls = _failing(*[api_exceptions.ServiceUnavailable('down')] * deadlines.RETRY_ATTEMPTS)
+
+    with pytest.raises(api_exceptions.ServiceUnavailable):
+        deadlines.call(fn, (), {}, 'get_board', idempotent=True)
+    assert len(calls) == deadlines.RETRY_ATTEMPTS
+
+
+@pytest.mark.parametrize('error, idempotent', [
+    (api_exceptions.ServiceUnavailable('down'), False),
+    (sqlite3.OperationalError('no such table: boards'), True),
+    (api_exceptions.NotFound('gone'), True),
+])
+def test_writes_and_lasting_errors_are_not_retried(no_backoff, error, idempotent):
+    fn, calls = _failing(error)
+
+    with pytest.raises(type(error)):
+        deadlines.call(fn, (), {}, 'update_board', idempotent=idempotent)
+    assert len(calls) == 1
+
+
+def test_a_retry_is_not_started_past_the_deadline(monkeypatch):
+    monkeypatch.setattr(deadlines.random, 'uniform', lambda low, high: 60)
+    fn, calls = _failing(api_exceptions.ServiceUnavailable('down'))
+    token = deadlines.start(1)
+    try:
+        with pytest.raises(api_exceptions.ServiceUnavailable):
+            deadlines.call(fn, (), {}, 'get_board', idempotent=True)
+    finally:
+        deadlines.reset(token)
+    assert len(calls) == 1
+
+
+def test_a_slow_read_is_hedged_and_the_first_answer_wins():
+    release = threading.Event()
+    answers = iter(['primary', 'hedge'])
+
+    def read():
+        answer = next(answers)
+        if answer == 'primary':
+            release.wait(5)
+        return answer
+
+    try:
+        assert deadlines.hedged(read, after=0.01) == 'hedge'
+    finally:
+        release.set()
+
+
+def test_reads_are_not_hedged_unless_turned_on():
+    assert deadlines.hedged(threading.current_thread, after=0) is threading.current_thread()
+
+
+def test_a_request_whose_budget_is_spent_answers_504(client, monkeypatch):
+    monkeypatch.setitem(deadlines.BUDGETS, 'read', 0)
+
+    response = client.get('/api/board/b1/activity')
+
+    assert response.status_code == 504
+    assert 'retry-after' in response.headers
@@ -0,0 +1,60 @@
+import pytest
+
+
+def test_a_registered_address_is_never_taken_over(store):
+    entry = store.claim_email('ada@example.com', 'u1', {'email': 'ada@example.com'}, pending=False)
+    assert entry == {'uid': 'u1', 'email': 'ada@example.com', 'pending': False}
+
+    for user_id, pending in (('u2', False), ('temp_ada', True)):
+        assert store.claim_email('ada@example.com', user_id, {'email': 'ada@example.com'}, pending)['uid'] == 'u1'
+    assert store.get_user('u2') is None
+
+
+def test_signing_up_takes_over_a_pending_invite(store):
+    store.claim_email('ada@example.com', 'temp_ada', {'email': 'ada@example.com', 'temp_user': True}, pending=True)
+    assert store.claim_email('ada@example.com', 'temp_other', None, pending=True)['uid'] == 'temp_ada'
+
+    entry = store.claim_email('ada@example.com', 'u1', {'email': 'ada@example.com'}, pending=False)
+
+    assert entry['uid'] == 'u1' and not entry['pending']
+    assert store.get_email_entry('ada@example.com') == entry
+
+
+def test_users_from_before_the_index_are_found_once_and_indexed(app):
+    app.store.set_user('old', {'email': 'old@example.com'})
+    app.store.set_user('temp_old', {'email': 'old@example.com', 'temp_user': True})
+
+    assert app.resolve_email('old@example.com')['uid'] == 'old'
+    assert app.store.get_email_entry('old@example.com')['uid'] == 'old'
+    assert app.resolve_email('nobody@example.com') is None
+
+
+def test_first_sign_in_indexes_the_canonical_address(client, app):
+    response = client.post('/ensure-user', json={'uid': 'u2', 'email': ' U2@Example.com'})
+
+    assert response.json() == {'status': 'created'}
+    assert app.store.get_email_entry('u2@example.com')['uid'] == 'u2'
+    assert client.post('/ensure-user', json={'uid': 'u2', 'email': 'u2@example.com'}).json() == {'status': 'exists'}
+
+
+@pytest.mark.parametrize('email', ['U2@example.com', 'u2@EXAMPLE.com '])
+def test_adding_a_member_by_email_finds_them_through_the_index(client, app, email):
+    client.post('/ensure-user', json={'uid': 'u2', 'email': 'u2@example.com'})
+    client.post('/create-board', data={'title': 'Board'})
+    board_id = app.store.list_member_boards('u1')[0]['id']
+
+    client.post(f'/board/{board_id}/add-member', data={'email': email})
+
+    board = app.store.get_board(board_id)
+    assert board['members'] == ['u1', 'u2']
+    assert board['member_emails']['u2'] == 'u2@example.com'
+
+
+def test_inviting_an_unknown_address_adds_a_placeholder(client, app):
+    client.post('/create-board', data={'title': 'Board'})
+    board_id = app.store.list_member_boards('u1')[0]['id']
+
+    client.post(f'/board/{board_id}/add-member', data={'email': 'new@example.com'})
+
+    assert 'temp_new_at_example_dot_com' in app.store.get_board(board_id)['members']
+    assert app.store.get_email_entry('new@example.com')['pending']
@@ -0,0 +1,53 @@
+import pytest
+
+from conftest import add_task
+
+FETCH = {'X-Requested-With': 'fetch'}
+
+
+@pytest.fixture
+def board_id(client, app):
+    client.post('/create-board', data={'title': 'Board'})
+    return app.store.list_member_boards('u1')[0]['id']
+
+
+def test_creating_a_task_from_fetch_answers_json(client, app, board_id):
+    response = client.post(f'/board/{board_id}/create-task', data={'title': 'Write docs'}, headers=FETCH)
+
+    assert response.status_code == 201
+    task_id = response.json()['task_id']
+    assert app.store.get_task(board_id, task_id)['title'] == 'Write docs'
+
+    response = client.post(f'/board/{board_id}/create-task', data={'title': 'write docs'}, headers=FETCH)
+    assert response.status_code == 409
+
+
+def test_forms_without_fetch_still_redirect(client, board_id):
+    response = client.post(f'/board/{board_id}/create-task', data={'title': 'Plain'}, follow_redirects=False)
+
+    assert response.status_code == 303
+    assert response.headers['location'] == f'/board/{board_id}'
+
+
+def test_completing_a_task_returns_its_item_and_counter_deltas(client, app, board_id):
+    task_id = add_task(app.store, board_id, 'Ship it')
+
+    body = client.post(f'/board/{board_id}/task/{task_id}/complete', headers=FETCH).json()
+
+    assert body['task_id'] == task_id
+    assert body['counters'] == {'active': -1, 'completed': 1}
+    assert 'Ship it' in body['html'] and 'Completed:' in body['html']
+    assert app.store.get_board(board_id)['completed_count'] == 1
+
+
+def test_completing_a_completed_task_again_changes_nothing(client, app, board_id):
+    task_id = add_task(app.store, board_id, 'Ship it')
+    client.post(f'/board/{board_id}/task/{task_id}/complete', headers=FETCH)
+    first = app.store.get_task(board_id, task_id)
+
+    body = client.post(f'/board/{board_id}/task/{task_id}/complete', headers=FETCH).json()
+
+    assert body['counters'] == {}
+    again = app.store.get_task(board_id, task_id)
+    assert (again['completed_at'], again['completed_by']) == (first['completed_at'], first['completed_by'])
+    assert app.store.get_board(board_id)['completed_count'] == 1
@@ -0,0 +1,56 @@
+import pytest
+
+import instrumentation
+from instrumentation import InstrumentedStorage, RequestOps
+
+
+@pytest.mark.parametrize('name, kind', [
+    ('get_board', 'read'), ('list_tasks', 'query'), ('find_search_postings', 'query'),
+    ('iter_due_recurring', 'query'), ('update_task', 'write'), ('create_board', 'write'),
+])
+def test_classify(name, kind):
+    assert instrumentation.classify(name) == kind
+
+
+def test_calls_are_counted_on_the_current_request(store):
+    wrapped = InstrumentedStorage(store)
+    board_id = wrapped.create_board({'title': 'Board', 'members': ['u1']})
+    ops = instrumentation.start_request()
+
+    wrapped.get_board(board_id)
+    wrapped.list_member_boards('u1')
+    wrapped.update_board(board_id, {'title': 'Renamed'})
+
+    assert (ops.reads, ops.queries, ops.writes, ops.documents) == (1, 1, 1, 1)
+    assert ops.headers() == {'X-Backend-Reads': '1', 'X-Backend-Writes': '1',
+                             'X-Backend-Queries': '1', 'X-Backend-Documents': '1'}
+
+
+def test_repeated_point_reads_are_reported_as_n_plus_one():
+    ops = RequestOps()
+    for _ in range(6):
+        ops.record('read', 'get_task')
+    assert ops.problems(budget=50, repeat_limit=5) == ["get_task called 6 times (possible N+1)"]
+    assert ops.problems(budget=5, repeat_limit=10) == ["6 backend ops exceeds budget of 5"]
+
+
+def test_strict_mode_raises_instead_of_logging(monkeypatch):
+    class Response:
+        headers = {}
+
+    ops = RequestOps()
+    for _ in range(instrumentation.REPEAT_LIMIT + 1):
+        ops.record('read', 'get_task')
+
+    instrumentation.finish_request(ops, '/board/{board_id}', Response())
+    monkeypatch.setattr(instrumentation, 'STRICT', True)
+    with pytest.raises(instrumentation.OpBudgetExceeded):
+        instrumentation.finish_request(ops, '/board/{board_id}', Response())
+
+
+def test_responses_carry_the_op_counts(client):
+    response = client.post('/create-board', data={'title': 'Board'}, follow_redirects=False)
+    assert int(response.headers['X-Backend-Writes']) >= 1
+
+    response = client.get('/')
+    assert int(response.headers['X-Backend-Reads']) + int(response.headers['X-Backend-Queries']) >= 1
@@ -0,0 +1,63 @@
+import json
+import logging
+import queue
+import sys
+
+import logging_config
+
+
+def _record(message='Saved', **extra):
+    record = logging.LogRecord('tasks', logging.INFO, __file__, 1, message, (), None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_records_are_formatted_as_json_with_their_extras():
+    entry = json.loads(logging_config.JSONFormatter().format(_record(board_id='b1', sample_rate=0.5)))
+
+    assert entry['message'] == 'Saved'
+    assert entry['level'] == 'INFO'
+    assert entry['board_id'] == 'b1'
+    assert 'sample_rate' not in entry
+    assert entry['time'].endswith('+00:00')
+
+
+def test_exceptions_are_included():
+    try:
+        raise RuntimeError('boom')
+    except RuntimeError:
+        record = logging.LogRecord('tasks', logging.ERROR, __file__, 1, 'Failed', (), sys.exc_info())
+
+    assert 'RuntimeError: boom' in json.loads(logging_config.JSONFormatter().format(record))['exception']
+
+
+def test_sampling_keeps_records_without_a_rate():
+    sampling = logging_config.SamplingFilter()
+    assert sampling.filter(_record())
+    assert sampling.filter(_record(sample_rate=1.0))
+    assert not sampling.filter(_record(sample_rate=0.0))
+
+
+def test_a_full_queue_drops_records_instead_of_blocking():
+    handler = logging_config.NonBlockingQueueHandler(queue.Queue(1))
+    handler.emit(_record('first'))
+    handler.emit(_record('second'))
+
+    assert handler.dropped == 1
+    assert handler.queue.get_nowait().getMessage() == 'first'
+
+
+def test_the_request_id_is_taken_on_the_calling_side():
+    handler = logging_config.NonBlockingQueueHandler(queue.Queue())
+    token = logging_config.request_id_var.set('abc123')
+    try:
+        handler.emit(_record())
+    finally:
+        logging_config.request_id_var.reset(token)
+
+    assert handler.queue.get_nowait().request_id == 'abc123'
+
+
+def test_responses_carry_a_request_id(client):
+    assert client.get('/', headers={'X-Request-ID': 'given'}).headers['X-Request-ID'] == 'given'
+    assert len(client.get('/').headers['X-Request-ID']) == 32
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+
+import pytest
+
+import loopmonitor
+
+
+@pytest.fixture
+def debug(monkeypatch):
+    monkeypatch.setattr(loopmonitor, 'DEBUG', True)
+
+
+async def _on_the_loop(fn, *args):
+    return fn(*args)
+
+
+def test_blocking_calls_raise_on_the_loop_only(debug):
+    with pytest.raises(loopmonitor.BlockingCallError):
+        asyncio.run(_on_the_loop(loopmonitor.check_blocking, 'store.get_board'))
+
+    loopmonitor.check_blocking('store.get_board')
+
+
+def test_blocking_calls_are_allowed_without_debug_mode():
+    asyncio.run(_on_the_loop(loopmonitor.check_blocking, 'store.get_board'))
+
+
+@pytest.mark.parametrize('event, args, raises', [
+    ('sqlite3.connect', ('tasks.db',), True),
+    ('time.sleep', (0.1,), True),
+    ('time.sleep', (0,), False),
+    ('open', ('tasks.db', 'r', 0), False),
+])
+def test_audit_events_that_block_are_caught(debug, event, args, raises):
+    if raises:
+        with pytest.raises(loopmonitor.BlockingCallError):
+            asyncio.run(_on_the_loop(loopmonitor._audit, event, args))
+    else:
+        asyncio.run(_on_the_loop(loopmonitor._audit, event, args))
+
+
+def test_backend_calls_from_the_loop_raise(debug, app):
+    with pytest.raises(loopmonitor.BlockingCallError):
+        asyncio.run(_on_the_loop(app.store.get_board, 'b1'))
+
+
+def test_handlers_keep_backend_calls_off_the_loop(debug, client, app):
+    assert client.post('/ensure-user', json={'uid': 'u2', 'email': 'u2@example.com'}).json() == {'status': 'created'}
+
+    client.post('/create-board', data={'title': 'Board'})
+    assert app.store.list_member_boards('u1')[0]['title'] == 'Board'
+
+
+def test_a_stalled_loop_is_reported_with_its_stack(caplog):
+    async def stall():
+        monitor = loopmonitor.LoopMonitor(interval=0.01, threshold=0.05)
+        monitor.start()
+        await asyncio.sleep(0.03)
+        # blocks the loop the way a synchronous backend call in an async handler would
+        time.sleep(0.3)
+        await asyncio.sleep(0.03)
+        await monitor.stop()
+
+    with caplog.at_level(logging.WARNING, logger='loopmonitor'):
+        asyncio.run(stall())
+
+    stalls = [record for record in caplog.records if record.getMessage().startswith('Event loop blocked')]
+    assert len(stalls) == 1
+    assert 'time.sleep' in stalls[0].stack and stalls[0].coroutine.endswith('stall')
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    """Metrics created in a test are exposed on their own, not with the app's."""
+    monkeypatch.setattr(metrics, '_registry', [])
+
+
+def test_counter_and_gauge_exposition(registry):
+    counter = metrics.Counter('jobs', 'Jobs run', ('queue',))
+    gauge = metrics.Gauge('depth', 'Queue depth')
+    counter.labels('mail "urgent"').inc(2)
+    gauge.inc(3)
+    gauge.dec()
+
+    assert metrics.generate_latest() == (
+        '# HELP jobs_total Jobs run\n'
+        '# TYPE jobs_total counter\n'
+        'jobs_total{queue="mail \\"urgent\\""} 2.0\n'
+        '# HELP depth Queue depth\n'
+        '# TYPE depth gauge\n'
+        'depth 2.0\n')
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    histogram = metrics.Histogram('latency', 'Latency', buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        histogram.observe(value)
+
+    lines = metrics.generate_latest().splitlines()[2:]
+    assert lines == [
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1.0"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        'latency_sum 2.65',
+        'latency_count 4',
+    ]
+
+
+def test_samples_from_many_threads_are_not_lost(registry):
+    counter = metrics.Counter('hits', 'Hits', ('route',))
+    histogram = metrics.Histogram('seconds', 'Seconds')
+
+    def record():
+        for _ in range(2000):
+            counter.labels('/').inc()
+            histogram.observe(0.01)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert counter.labels('/').value == 16000
+    assert histogram._unlabelled.snapshot()[2] == 16000
+
+
+def test_metrics_endpoint_is_refused_to_other_networks(client):
+    assert client.get('/metrics').status_code == 403
+
+
+def test_metrics_endpoint_answers_loopback_and_the_bearer_token(app, monkeypatch):
+    local = TestClient(app.app, client=('127.0.0.1', 50000))
+    response = local.get('/metrics')
+    assert response.status_code == 200
+    assert 'http_request_duration_seconds' in response.text
+
+    monkeypatch.setattr(app, 'METRICS_TOKEN', 'secret')
+    remote = TestClient(app.app, client=('203.0.113.9', 50000))
+    assert remote.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 403
+    assert remote.get('/metrics', headers={'Authorization': 'Bearer secret'}).status_code == 200
+
+
+def test_requests_are_recorded_by_route_template(app):
+    local = TestClient(app.app, client=('127.0.0.1', 50000))
+    local.get('/board/some-board')
+
+    assert 'route="/board/{board_id}"' in local.get('/metrics').text
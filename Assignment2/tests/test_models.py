@@ -0,0 +1,58 @@
+import datetime
+
+import pytest
+
+from models import Board, Task, canonical_email, temp_member_id, to_datetime
+from storage import SERVER_TIMESTAMP
+
+UTC = datetime.timezone.utc
+
+
+class Timestamp:
+    """What older Firestore clients hand back instead of a datetime."""
+    seconds = 1790000000
+
+
+@pytest.mark.parametrize('value, expected', [
+    (None, None),
+    (datetime.datetime(2026, 10, 19, 8, 30, tzinfo=UTC), datetime.datetime(2026, 10, 19, 8, 30, tzinfo=UTC)),
+    (Timestamp(), datetime.datetime.fromtimestamp(1790000000, UTC)),
+    ('2026-10-19T08:30:00+00:00', datetime.datetime(2026, 10, 19, 8, 30, tzinfo=UTC)),
+    (SERVER_TIMESTAMP, None),
+])
+def test_timestamps_are_read_as_datetimes(value, expected):
+    assert to_datetime(value) == expected
+
+
+def test_protobuf_timestamps_are_utc():
+    assert to_datetime(Timestamp()).utcoffset() == datetime.timedelta(0)
+
+
+def test_invited_emails_get_one_placeholder_whatever_their_case():
+    assert canonical_email('  Ada@Example.COM ') == 'ada@example.com'
+    assert temp_member_id('Ada@Example.com') == 'temp_ada_at_example_dot_com'
+
+
+def test_tasks_keep_only_what_the_pages_show():
+    task = Task.from_doc({'id': 't1', 'title': None, 'status': 'completed', 'assigned_users': None,
+                          'completed_at': datetime.datetime(2026, 10, 19, 8, 30, tzinfo=UTC),
+                          'member_emails': {'u1': 'u1@example.com'}})
+
+    assert (task.title, task.assigned_users, task.completed) == ('', [], True)
+    assert task.completed_at_formatted == '2026-10-19 08:30'
+    assert not hasattr(task, '__dict__')
+
+
+def test_a_pending_completion_time_is_not_shown():
+    task = Task.from_doc({'id': 't1', 'status': 'completed', 'completed_at': SERVER_TIMESTAMP})
+
+    assert not task.completed
+    assert task.completed_at_formatted == ''
+
+
+def test_boards_from_documents_and_dashboard_summaries():
+    board = Board.from_doc({'id': 'b1', 'title': 'Board', 'members': ['u1', 'u2'], 'task_count': 3})
+    assert (board.member_count, board.task_count, board.completed_count) == (2, 3, 0)
+
+    summary = Board.from_summary('b1', {'title': 'Board', 'role': 'creator', 'member_count': 2})
+    assert (summary.id, summary.is_creator, summary.member_count) == ('b1', True, 2)
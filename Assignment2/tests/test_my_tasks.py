@@ -0,0 +1,68 @@
+from conftest import add_task
+
+
+def _board(store, title, members):
+    return store.create_board({'title': title, 'creator_id': members[0], 'members': members, 'ranked': True})
+
+
+def test_assigned_tasks_come_only_from_the_boards_asked_for(store):
+    mine = _board(store, 'Mine', ['u1'])
+    left = _board(store, 'Left', ['u2'])
+    for day in range(1, 4):
+        add_task(store, left, f"Left {day}", assigned_users=['u1'], due_date=f"2026-11-0{day}")
+    add_task(store, mine, 'Mine', assigned_users=['u1'], due_date='2026-11-09')
+
+    tasks, cursor = store.list_assigned_tasks(['u1'], [mine], 2)
+
+    assert [task['title'] for task in tasks] == ['Mine']
+    assert cursor is None
+
+
+def test_assigned_tasks_page_in_due_date_order_across_boards(store):
+    first = _board(store, 'First', ['u1'])
+    second = _board(store, 'Second', ['u1'])
+    add_task(store, first, 'No date', assigned_users=['u1'])
+    for day in range(1, 6):
+        add_task(store, first if day % 2 else second, f"Day {day}", assigned_users=['temp'], due_date=f"2026-11-0{day}")
+
+    seen, cursor = [], None
+    while True:
+        tasks, cursor = store.list_assigned_tasks(['u1', 'temp'], [first, second], 2, cursor)
+        assert len(tasks) == 2 or cursor is None
+        seen.extend(task['title'] for task in tasks)
+        if cursor is None:
+            break
+
+    assert seen == ['No date'] + [f"Day {day}" for day in range(1, 6)]
+
+
+def test_member_boards_can_be_read_with_only_some_fields(store):
+    board_id = _board(store, 'Board', ['u1'])
+
+    assert store.list_member_boards('u1', ['title']) == [{'id': board_id, 'title': 'Board'}]
+    assert store.list_member_boards('u1', []) == [{'id': board_id}]
+
+
+def test_my_tasks_pages_are_full_when_the_user_left_a_busy_board(client, app):
+    store = app.store
+    left = _board(store, 'Left', ['u2'])
+    for day in range(1, 10):
+        add_task(store, left, f"Left {day}", assigned_users=['u1'], due_date=f"2026-10-0{day}")
+    mine = _board(store, 'Mine', ['u1'])
+    for day in range(10, 13):
+        add_task(store, mine, f"Mine {day}", assigned_users=['u1'], due_date=f"2026-10-{day}")
+
+    page = client.get('/api/my-tasks', params={'limit': 2}).json()
+    assert [task['title'] for task in page['tasks']] == ['Mine 10', 'Mine 11']
+    page = client.get('/api/my-tasks', params={'limit': 2, 'cursor': page['next_cursor']}).json()
+    assert [task['title'] for task in page['tasks']] == ['Mine 12']
+
+    response = client.get('/my-tasks')
+    assert 'Mine 12' in response.text and 'Left 1' not in response.text
+
+
+def test_my_tasks_include_boards_from_a_pending_invite(client, app):
+    board_id = _board(app.store, 'Invited', ['u2', 'temp_u1_at_example_dot_com'])
+    add_task(app.store, board_id, 'For the invitee', assigned_users=['temp_u1_at_example_dot_com'])
+
+    assert [task['title'] for task in client.get('/api/my-tasks').json()['tasks']] == ['For the invitee']
@@ -0,0 +1,71 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import profiling
+
+
+@pytest.fixture
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILE_DIR', str(tmp_path))
+    monkeypatch.setattr(profiling, 'DEBUG_TOKEN', 'debug')
+    return tmp_path
+
+
+def _wait_for_writer():
+    profiling._writer.submit(lambda: None).result()
+
+
+def busy_handler():
+    end = time.perf_counter() + 0.05
+    while time.perf_counter() < end:
+        pass
+    return {'ok': True}
+
+
+def test_requests_with_the_debug_header_are_profiled_in_the_worker_thread(profile_dir):
+    app = FastAPI()
+    app.middleware('http')(profiling.profile_request)
+    app.router.route_class = profiling.ProfiledRoute
+    app.get('/board/{board_id}')(busy_handler)
+    client = TestClient(app)
+
+    assert client.get('/board/1').status_code == 200
+    assert client.get('/board/1', headers={'X-Debug-Profile': 'debug'}).status_code == 200
+    _wait_for_writer()
+
+    files = os.listdir(profile_dir / 'board_board_id_')
+    assert len(files) == 1
+    folded = (profile_dir / 'board_board_id_' / files[0]).read_text()
+    assert 'busy_handler (test_profiling.py' in folded
+
+
+def test_sampling_rate_picks_requests(monkeypatch):
+    class Request:
+        headers = {}
+
+    monkeypatch.setattr(profiling, 'DEBUG_TOKEN', '')
+    monkeypatch.setattr(profiling, 'SAMPLE_RATE', 0)
+    assert not profiling.should_profile(Request())
+    monkeypatch.setattr(profiling, 'SAMPLE_RATE', 1.0)
+    assert profiling.should_profile(Request())
+
+
+def test_oldest_profiles_are_removed_past_the_disk_limit(profile_dir, monkeypatch):
+    monkeypatch.setattr(profiling, 'MAX_BYTES', 250)
+    for index in range(3):
+        path = profile_dir / f"{index}.folded"
+        path.write_text('x' * 100)
+        os.utime(path, (index, index))
+
+    profiling._enforce_disk_limit()
+
+    assert sorted(os.listdir(profile_dir)) == ['1.folded', '2.folded']
+
+
+def test_empty_samples_write_nothing(profile_dir):
+    assert profiling.save_profile('/', profiling.Sampler(0)) is None
+    assert os.listdir(profile_dir) == []
@@ -0,0 +1,120 @@
+import datetime
+import itertools
+
+import pytest
+
+import purge
+from conftest import add_task
+
+NOW = datetime.datetime(2026, 10, 19, 3, 0, tzinfo=datetime.timezone.utc)
+
+
+class _Timestamp:
+    """What older Firestore clients return for timestamps."""
+
+    def __init__(self, when):
+        self.seconds = int(when.timestamp())
+        self.nanos = 0
+
+
+@pytest.mark.parametrize('deleted_at, undo', [
+    (NOW - purge.UNDO_WINDOW + datetime.timedelta(seconds=1), True),
+    (NOW - purge.UNDO_WINDOW, False),
+    (NOW - purge.UNDO_WINDOW - datetime.timedelta(seconds=1), False),
+    (None, False),
+])
+def test_can_undo_inside_the_window_only(deleted_at, undo):
+    assert purge.can_undo({'deleted_at': deleted_at}, NOW) is undo
+
+
+def test_can_undo_reads_protobuf_and_string_timestamps():
+    recently = NOW - datetime.timedelta(seconds=30)
+    assert purge.can_undo({'deleted_at': _Timestamp(recently)}, NOW)
+    assert purge.can_undo({'deleted_at': recently.isoformat()}, NOW)
+    assert not purge.can_undo({'deleted_at': _Timestamp(NOW - 2 * purge.UNDO_WINDOW)}, NOW)
+
+
+@pytest.mark.parametrize('hour, inside', [(1, False), (2, True), (5, True), (6, False)])
+def test_off_peak_hours(hour, inside):
+    assert purge.in_off_peak(NOW.replace(hour=hour), '2-6') is inside
+
+
+@pytest.mark.parametrize('hour, inside', [(21, False), (22, True), (0, True), (3, True), (4, False)])
+def test_off_peak_hours_across_midnight(hour, inside):
+    assert purge.in_off_peak(NOW.replace(hour=hour), '22-4') is inside
+
+
+def test_purge_removes_only_tasks_past_the_undo_window(store, board):
+    expired_id = add_task(store, board['id'], 'Expired', deleted_at=NOW - purge.UNDO_WINDOW - datetime.timedelta(seconds=1))
+    recent_id = add_task(store, board['id'], 'Recent', deleted_at=NOW - datetime.timedelta(seconds=1))
+    live_id = add_task(store, board['id'], 'Live')
+
+    purged = purge.purge_deleted(store, batch_size=1, now=NOW)
+
+    assert purged['tasks'] == 1
+    assert store.get_task(board['id'], expired_id, include_deleted=True) is None
+    assert store.get_task(board['id'], recent_id, include_deleted=True) is not None
+    assert store.get_task(board['id'], live_id) is not None
+
+
+def test_purge_removes_boards_past_the_undo_window_with_their_tasks(store, board):
+    task_id = add_task(store, board['id'], 'Task')
+    store.update_board(board['id'], {'deleted_at': NOW - purge.UNDO_WINDOW - datetime.timedelta(minutes=1)})
+    recent_id = store.create_board({'title': 'Recent', 'creator_id': 'u1', 'members': ['u1'],
+                                    'deleted_at': NOW - datetime.timedelta(minutes=1)})
+
+    assert purge.purge_deleted(store, now=NOW)['boards'] == 1
+
+    assert store.get_board(board['id'], include_deleted=True) is None
+    assert store.get_task(board['id'], task_id, include_deleted=True) is None
+    assert store.get_board(recent_id, include_deleted=True) is not None
+
+
+def test_purge_paces_its_deletes(store, board):
+    for index in range(4):
+        add_task(store, board['id'], f"Task {index}", deleted_at=NOW - 2 * purge.UNDO_WINDOW)
+    pauses = []
+
+    purge.purge_deleted(store, batch_size=2, rate=10, now=NOW, sleep=pauses.append)
+
+    assert pauses[:2] == [0.2, 0.2]
+
+
+def test_purge_empties_a_board_in_paced_batches(store, board):
+    for index in range(5):
+        add_task(store, board['id'], f"Task {index}")
+    store.update_board(board['id'], {'deleted_at': NOW - 2 * purge.UNDO_WINDOW})
+    pauses = []
+
+    assert purge.purge_deleted(store, batch_size=2, rate=10, now=NOW, sleep=pauses.append)['boards'] == 1
+
+    assert pauses == [0.2, 0.2, 0.1, 0.1]
+    assert store.get_board(board['id'], include_deleted=True) is None
+    assert store.list_tasks(board['id']) == []
+
+
+def test_purge_stops_between_batches_when_the_off_peak_hours_end(store, board):
+    for index in range(4):
+        add_task(store, board['id'], f"Task {index}", deleted_at=NOW - 2 * purge.UNDO_WINDOW)
+    # the second batch would start as the window closes
+    clock = itertools.chain([NOW], itertools.repeat(NOW.replace(hour=6)))
+
+    purged = purge.purge_deleted(store, batch_size=2, now=NOW, hours='2-6', clock=lambda: next(clock))
+
+    assert purged == {'tasks': 2, 'boards': 0, 'events': 0}
+    assert len(store.list_deleted_tasks(NOW, 10)) == 2
+
+
+def test_purge_leaves_a_half_emptied_board_for_the_next_run(store, board):
+    for index in range(3):
+        add_task(store, board['id'], f"Task {index}")
+    store.update_board(board['id'], {'deleted_at': NOW - 2 * purge.UNDO_WINDOW})
+    # the window closes after the deleted tasks are looked for and the board's first batch is removed
+    clock = itertools.chain([NOW] * 3, itertools.repeat(NOW.replace(hour=6)))
+
+    purged = purge.purge_deleted(store, batch_size=2, now=NOW, hours='2-6', clock=lambda: next(clock))
+
+    assert purged['boards'] == 0
+    assert store.get_board(board['id'], include_deleted=True) is not None
+    assert len(store.list_tasks(board['id'])) == 1
+    assert purge.purge_deleted(store, batch_size=2, now=NOW)['boards'] == 1
@@ -0,0 +1,162 @@
+import pytest
+
+import ranking
+from conftest import add_task
+
+
+def test_key_after_appends_fixed_width_keys_in_order():
+    keys = ranking.keys_after(None, 50)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == 50
+    assert all(len(key) <= ranking.WIDTH for key in keys)
+
+
+def test_key_after_grows_a_digit_past_the_last_key_of_its_width():
+    last = ranking.DIGITS[-1] * ranking.WIDTH
+    key = ranking.key_after(last)
+    assert key > last
+    assert len(key) > ranking.WIDTH
+
+
+@pytest.mark.parametrize('before, after', [
+    (None, '1'),
+    ('1', '2'),
+    ('1', '11'),
+    ('1z', '2'),
+    ('zz', None),
+    ('A', 'A1'),
+])
+def test_key_between_sorts_between_its_neighbours(before, after):
+    key = ranking.key_between(before, after)
+    assert (before or '') < key
+    assert after is None or key < after
+    assert not key.endswith('0')
+
+
+def test_key_between_keeps_finding_room_in_the_same_gap():
+    before, after = '1', '2'
+    for _ in range(200):
+        key = ranking.key_between(before, after)
+        assert before < key < after
+        after = key
+
+
+def test_key_between_rejects_neighbours_out_of_order():
+    with pytest.raises(ValueError):
+        ranking.key_between('2', '1')
+    with pytest.raises(ValueError):
+        ranking.key_between('2', '2')
+
+
+def test_spaced_keys_are_even_when_appending_would_not_fit():
+    count = ranking.BASE ** ranking.WIDTH // 2 // ranking.APPEND_STEP
+    keys = ranking.spaced_keys(count)
+    assert keys == sorted(keys)
+    assert len(set(keys)) == count
+    assert all(len(key) <= ranking.WIDTH for key in keys)
+
+
+def test_in_board_order_puts_unranked_tasks_last():
+    tasks = [{'id': 'c'}, {'id': 'b', 'rank': '2'}, {'id': 'a'}, {'id': 'd', 'rank': '1'}]
+    assert [task['id'] for task in ranking.in_board_order(tasks)] == ['d', 'b', 'a', 'c']
+
+
+def test_rebalance_keeps_the_order_and_shortens_the_keys(store, board):
+    ranks = ['1', '1V', '1VV', '1VVV', '1VVVVVVVVVVVVV']
+    task_ids = [add_task(store, board['id'], f"Task {index}", rank=rank) for index, rank in enumerate(ranks)]
+    unranked_id = add_task(store, board['id'], 'Unranked')
+
+    assert ranking.rebalance_board(store, board['id']) == len(ranks) + 1
+
+    tasks = store.list_tasks(board['id'], ['rank'], by_rank=True)
+    assert [task['id'] for task in tasks] == task_ids + [unranked_id]
+    assert not any(ranking.needs_rebalance(task['rank']) for task in tasks)
+
+
+def test_rebalance_leaves_soft_deleted_tasks_alone(store, board):
+    live_id = add_task(store, board['id'], 'Live', rank='2')
+    deleted_id = add_task(store, board['id'], 'Deleted', rank='1', deleted_at='2026-01-01')
+
+    assert ranking.rebalance_board(store, board['id']) == 1
+
+    assert store.get_task(board['id'], live_id)['rank'] != '2'
+    assert store.get_task(board['id'], deleted_id, include_deleted=True)['rank'] == '1'
+
+
+def test_ensure_ranked_ranks_a_board_once(store, board):
+    store.update_board(board['id'], {'ranked': False})
+    add_task(store, board['id'], 'First')
+    board = store.get_board(board['id'])
+
+    ranking.ensure_ranked(store, board)
+
+    assert store.get_board(board['id'])['ranked']
+    assert all(task.get('rank') for task in store.list_tasks(board['id'], ['rank']))
+
+
+def test_unranked_tasks_are_listed_after_the_ranked_ones(store, board):
+    unranked_ids = sorted(add_task(store, board['id'], f"Unranked {index}", rank=None) for index in range(2))
+    ranked_ids = [add_task(store, board['id'], f"Task {index}", rank=rank) for index, rank in enumerate(['1', '2', '3'])]
+    expected = ranked_ids + unranked_ids
+
+    assert [task['id'] for task in store.list_tasks(board['id'], ['rank'], by_rank=True)] == expected
+
+    paged, cursor = [], None
+    while True:
+        tasks, cursor = store.list_tasks_page(board['id'], 2, cursor, by_rank=True)
+        paged += [task['id'] for task in tasks]
+        if cursor is None:
+            break
+    assert paged == expected
+
+
+def test_the_scheduled_job_ranks_old_boards_and_stray_unranked_tasks(store, board):
+    old_id = store.create_board({'title': 'Old', 'creator_id': 'u1', 'members': ['u1']})
+    add_task(store, old_id, 'Old task')
+    add_task(store, board['id'], 'Ranked', rank='1')
+    add_task(store, board['id'], 'Added while ranking', rank=None)
+
+    assert ranking.rebalance_boards(store) == 2
+
+    assert store.get_board(old_id)['ranked']
+    for board_id in (old_id, board['id']):
+        assert all(task['rank'] for task in store.list_tasks(board_id, ['rank']))
+
+
+@pytest.fixture
+def old_board_id(app):
+    board_id = app.store.create_board({'title': 'Old', 'creator_id': 'u1', 'members': ['u1']})
+    add_task(app.store, board_id, 'First')
+    return board_id
+
+
+def test_adding_to_an_old_board_ranks_nothing(client, app, old_board_id):
+    client.post(f'/board/{old_board_id}/create-task', data={'title': 'Second'})
+
+    assert not app.store.get_board(old_board_id).get('ranked')
+    assert [task.get('rank') for task in app.store.list_tasks(old_board_id, ['rank'])] == [None, None]
+
+
+def test_moving_on_an_old_board_ranks_it_behind_the_answer(client, app, old_board_id):
+    task_id = add_task(app.store, old_board_id, 'Second')
+    path = f'/api/board/{old_board_id}/task/{task_id}/move'
+
+    response = client.post(path, data={'before_id': '', 'after_id': ''})
+
+    # the test client runs the background task before returning
+    assert response.status_code == 409
+    assert app.store.get_board(old_board_id)['ranked']
+    assert client.post(path, data={'before_id': '', 'after_id': ''}).status_code == 200
+
+
+def test_moving_a_task_writes_only_that_task(client, app):
+    board_id = app.store.create_board({'title': 'Board', 'creator_id': 'u1', 'members': ['u1'], 'ranked': True})
+    first_id, second_id = (add_task(app.store, board_id, title, rank=rank) for title, rank in (('A', '1'), ('B', '2')))
+
+    response = client.post(f'/api/board/{board_id}/task/{second_id}/move', data={'after_id': first_id})
+
+    rank = response.json()['rank']
+    assert rank < '1'
+    assert app.store.get_task(board_id, first_id)['rank'] == '1'
+    tasks = app.store.list_tasks(board_id, ['rank'], by_rank=True)
+    assert [task['id'] for task in tasks] == [second_id, first_id]
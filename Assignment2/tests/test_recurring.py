@@ -0,0 +1,115 @@
+import datetime
+
+import pytest
+
+import recurring
+
+MONDAY = datetime.date(2026, 10, 19)
+
+
+def _days(rule, start, end):
+    return recurring.occurrences(recurring.parse_rule(rule), start, end)
+
+
+def test_weekly_alias_falls_on_mondays():
+    days = _days('@weekly', MONDAY, MONDAY + datetime.timedelta(days=20))
+    assert days == [MONDAY, MONDAY + datetime.timedelta(days=7), MONDAY + datetime.timedelta(days=14)]
+
+
+def test_lists_ranges_and_steps():
+    assert {day.weekday() for day in _days('* * 1,3', MONDAY, MONDAY + datetime.timedelta(days=13))} == {0, 2}
+    assert {day.weekday() for day in _days('* * 1-5', MONDAY, MONDAY + datetime.timedelta(days=13))} == set(range(5))
+    assert [day.day for day in _days('*/10 * *', datetime.date(2026, 11, 1), datetime.date(2026, 11, 30))] == [1, 11, 21]
+
+
+def test_day_of_week_seven_is_sunday():
+    assert recurring.parse_rule('* * 7')[2] == {0}
+    assert [day.weekday() for day in _days('* * 7', MONDAY, MONDAY + datetime.timedelta(days=6))] == [6]
+
+
+def test_day_of_month_and_day_of_week_are_either_or():
+    days = _days('13 * 5', datetime.date(2026, 11, 1), datetime.date(2026, 11, 30))
+    # the 13th is a Friday this month, so the Fridays are the only days
+    assert [day.day for day in days] == [6, 13, 20, 27]
+    days = _days('1 * 1', datetime.date(2026, 12, 1), datetime.date(2026, 12, 14))
+    assert [day.day for day in days] == [1, 7, 14]
+
+
+def test_rule_for_29_february_finds_the_next_leap_year():
+    parsed = recurring.parse_rule('29 2 *')
+    assert recurring.next_on_or_after(parsed, datetime.date(2026, 3, 1)) == datetime.date(2028, 2, 29)
+
+
+@pytest.mark.parametrize('rule', ['', '* *', '* * * *', '32 * *', '* 13 *', '* * 8', 'x * *', '5-1 * *', '*/0 * *', '31 2 *'])
+def test_invalid_rules_are_rejected(rule):
+    with pytest.raises(ValueError):
+        recurring.parse_rule(rule)
+
+
+def _add_rule(store, board, rule, today=MONDAY):
+    data = recurring.new_rule('Standup', '', rule, ['u1', 'gone'], 'u1', today=today)
+    return store.create_recurring(board['id'], data)
+
+
+def test_materialize_creates_each_day_up_to_the_window(store, board):
+    rule_id = _add_rule(store, board, '@weekdays')
+
+    counts = recurring.materialize_added(store, board['id'], rule_id, today=MONDAY,
+                                         window=datetime.timedelta(days=6))
+
+    assert counts == {'tasks': 5, 'recurring': 1, 'conflicts': 0}
+    tasks = store.list_tasks(board['id'], by_rank=True)
+    assert [task['due_date'] for task in tasks] == [(MONDAY + datetime.timedelta(days=offset)).isoformat()
+                                                   for offset in range(5)]
+    assert all(task['assigned_users'] == ['u1'] for task in tasks)
+    assert store.get_recurring(board['id'], rule_id)['next_due'] == (MONDAY + datetime.timedelta(days=7)).isoformat()
+    assert store.get_board(board['id'])['task_count'] == 5
+
+
+def test_materialize_again_writes_nothing_new(store, board):
+    _add_rule(store, board, '@daily')
+    window = datetime.timedelta(days=3)
+    recurring.materialize_due(store, today=MONDAY, window=window)
+
+    assert recurring.materialize_due(store, today=MONDAY, window=window)['tasks'] == 0
+    assert len(store.list_tasks(board['id'])) == 4
+
+
+def test_rerun_with_a_stale_rule_adds_no_copies(store, board):
+    rule_id = _add_rule(store, board, '@daily')
+    window = datetime.timedelta(days=2)
+    rule = {**store.get_recurring(board['id'], rule_id), 'board_id': board['id']}
+    recurring.materialize_board(store, board['id'], [rule], today=MONDAY, window=window)
+
+    # the same rule as read before the first run finished
+    counts = recurring.materialize_board(store, board['id'], [rule], today=MONDAY, window=window)
+
+    assert counts['conflicts'] == 1
+    assert len(store.list_tasks(board['id'])) == 3
+
+
+def test_days_missed_while_not_running_are_skipped(store, board):
+    _add_rule(store, board, '@daily')
+
+    later = MONDAY + datetime.timedelta(days=10)
+    recurring.materialize_due(store, today=later, window=datetime.timedelta(days=1))
+
+    assert sorted(task['due_date'] for task in store.list_tasks(board['id'])) == [
+        later.isoformat(), (later + datetime.timedelta(days=1)).isoformat()]
+
+
+def test_a_rerun_leaves_occurrences_members_have_changed(store, board):
+    rule_id = _add_rule(store, board, '@daily')
+    recurring.materialize_added(store, board['id'], rule_id, today=MONDAY, window=datetime.timedelta(days=1))
+    first, second = sorted(store.list_tasks(board['id']), key=lambda task: task['due_date'])
+    store.update_task(board['id'], first['id'], {'status': 'completed', 'title': 'Standup (done)'})
+    store.update_task(board['id'], second['id'], {'deleted_at': MONDAY.isoformat()})
+    rule = store.get_recurring(board['id'], rule_id)
+    occurrences = {task['id']: recurring._occurrence(rule, datetime.date.fromisoformat(task['due_date']), {'u1'})
+                   for task in (first, second)}
+
+    assert store.materialize_recurring(board['id'], occurrences, {}) == []
+
+    assert store.get_task(board['id'], first['id'])['status'] == 'completed'
+    assert store.get_task(board['id'], first['id'])['title'] == 'Standup (done)'
+    assert store.get_task(board['id'], second['id']) is None
@@ -0,0 +1,90 @@
+import pytest
+
+import search
+from conftest import add_task
+
+
+def _add(store, board_id, title, description=''):
+    task = {'title': title, 'description': description}
+    task_id = add_task(store, board_id, title, description=description)
+    search.index_task(store, board_id, task_id, None, task)
+    return task_id
+
+
+def test_tokens_weigh_titles_over_descriptions():
+    assert search.tokenize('Fix the CI, a b') == ['fix', 'the', 'ci']
+    assert search.task_tokens({'title': 'Deploy docs', 'description': 'deploy to prod'}) == {
+        'deploy': 4, 'docs': 3, 'to': 1, 'prod': 1}
+
+
+def test_postings_page_with_the_same_limit_on_every_backend(store, board):
+    for index in range(7):
+        _add(store, board['id'], f"alpha {index}")
+
+    pages, cursor = [], None
+    while True:
+        postings, cursor = store.find_search_postings([board['id']], 'al', 3, cursor)
+        pages.append(len(postings))
+        if cursor is None:
+            break
+
+    assert pages[:3] == [3, 3, 1]
+    assert sum(pages) == 7
+
+
+def test_a_match_past_the_first_page_of_a_common_term_is_found(store, board, monkeypatch):
+    monkeypatch.setattr(search, 'POSTINGS_PAGE_SIZE', 4)
+    for index in range(30):
+        _add(store, board['id'], f"alpha gamma {index:02d}")
+    wanted = _add(store, board['id'], 'alpha beta')
+    for index in range(10):
+        _add(store, board['id'], f"beta delta {index}")
+
+    results = search.search_tasks(store, [board['id']], 'al be')
+
+    assert [task['id'] for task in results] == [wanted]
+
+
+def test_results_are_ranked_by_weight_and_exact_match(store, board):
+    in_title = _add(store, board['id'], 'Release notes')
+    in_description = _add(store, board['id'], 'Chores', 'write the release notes')
+    prefix_only = _add(store, board['id'], 'Releases page')
+
+    results = search.search_tasks(store, [board['id']], 'release')
+
+    assert [task['id'] for task in results] == [in_title, prefix_only, in_description]
+
+
+def test_edits_move_a_task_between_terms(store, board):
+    task_id = _add(store, board['id'], 'Old name')
+    search.index_task(store, board['id'], task_id, {'title': 'Old name'}, {'title': 'New name'})
+
+    assert search.search_tasks(store, [board['id']], 'old') == []
+    assert [task['id'] for task in search.search_tasks(store, [board['id']], 'new')] == [task_id]
+
+
+def test_rebuild_indexes_every_task_in_pages(store, board, monkeypatch, capsys):
+    monkeypatch.setattr(search, 'REBUILD_PAGE_SIZE', 2)
+    task_ids = [add_task(store, board['id'], f"Rebuilt {index}") for index in range(5)]
+
+    assert search.rebuild(store) == (1, 5)
+
+    assert sorted(task['id'] for task in search.search_tasks(store, [board['id']], 'rebuilt')) == sorted(task_ids)
+
+
+def test_search_only_covers_the_users_boards(client, app):
+    client.post('/create-board', data={'title': 'Mine'})
+    board_id = app.store.list_member_boards('u1')[0]['id']
+    client.post(f'/board/{board_id}/create-task', data={'title': 'Searchable thing'})
+    other = app.store.create_board({'title': 'Other', 'members': ['u2']})
+    _add(app.store, other, 'Searchable secret')
+
+    results = client.get('/api/search', params={'q': 'searchable'}).json()['results']
+
+    assert [task['title'] for task in results] == ['Searchable thing']
+
+
+@pytest.mark.parametrize('query', ['', 'a', '!!'])
+def test_queries_without_terms_match_nothing(store, board, query):
+    _add(store, board['id'], 'Anything')
+    assert search.search_tasks(store, [board['id']], query) == []
@@ -0,0 +1,75 @@
+import time
+
+import serve
+import sharedcache
+
+
+def test_local_entries_expire_and_the_oldest_is_evicted():
+    cache = sharedcache.LocalCache(2)
+    later = time.time() + 60
+    cache.set('a', 1, later)
+    cache.set('b', 2, later)
+    cache.set('c', 3, later)
+    cache.set('gone', 4, time.time() - 1)
+
+    assert (cache.get('a'), cache.get('b'), cache.get('c'), cache.get('gone')) == (None, None, 3, None)
+
+
+def test_a_value_cached_by_one_worker_is_a_hit_for_another(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    first = sharedcache.TieredCache(sharedcache.LocalCache(10), sharedcache.SQLiteCache(path, 'tokens'))
+    second = sharedcache.TieredCache(sharedcache.LocalCache(10), sharedcache.SQLiteCache(path, 'tokens'))
+    expires_at = time.time() + 60
+
+    first.set('token', {'user_id': 'u1'}, expires_at)
+
+    assert second.get('token') == {'user_id': 'u1'}
+    assert second.local.get('token') == {'user_id': 'u1'}
+
+
+def test_shared_caches_are_kept_apart_by_name_and_expire(tmp_path):
+    path = str(tmp_path / 'cache.db')
+    tokens = sharedcache.SQLiteCache(path, 'tokens')
+    directory = sharedcache.SQLiteCache(path, 'member_directory')
+
+    tokens.set('key', 'token value', time.time() + 60)
+    directory.set('stale', 'old', time.time() - 1)
+
+    assert directory.get('key') is None
+    assert directory.get('stale') is None
+    assert tokens.get('key') == 'token value'
+
+
+def test_caches_are_local_unless_a_shared_path_is_set(tmp_path, monkeypatch):
+    assert isinstance(sharedcache.get_cache('tokens', 10), sharedcache.LocalCache)
+
+    monkeypatch.setattr(sharedcache, 'SHARED_CACHE_PATH', str(tmp_path / 'cache.db'))
+    assert isinstance(sharedcache.get_cache('tokens', 10), sharedcache.TieredCache)
+
+
+def test_several_workers_share_caches_and_rate_limits(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setattr(serve.uvicorn, 'run', lambda app, **options: runs.append(options))
+    # serve.main changes to the app directory, this puts the old one back afterwards
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TASK_RUNTIME_DIR', str(tmp_path))
+    monkeypatch.setenv('TASK_STORAGE', 'sqlite')
+    monkeypatch.delenv('TASK_SHARED_CACHE_PATH', raising=False)
+    monkeypatch.delenv('TASK_RATE_LIMIT_PATH', raising=False)
+
+    serve.main(['--workers', '3'])
+
+    assert runs[0]['workers'] == 3
+    assert serve.os.environ['TASK_SHARED_CACHE_PATH'] == str(tmp_path / 'cache.db')
+    assert serve.os.environ['TASK_RATE_LIMIT_PATH'] == str(tmp_path / 'rate_limits.db')
+
+
+def test_the_memory_backend_runs_one_worker(tmp_path, monkeypatch):
+    runs = []
+    monkeypatch.setattr(serve.uvicorn, 'run', lambda app, **options: runs.append(options))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('TASK_STORAGE', 'memory')
+
+    serve.main(['--workers', '4'])
+
+    assert runs[0]['workers'] == 1
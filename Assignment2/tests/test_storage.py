@@ -0,0 +1,86 @@
+import pytest
+
+import storage
+from conftest import add_task
+
+
+def test_get_storage_builds_the_named_backend(tmp_path, monkeypatch):
+    monkeypatch.setenv('TASK_SQLITE_PATH', str(tmp_path / 'tasks.db'))
+    assert isinstance(storage.get_storage('memory'), storage.MemoryStorage)
+    assert isinstance(storage.get_storage('SQLite'), storage.SQLiteStorage)
+    with pytest.raises(ValueError):
+        storage.get_storage('redis')
+
+
+def test_a_backend_missing_a_method_fails_when_created():
+    class Partial(storage.Storage):
+        def get_user(self, user_id):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_documents_are_copies(store, board):
+    task_id = add_task(store, board['id'], 'Task', assigned_users=['u1'])
+
+    store.get_task(board['id'], task_id)['assigned_users'].append('u2')
+    board['members'].append('u2')
+
+    assert store.get_task(board['id'], task_id)['assigned_users'] == ['u1']
+    assert store.get_board(board['id'])['members'] == ['u1']
+
+
+def test_server_timestamps_are_resolved_on_write(store, board):
+    task = store.get_task(board['id'], add_task(store, board['id'], 'Task'))
+    assert task['created_at'].tzinfo is not None
+
+
+def test_boards_are_listed_for_their_members(store, board):
+    store.add_member(board['id'], 'u2', email='u2@example.com')
+
+    assert [b['id'] for b in store.list_member_boards('u2')] == [board['id']]
+    assert store.get_board(board['id'])['member_emails'] == {'u2': 'u2@example.com'}
+
+    store.remove_member(board['id'], 'u2')
+    assert store.list_member_boards('u2') == []
+    assert store.get_board(board['id'])['member_emails'] == {}
+
+
+def test_list_tasks_projects_the_fields_asked_for(store, board):
+    task_id = add_task(store, board['id'], 'Task', description='Long text')
+
+    assert store.list_tasks(board['id'], ['title']) == [{'id': task_id, 'title': 'Task'}]
+
+
+def test_soft_deleted_documents_are_left_out_of_reads(store, board):
+    task_id = add_task(store, board['id'], 'Deleted')
+    store.update_task(board['id'], task_id, {'deleted_at': storage.SERVER_TIMESTAMP})
+    live_id = add_task(store, board['id'], 'Live')
+
+    assert store.get_task(board['id'], task_id) is None
+    assert store.get_task(board['id'], task_id, include_deleted=True)['title'] == 'Deleted'
+    assert [task['id'] for task in store.list_tasks(board['id'])] == [live_id]
+
+    store.update_board(board['id'], {'deleted_at': storage.SERVER_TIMESTAMP})
+    assert store.get_board(board['id']) is None
+    assert store.list_member_boards('u1') == []
+
+
+def test_tasks_page_by_id_without_gaps(store, board):
+    task_ids = sorted(add_task(store, board['id'], f"Task {index}") for index in range(7))
+    seen, cursor = [], None
+    while True:
+        tasks, cursor = store.list_tasks_page(board['id'], 3, cursor)
+        seen.extend(task['id'] for task in tasks)
+        if cursor is None:
+            break
+
+    assert seen == task_ids
+
+
+def test_sqlite_data_outlives_the_connection(tmp_path):
+    path = str(tmp_path / 'tasks.db')
+    board_id = storage.SQLiteStorage(path).create_board({'title': 'Kept', 'members': ['u1']})
+
+    assert storage.SQLiteStorage(path).get_board(board_id)['title'] == 'Kept'
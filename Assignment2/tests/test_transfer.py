@@ -0,0 +1,102 @@
+import io
+import json
+
+import transfer
+from conftest import add_task
+from storage import SERVER_TIMESTAMP
+
+
+def _jsonl(*rows):
+    return io.StringIO(''.join((row if isinstance(row, str) else json.dumps(row)) + '\n' for row in rows))
+
+
+def _import(store, board, lines, fmt='jsonl', **kwargs):
+    return transfer.import_tasks(store, board, transfer.read_rows(lines, fmt), 'u1', **kwargs)
+
+
+def test_import_skips_titles_already_on_the_board_or_earlier_in_the_file(store, board):
+    add_task(store, board['id'], 'Existing')
+
+    result = _import(store, board, _jsonl({'title': 'Existing'}, {'title': 'New'}, {'title': ' New '}, {'title': 'Other'}))
+
+    assert result == {'imported': 2, 'duplicates': 2, 'errors': []}
+    assert sorted(task['title'] for task in store.list_tasks(board['id'])) == ['Existing', 'New', 'Other']
+
+
+def test_import_finds_duplicates_per_batch_without_reading_the_board(store, board, monkeypatch):
+    add_task(store, board['id'], 'Existing', rank='1')
+    monkeypatch.setattr(store, 'list_tasks_page', None)
+    rows = [{'title': 'One'}, {'title': 'Two'}, {'title': 'One'}, {'title': 'Existing'}, {'title': 'Three'}]
+
+    result = _import(store, board, _jsonl(*rows), batch_size=2)
+
+    assert result == {'imported': 3, 'duplicates': 2, 'errors': []}
+    titles = [task['title'] for task in store.list_tasks(board['id'], by_rank=True)]
+    assert titles == ['Existing', 'One', 'Two', 'Three']
+
+
+def test_deleted_tasks_do_not_count_as_duplicates(store, board):
+    task_id = add_task(store, board['id'], 'Gone')
+    store.update_task(board['id'], task_id, {'deleted_at': SERVER_TIMESTAMP})
+
+    assert store.find_task_titles(board['id'], ['Gone', 'Missing']) == set()
+    assert _import(store, board, _jsonl({'title': 'Gone'}))['imported'] == 1
+
+
+def test_import_reports_invalid_rows_by_line_and_keeps_the_rest(store, board):
+    lines = _jsonl(
+        {'title': 'Good'},
+        'not json',
+        {'description': 'no title'},
+        {'title': 'Bad status', 'status': 'archived'},
+        {'title': 'Bad date', 'due_date': '2026-13-01'},
+        {'title': 'Bad assignees', 'assigned_users': 'u1'},
+        '[1, 2]',
+        {'title': 'Also good', 'status': 'completed', 'completed_at': '2026-01-02T03:04:05'},
+    )
+
+    result = _import(store, board, lines)
+
+    assert result['imported'] == 2
+    assert [error['line'] for error in result['errors']] == [2, 3, 4, 5, 6, 7]
+    assert result['errors'][1]['error'] == 'missing title'
+    board = store.get_board(board['id'])
+    assert (board['task_count'], board['completed_count']) == (2, 1)
+
+
+def test_import_caps_the_errors_reported(store, board):
+    result = _import(store, board, _jsonl(*['{}'] * (transfer.MAX_REPORTED_ERRORS + 5)))
+
+    assert result['imported'] == 0
+    assert len(result['errors']) == transfer.MAX_REPORTED_ERRORS
+
+
+def test_import_appends_in_file_order_across_batches(store, board):
+    add_task(store, board['id'], 'First', rank='1')
+
+    result = _import(store, board, _jsonl(*({'title': f"Task {index}"} for index in range(7))), batch_size=3)
+
+    assert result['imported'] == 7
+    titles = [task['title'] for task in store.list_tasks(board['id'], by_rank=True)]
+    assert titles == ['First'] + [f"Task {index}" for index in range(7)]
+
+
+def test_csv_import_drops_assignees_who_are_not_members(store, board):
+    lines = io.StringIO('title,assigned_users\nShared,u1;stranger\n')
+
+    assert _import(store, board, lines, fmt='csv')['imported'] == 1
+    assert store.list_tasks(board['id'])[0]['assigned_users'] == ['u1']
+
+
+def test_export_then_import_round_trips(store, board):
+    add_task(store, board['id'], 'One', rank='1', due_date='2026-11-01')
+    add_task(store, board['id'], 'Two', rank='2', assigned_users=['u1'])
+    exported = ''.join(transfer.export_tasks(store, board['id'], 'jsonl', page_size=1))
+
+    other_id = store.create_board({'title': 'Other', 'creator_id': 'u1', 'members': ['u1'], 'ranked': True})
+    other = store.get_board(other_id)
+    assert _import(store, other, io.StringIO(exported))['imported'] == 2
+
+    tasks = store.list_tasks(other_id, by_rank=True)
+    assert [(task['title'], task['due_date'], task['assigned_users']) for task in tasks] == [
+        ('One', '2026-11-01', []), ('Two', None, ['u1'])]
@@ -0,0 +1,111 @@
+import pytest
+
+from storage import SQLiteStorage, VersionConflict
+from writebehind import WriteBehind
+
+
+def _queue(flush_fn, **kwargs):
+    # the background thread never gets to flush, the tests do it themselves
+    return WriteBehind('test', flush_fn, interval=3600, **kwargs)
+
+
+def test_updates_to_a_document_are_merged_into_one_write():
+    writes = []
+    queue = _queue(lambda key, fields: writes.append((key, fields)))
+
+    queue.defer('b1', {'u1': 'u1@example.com'})
+    queue.defer('b1', {'u2': 'u2@example.com'})
+    queue.defer('b2', {'u3': 'u3@example.com'})
+    queue.flush()
+
+    assert writes == [('b1', {'u1': 'u1@example.com', 'u2': 'u2@example.com'}), ('b2', {'u3': 'u3@example.com'})]
+
+
+def test_a_full_queue_drops_new_documents():
+    queue = _queue(lambda key, fields: None, max_pending=1)
+
+    assert queue.defer('b1', {'u1': 'a'})
+    assert queue.defer('b1', {'u2': 'b'})
+    assert not queue.defer('b2', {'u3': 'c'})
+
+
+def test_failed_writes_are_retried_then_given_up_on():
+    attempts = []
+
+    def flaky(key, fields):
+        attempts.append(dict(fields))
+        raise RuntimeError('backend down')
+
+    queue = _queue(flaky, max_attempts=2)
+    queue.defer('b1', {'u1': 'old'})
+    queue.flush()
+    queue.defer('b1', {'u1': 'new'})
+    queue.flush()
+    queue.flush()
+
+    assert attempts == [{'u1': 'old'}, {'u1': 'new'}]
+
+
+def test_backfilled_emails_only_go_to_current_members(store, board):
+    queue = _queue(store.set_member_emails)
+    queue.defer(board['id'], {'u1': 'u1@example.com', 'gone': 'gone@example.com'})
+    queue.flush()
+
+    assert store.get_board(board['id'])['member_emails'] == {'u1': 'u1@example.com'}
+
+
+@pytest.fixture
+def workers(tmp_path):
+    """Two backends on one database file, as serve.py's worker processes have."""
+    path = str(tmp_path / 'tasks.db')
+    return SQLiteStorage(path), SQLiteStorage(path)
+
+
+def _write_after_first_read(worker, write):
+    # the other worker's write lands between this worker's read and its write
+    query = worker._query
+
+    def interleaved(sql, params=()):
+        rows = query(sql, params)
+        if write:
+            write.pop()()
+        return rows
+
+    worker._query = interleaved
+
+
+def test_a_stale_version_from_another_worker_is_refused(workers):
+    first, second = workers
+    board_id = first.create_board({'title': 'Board', 'members': ['u1']})
+    version = second.get_board(board_id, with_version=True)['version']
+    _write_after_first_read(second, [lambda: first.update_board(board_id, {'title': 'First'})])
+
+    with pytest.raises(VersionConflict):
+        second.update_board(board_id, {'title': 'Second'}, version=version)
+    assert first.get_board(board_id)['title'] == 'First'
+
+
+def test_unversioned_writes_from_two_workers_both_land(workers):
+    first, second = workers
+    board_id = first.create_board({'title': 'Board', 'members': ['u1'], 'task_count': 0})
+    _write_after_first_read(second, [lambda: first.increment_task_counts(board_id, {'task_count': 1})])
+
+    second.add_member(board_id, 'u2')
+
+    board = first.get_board(board_id)
+    assert (board['members'], board['task_count']) == (['u1', 'u2'], 1)
+
+
+def test_task_edits_from_two_workers_do_not_overwrite_each_other(workers):
+    first, second = workers
+    board_id = first.create_board({'title': 'Board', 'members': ['u1']})
+    task_id = first.create_task(board_id, {'title': 'Task', 'status': 'pending'})
+    version = second.get_task(board_id, task_id, with_version=True)['version']
+    _write_after_first_read(second, [lambda: first.update_task(board_id, task_id, {'status': 'completed'})])
+
+    with pytest.raises(VersionConflict):
+        second.update_task(board_id, task_id, {'title': 'Renamed'}, version=version)
+    second.update_task(board_id, task_id, {'title': 'Renamed'})
+
+    assert first.get_task(board_id, task_id)['status'] == 'completed'
+    assert first.get_task(board_id, task_id)['title'] == 'Renamed'
@@ -0,0 +1,235 @@
+"""Board export and bulk import as JSON Lines or CSV.
+
+Exports page through a board's tasks and are written out one page at a time,
+so memory stays flat however big the board is. Imports read the upload one
+row at a time and create tasks in batches instead of one request per task.
+Rows whose title is already on the board, or earlier in the file, are
+skipped: each batch looks its titles up on the board before it is written,
+so the board is never read in full.
+Both also run from the command line for migrations:
+
+    python transfer.py export BOARD_ID --format csv > tasks.csv
+    python transfer.py import BOARD_ID tasks.jsonl --creator USER_ID
+"""
+import argparse
+import csv
+import datetime
+import io
+import json
+import sys
+
+import activity
+import dashboard
+import ranking
+import search
+from storage import SERVER_TIMESTAMP
+
+
+FORMATS = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+FIELDS = ['id', 'title', 'description', 'status', 'due_date', 'assigned_users', 'created_at', 'completed_at']
+
+EXPORT_PAGE_SIZE = 500
+IMPORT_BATCH_SIZE = 400
+MAX_REPORTED_ERRORS = 100
+
+
+def format_for(filename, default='jsonl'):
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    if filename and filename.lower().endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return default
+
+
+def iter_tasks(store, board_id, page_size=EXPORT_PAGE_SIZE, by_rank=False):
+    cursor = None
+    while True:
+        tasks, cursor = store.list_tasks_page(board_id, page_size, cursor, by_rank)
+        yield tasks
+        if cursor is None:
+            return
+
+
+def _export_record(task):
+    record = {}
+    for field in FIELDS:
+        value = task.get(field)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        record[field] = value
+    record['assigned_users'] = record['assigned_users'] or []
+    return record
+
+
+def export_tasks(store, board_id, fmt, page_size=EXPORT_PAGE_SIZE, by_rank=True):
+    """Yield the board's tasks as text, one chunk per page.
+
+    Tasks come in board order when ``by_rank``, which needs a ranked board
+    (see ranking.ensure_ranked), and in id order otherwise.
+    """
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, FIELDS)
+        writer.writeheader()
+        for tasks in iter_tasks(store, board_id, page_size, by_rank=by_rank):
+            for task in tasks:
+                record = _export_record(task)
+                record['assigned_users'] = ';'.join(record['assigned_users'])
+                writer.writerow(record)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    else:
+        for tasks in iter_tasks(store, board_id, page_size, by_rank=by_rank):
+            yield ''.join(json.dumps(_export_record(task)) + '\n' for task in tasks)
+
+
+def read_rows(lines, fmt):
+    """Yield ``(line_number, row)`` from an iterable of text lines.
+
+    ``row`` is None for JSON lines that can't be parsed into an object.
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            if row.get('assigned_users') is not None:
+                row['assigned_users'] = [user for user in row['assigned_users'].split(';') if user]
+            yield reader.line_num, row
+    else:
+        for line_number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield line_number, row if isinstance(row, dict) else None
+
+
+def _parse_datetime(value):
+    parsed = datetime.datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=datetime.timezone.utc)
+    return parsed
+
+
+def task_from_row(row, creator_id, members):
+    """The task document for an imported row, raises ValueError when it is invalid."""
+    if row is None:
+        raise ValueError("not a JSON object")
+    title = (row.get('title') or '').strip()
+    if not title:
+        raise ValueError("missing title")
+
+    status = row.get('status') or 'pending'
+    if status not in ('pending', 'completed'):
+        raise ValueError(f"unknown status {status!r}")
+
+    due_date = row.get('due_date') or None
+    if due_date is not None:
+        datetime.date.fromisoformat(due_date)
+
+    completed_at = None
+    if status == 'completed':
+        completed_at = _parse_datetime(row['completed_at']) if row.get('completed_at') else SERVER_TIMESTAMP
+
+    assigned_users = row.get('assigned_users') or []
+    if not isinstance(assigned_users, list):
+        raise ValueError("assigned_users must be a list")
+
+    return {
+        'title': title,
+        'description': row.get('description') or '',
+        'creator_id': creator_id,
+        # assignees who aren't on the board are dropped like removed members are
+        'assigned_users': [user for user in assigned_users if user in members],
+        'status': status,
+        'created_at': SERVER_TIMESTAMP,
+        'due_date': due_date,
+        'completed_at': completed_at
+    }
+
+
+def import_tasks(store, board, rows, creator_id, batch_size=IMPORT_BATCH_SIZE):
+    """Create tasks from ``(line_number, row)`` pairs, returns a summary of what happened."""
+    board_id = board['id']
+    # imported tasks go to the bottom of the board in file order, unranked
+    # boards are left for ranking.py to rank
+    ranked = bool(board.get('ranked'))
+    rank = store.find_last_rank(board_id) if ranked else None
+    members = set(board.get('members', []))
+    result = {'imported': 0, 'duplicates': 0, 'errors': []}
+    batch = []
+    # titles in the batch being filled, those of earlier batches are on the board by now
+    titles = set()
+
+    def flush():
+        nonlocal rank
+        existing = store.find_task_titles(board_id, list(titles))
+        titles.clear()
+        if existing:
+            result['duplicates'] += sum(1 for task in batch if task['title'] in existing)
+            batch[:] = [task for task in batch if task['title'] not in existing]
+            if not batch:
+                return
+        ranks = ranking.keys_after(rank, len(batch)) if ranked else [None] * len(batch)
+        for task, task_rank in zip(batch, ranks):
+            task['rank'] = task_rank
+        rank = batch[-1]['rank']
+        task_ids = store.create_tasks(board_id, batch,
+                                      activity.event(activity.TASKS_IMPORTED, creator_id, count=len(batch)))
+        search.index_new_tasks(store, board_id, zip(task_ids, batch))
+        completed = sum(1 for task in batch if task['status'] == 'completed')
+        dashboard.tasks_changed(store, board, total=len(batch), completed=completed)
+        result['imported'] += len(batch)
+        batch.clear()
+
+    for line_number, row in rows:
+        try:
+            task = task_from_row(row, creator_id, members)
+        except (KeyError, TypeError, ValueError) as err:
+            if len(result['errors']) < MAX_REPORTED_ERRORS:
+                result['errors'].append({'line': line_number, 'error': str(err)})
+            continue
+        if task['title'] in titles:
+            result['duplicates'] += 1
+            continue
+        titles.add(task['title'])
+        batch.append(task)
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+    if rank is not None and ranking.needs_rebalance(rank):
+        ranking.rebalance_board(store, board_id)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Export or bulk import a board's tasks")
+    subcommands = parser.add_subparsers(dest='command', required=True)
+    export_parser = subcommands.add_parser('export')
+    export_parser.add_argument('board_id')
+    export_parser.add_argument('--format', choices=sorted(FORMATS), default='jsonl')
+    import_parser = subcommands.add_parser('import')
+    import_parser.add_argument('board_id')
+    import_parser.add_argument('path')
+    import_parser.add_argument('--creator', required=True, help="user id recorded as the tasks' creator")
+    import_parser.add_argument('--format', choices=sorted(FORMATS))
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from storage import get_storage
+    store = get_storage()
+    board = store.get_board(args.board_id)
+    if board is None:
+        sys.exit(f"No board {args.board_id}")
+
+    if args.command == 'export':
+        ranking.ensure_ranked(store, board)
+        for chunk in export_tasks(store, args.board_id, args.format):
+            sys.stdout.write(chunk)
+    else:
+        fmt = args.format or format_for(args.path)
+        with open(args.path, encoding='utf-8-sig', newline='') as f:
+            print(json.dumps(import_tasks(store, board, read_rows(f, fmt), args.creator, args.batch_size)))
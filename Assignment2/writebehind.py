@@ -0,0 +1,90 @@
+"""Write-behind queue for opportunistic cache fills.
+
+Pages sometimes work out something worth remembering, like a member's email
+missing from an older board's ``member_emails``. Rather than writing it
+while the user waits, the update is queued per document; updates to the
+same document are merged and a background thread writes each document once
+per flush interval. The queue is bounded and a failed write is retried a
+few times before being given up on, since the value can always be worked
+out again on a later request.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+
+import metrics
+
+
+logger = logging.getLogger(__name__)
+
+MAX_PENDING = int(os.environ.get('TASK_WRITE_BEHIND_MAX_PENDING', '10000'))
+FLUSH_INTERVAL = float(os.environ.get('TASK_WRITE_BEHIND_INTERVAL_MS', '500')) / 1000
+MAX_ATTEMPTS = 3
+
+
+class WriteBehind:
+    """Coalesces ``{field: value}`` updates per document key and writes them with ``flush_fn(key, fields)``."""
+
+    def __init__(self, name, flush_fn, max_pending=MAX_PENDING, interval=FLUSH_INTERVAL, max_attempts=MAX_ATTEMPTS):
+        self.name = name
+        self.flush_fn = flush_fn
+        self.max_pending = max_pending
+        self.interval = interval
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._thread = None
+        self._pending_gauge = metrics.WRITE_BEHIND_PENDING.labels(name)
+
+    def _count(self, result, amount=1):
+        metrics.WRITE_BEHIND_UPDATES.labels(self.name, result).inc(amount)
+
+    def defer(self, key, fields):
+        """Queue ``fields`` for the document, returns False when the queue is full."""
+        with self._lock:
+            entry = self._pending.get(key)
+            if entry is None:
+                if len(self._pending) >= self.max_pending:
+                    self._count('dropped')
+                    return False
+                entry = self._pending[key] = [{}, 0]
+            entry[0].update(fields)
+            self._pending_gauge.set(len(self._pending))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=f'write-behind-{self.name}', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+        self._count('queued')
+        return True
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            self._pending_gauge.set(0)
+
+        for key, (fields, attempts) in batch.items():
+            try:
+                self.flush_fn(key, fields)
+            except Exception:
+                attempts += 1
+                if attempts >= self.max_attempts:
+                    logger.exception("Giving up on deferred update", extra={'queue': self.name, 'key': key})
+                    self._count('failed')
+                    continue
+                logger.warning("Deferred update failed, will retry", extra={'queue': self.name, 'key': key})
+                self._count('retried')
+                with self._lock:
+                    entry = self._pending.setdefault(key, [{}, 0])
+                    # anything queued since the batch was taken is newer and wins
+                    entry[0] = {**fields, **entry[0]}
+                    entry[1] = max(entry[1], attempts)
+                    self._pending_gauge.set(len(self._pending))
+            else:
+                self._count('flushed')